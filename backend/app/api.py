@@ -1,16 +1,63 @@
+import asyncio
+import json
 import logging
-from fastapi import FastAPI
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Any, Dict, Iterator, List, Literal
+
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from app.tools.sql_tool import run_sql
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import psycopg
+from pydantic import BaseModel, Field, model_validator
+from app.tools.async_sql_tool import (
+    QueryCapacityError,
+    close_async_pool,
+    get_async_pool_stats,
+    run_sql_async,
+    stream_sql_async,
+)
+from app.tools.columnar_engine import columnar_engine_enabled, get_columnar_engine
+from app.tools.metrics import PROMETHEUS_CONTENT_TYPE, Sample, get_metrics_registry
+from app.tools.result_cache import get_result_cache
+from app.tools.sql_tool import get_pool_stats
+from app.tools.slow_query_log import WORST_FINGERPRINTS_SQL, close_slow_query_log, get_slow_query_log
+from app.tools.serialization import ARROW_STREAM_MEDIA_TYPE, columns_to_arrow_ipc, rows_to_ndjson
+from app.tools.change_points import DEFAULT_MAX_MEMBERS, MAX_MEMBERS, MAX_WINDOW_DAYS, run_change_point_scan
+from app.tools.drilldown import DEFAULT_PATH, run_drilldown
+from app.tools.kpi_prefix import MAX_WINDOWS, run_kpi_windows
+from app.tools.template_registry import get_template_registry
+from app.tools.trace_writer import close_trace_writer, current_run_id, get_trace_writer, trace_run
+from app.tools.window_cube import run_window_comparison
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
+logger = logging.getLogger(__name__)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load and validate all SQL templates once (invalid files are logged and skipped)
+    get_template_registry()
+    # Start the background agent trace writer (None when TRACE_ENABLED is off)
+    get_trace_writer()
+    # Load the columnar engine's facts in the background so the first request need not wait
+    warmup = asyncio.create_task(get_columnar_engine().warm()) if columnar_engine_enabled() else None
+    yield
+    if warmup is not None:
+        warmup.cancel()
+    await close_async_pool()
+    # Flush queued traces and plan captures before the process exits
+    close_trace_writer()
+    close_slow_query_log()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -21,16 +68,212 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+ResponseFormat = Literal["rows", "columns", "arrow"]
+
 class QueryRequest(BaseModel):
     sql: str
     params: dict | None = None
     timeout_seconds: float | None = None
+    use_cache: bool = True
+    format: ResponseFormat | None = None
+
+class StreamQueryRequest(BaseModel):
+    sql: str
+    params: dict | None = None
+    timeout_seconds: float | None = None
+    batch_size: int = Field(default=1000, ge=1)
+    max_rows: int | None = Field(default=None, ge=1)
+
+class TemplateRequest(BaseModel):
+    params: dict | None = None
+    timeout_seconds: float | None = None
+    use_cache: bool = True
+    format: ResponseFormat | None = None
+
+class BatchItem(BaseModel):
+    id: str | None = None
+    template: str | None = None
+    sql: str | None = None
+    params: dict | None = None
+    timeout_seconds: float | None = None
+    use_cache: bool = True
+    format: Literal["rows", "columns"] = "rows"
+
+    @model_validator(mode="after")
+    def _one_source(self):
+        if (self.template is None) == (self.sql is None):
+            raise ValueError("Each batch item needs exactly one of 'template' or 'sql'.")
+        return self
+
+class BatchQueryRequest(BaseModel):
+    items: List[BatchItem] = Field(min_length=1, max_length=32)
+
+class WindowComparisonRequest(BaseModel):
+    params: dict
+    top_n: int = Field(default=10, ge=1)
+    dimension: Literal["country", "stock_code", "customer_id"] | None = None
+    timeout_seconds: float | None = None
+    use_cache: bool = True
+    engine: Literal["sql", "columnar"] = "sql"
+
+class DrillDownRequest(BaseModel):
+    params: dict
+    path: List[Literal["country", "stock_code", "customer_id"]] = list(DEFAULT_PATH)
+    metric: Literal["revenue", "units"] = "revenue"
+    top_n: int = Field(default=5, ge=1, le=100)
+    expand_n: int = Field(default=3, ge=0, le=20)
+    timeout_seconds: float | None = None
+    use_cache: bool = True
+
+class ChangePointRequest(BaseModel):
+    kpi: Literal["revenue", "units", "aov"] = "revenue"
+    window_days: int = Field(ge=1, le=MAX_WINDOW_DAYS)
+    start_date: date
+    end_date: date
+    step_days: int = Field(default=1, ge=1)
+    dimension: Literal["country", "stock_code"] | None = None
+    max_members: int = Field(default=DEFAULT_MAX_MEMBERS, ge=1, le=MAX_MEMBERS)
+    top_n: int = Field(default=10, ge=1, le=100)
+    timeout_seconds: float | None = None
+    use_cache: bool = True
+
+class KpiWindowsRequest(BaseModel):
+    windows: List[dict] = Field(min_length=1, max_length=MAX_WINDOWS)
+    country: str | None = None
+    timeout_seconds: float | None = None
+    use_cache: bool = True
+
+
+def _resource_samples() -> Iterator[Sample]:
+    """Pool and result cache gauges, sampled when /metrics is scraped."""
+    pools = {"async": get_async_pool_stats(), "sync": get_pool_stats()}
+    pools = {name: stats for name, stats in pools.items() if stats is not None}
+    yield (
+        "db_pool_connections", "gauge", "Pooled connections by state.", ("pool", "state"),
+        {(name, state): stats[state] for name, stats in pools.items() for state in ("in_use", "idle")},
+    )
+    yield (
+        "db_pool_max_connections", "gauge", "Configured pool size limit.", ("pool",),
+        {(name,): stats["max_size"] for name, stats in pools.items()},
+    )
+    yield (
+        "db_pool_waiting", "gauge", "Callers waiting for a pooled connection.", ("pool",),
+        {(name,): stats["waiting"] for name, stats in pools.items()},
+    )
+    yield (
+        "db_pool_wait_seconds_total", "counter", "Time spent waiting for pooled connections.", ("pool",),
+        {(name,): stats["wait_ms_total"] / 1000 for name, stats in pools.items()},
+    )
+    yield (
+        "db_pool_timeouts_total", "counter", "Connection requests that timed out.", ("pool",),
+        {(name,): stats["timeouts_total"] for name, stats in pools.items()},
+    )
+
+    writer = get_trace_writer()
+    if writer is not None:
+        traces = writer.stats()
+        yield ("trace_queue_depth", "gauge", "Agent trace records waiting to be written.", (), {(): traces["queue_depth"]})
+        yield (
+            "trace_records_total", "counter", "Agent trace records by outcome.", ("outcome",),
+            {(outcome,): traces[outcome] for outcome in ("written", "dropped", "failed")},
+        )
+
+    cache = get_result_cache().stats()
+    yield ("result_cache_hits_total", "counter", "Result cache hits.", (), {(): cache["hits"]})
+    yield ("result_cache_misses_total", "counter", "Result cache misses.", (), {(): cache["misses"]})
+    yield ("result_cache_bytes", "gauge", "Estimated bytes held by the result cache.", (), {(): cache["bytes"]})
+
+
+get_metrics_registry().add_collector(_resource_samples)
+
+
+def _negotiate_format(requested: str | None, request: Request) -> str:
+    """Pick the response format from the body field, falling back to the Accept header."""
+    if requested is not None:
+        return requested
+    if ARROW_STREAM_MEDIA_TYPE in request.headers.get("accept", ""):
+        return "arrow"
+    return "rows"
+
+
+def _format_response(result: Dict[str, Any], response_format: str) -> Any:
+    """Return JSON as-is, or encode a columnar result as an Arrow IPC stream."""
+    if response_format != "arrow":
+        return result
+
+    try:
+        content = columns_to_arrow_ipc(result["columns"], result["arrays"])
+    except RuntimeError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+    headers = {
+        "X-Query-Hash": result["query_hash"],
+        "X-Row-Count": str(result["row_count"]),
+        "X-Duration-Ms": str(result["duration_ms"]),
+        "X-Cache": result["cache"],
+    }
+    if "template" in result:
+        headers["X-Template"] = result["template"]
+    return Response(content=content, media_type=ARROW_STREAM_MEDIA_TYPE, headers=headers)
+
+
+@app.middleware("http")
+async def trace_agent_runs(request: Request, call_next):
+    """Record each POST as an agent run so the queries it makes are traced as tool calls.
+
+    Agents pass their own run id in X-Agent-Run-Id to group calls under one
+    run; otherwise every request becomes a run of its own. Traces are queued
+    for the background writer, never written on the request path.
+    """
+    if request.method != "POST" or get_trace_writer() is None:
+        return await call_next(request)
+
+    run_id = request.headers.get("x-agent-run-id")
+    owns_run = run_id is None
+    if owns_run:
+        run_id = str(uuid.uuid4())
+        trace_run(run_id, inputs={"method": request.method, "path": request.url.path})
+    else:
+        try:
+            run_id = str(uuid.UUID(run_id))
+        except ValueError:
+            return JSONResponse(status_code=422, content={"detail": "X-Agent-Run-Id must be a UUID."})
+
+    token = current_run_id.set(run_id)
+    t0 = time.time()
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        if owns_run:
+            trace_run(run_id, status="failed", duration_ms=int((time.time() - t0) * 1000), error=str(e))
+        raise
+    finally:
+        current_run_id.reset(token)
+
+    if owns_run:
+        trace_run(
+            run_id,
+            status="completed" if response.status_code < 400 else "failed",
+            result={"status_code": response.status_code},
+            duration_ms=int((time.time() - t0) * 1000),
+        )
+    response.headers["X-Agent-Run-Id"] = run_id
+    return response
+
+@app.exception_handler(QueryCapacityError)
+async def query_capacity_handler(request: Request, exc: QueryCapacityError):
+    """Push back with 503 instead of queueing more work than the pool can serve."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"},
+    )
 
 @app.get("/health/db")
-def health_db():
+async def health_db():
     """Test database connection"""
     try:
-        result = run_sql("SELECT 1 as test", {})
+        result = await run_sql_async("SELECT 1 as test", {}, use_cache=False)
         return {
             "ok": True,
             "database": "connected",
@@ -44,10 +287,266 @@ def health_db():
         }
 
 @app.post("/query")
-def query(req: QueryRequest):
-    """Execute a read-only SQL query with connection pooling, timeout, and logging."""
-    return run_sql(
-        req.sql, 
+async def query(req: QueryRequest, request: Request):
+    """Execute a read-only SQL query with connection pooling, timeout, and logging.
+
+    Results come back as row dicts by default. Set "format" to "columns" for
+    column arrays or "arrow" (or send Accept: application/vnd.apache.arrow.stream)
+    for an Arrow IPC stream.
+    """
+    response_format = _negotiate_format(req.format, request)
+    result = await run_sql_async(
+        req.sql,
         req.params or {},
-        timeout_seconds=req.timeout_seconds
-    )
\ No newline at end of file
+        timeout_seconds=req.timeout_seconds,
+        use_cache=req.use_cache,
+        row_format="rows" if response_format == "rows" else "columns",
+    )
+    return _format_response(result, response_format)
+
+@app.post("/query/stream")
+async def query_stream(req: StreamQueryRequest):
+    """Stream a read-only query as NDJSON (one JSON object per row) as batches arrive."""
+    batches = stream_sql_async(
+        req.sql,
+        req.params or {},
+        batch_size=req.batch_size,
+        max_rows=req.max_rows,
+        timeout_seconds=req.timeout_seconds,
+    )
+
+    # Fetch the first batch before responding so guard, capacity and SQL
+    # errors still surface as a normal error status
+    try:
+        first_batch = await batches.__anext__()
+    except StopAsyncIteration:
+        first_batch = []
+
+    async def body():
+        try:
+            if first_batch:
+                yield rows_to_ndjson(first_batch)
+            async for batch in batches:
+                yield rows_to_ndjson(batch)
+        except Exception as e:
+            # Headers are already sent; report the failure as a final line
+            yield json.dumps({"error": str(e)}).encode() + b"\n"
+        finally:
+            # A client that disconnects mid-stream leaves the generator
+            # suspended; close it so the cursor and pooled connection are
+            # released now rather than at garbage collection
+            await batches.aclose()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@app.get("/templates")
+def list_templates():
+    """List the preloaded SQL templates and their typed parameters."""
+    return [template.describe() for template in get_template_registry()]
+
+@app.post("/templates/{name}")
+async def run_template(name: str, req: TemplateRequest, request: Request):
+    """Run a preloaded SQL template as a prepared statement with validated parameters."""
+    try:
+        template = get_template_registry().get(name)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+    try:
+        params = template.bind(req.params)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    response_format = _negotiate_format(req.format, request)
+    result = await run_sql_async(
+        template.sql,
+        params,
+        timeout_seconds=req.timeout_seconds,
+        use_cache=req.use_cache,
+        prepare=True,
+        row_format="rows" if response_format == "rows" else "columns",
+        name=template.name,
+    )
+    return _format_response({**result, "template": template.name}, response_format)
+
+async def _run_batch_item(index: int, item: BatchItem) -> Dict[str, Any]:
+    """Run one batch item, turning its failure into a per-item error entry."""
+    entry: Dict[str, Any] = {"id": item.id if item.id is not None else str(index)}
+    try:
+        if item.template is not None:
+            template = get_template_registry().get(item.template)
+            sql, params, prepare = template.sql, template.bind(item.params), True
+            entry["template"] = name = template.name
+        else:
+            sql, params, prepare, name = item.sql, item.params or {}, False, None
+
+        result = await run_sql_async(
+            sql,
+            params,
+            timeout_seconds=item.timeout_seconds,
+            use_cache=item.use_cache,
+            prepare=prepare,
+            row_format=item.format,
+            name=name,
+        )
+        return {**entry, "ok": True, **result}
+    except KeyError as e:
+        error_type, message = "not_found", str(e.args[0])
+    except ValueError as e:
+        error_type, message = "invalid", str(e)
+    except QueryCapacityError as e:
+        error_type, message = "capacity", str(e)
+    except psycopg.errors.QueryCanceled as e:
+        error_type, message = "timeout", str(e)
+    except Exception as e:
+        error_type, message = "error", str(e)
+    return {**entry, "ok": False, "error_type": error_type, "error": message}
+
+@app.post("/query/batch")
+async def query_batch(req: BatchQueryRequest):
+    """Run several templates and/or SQL queries concurrently.
+
+    Each item runs on its own pooled connection with its own statement
+    timeout, so the batch takes as long as its slowest item. One item
+    failing does not affect the others; results come back in request order.
+    """
+    t0 = time.time()
+    results = await asyncio.gather(*(_run_batch_item(i, item) for i, item in enumerate(req.items)))
+    elapsed_ms = int((time.time() - t0) * 1000)
+    failed = sum(1 for r in results if not r["ok"])
+
+    logger.info(f"Batch executed | items={len(results)} | failed={failed} | duration_ms={elapsed_ms}")
+
+    return {
+        "duration_ms": elapsed_ms,
+        "item_count": len(results),
+        "failed_count": failed,
+        "items": results,
+    }
+
+@app.post("/analysis/window-comparison")
+async def window_comparison(req: WindowComparisonRequest):
+    """KPI delta, top contributors, mix shift and price/volume from one scan.
+
+    Each section has the same rows as the corresponding template
+    (kpi_trend_window_comparison, top_contributors, mix_shift_by_dimension,
+    price_volume_decomposition) for the same window params. engine="columnar"
+    computes the cube from in-memory column arrays instead of Postgres.
+    """
+    try:
+        return await run_window_comparison(
+            req.params,
+            top_n=req.top_n,
+            dimension=req.dimension,
+            timeout_seconds=req.timeout_seconds,
+            use_cache=req.use_cache,
+            engine=req.engine,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.post("/analysis/drilldown")
+async def drilldown(req: DrillDownRequest):
+    """Hierarchical root-cause drill-down, e.g. country -> SKU -> customer.
+
+    Each level ranks contributors to the change between the windows and only
+    the strongest expand_n branches are drilled into, one query per level.
+    """
+    try:
+        return await run_drilldown(
+            req.params,
+            path=req.path,
+            metric=req.metric,
+            top_n=req.top_n,
+            expand_n=req.expand_n,
+            timeout_seconds=req.timeout_seconds,
+            use_cache=req.use_cache,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.post("/analysis/change-points")
+async def change_points(req: ChangePointRequest):
+    """Rank every consecutive window pair in a date range by KPI change.
+
+    One pass over the daily series replaces one kpi_trend_window_comparison
+    call per candidate pair; with a dimension, each member's series is
+    scanned and ranked together.
+    """
+    try:
+        return await run_change_point_scan(
+            kpi=req.kpi,
+            window_days=req.window_days,
+            start_date=req.start_date,
+            end_date=req.end_date,
+            step_days=req.step_days,
+            dimension=req.dimension,
+            max_members=req.max_members,
+            top_n=req.top_n,
+            timeout_seconds=req.timeout_seconds,
+            use_cache=req.use_cache,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.post("/analysis/kpi-windows")
+async def kpi_windows(req: KpiWindowsRequest):
+    """kpi_trend_window_comparison rows for many day-aligned window pairs.
+
+    Answered from the per-day running totals in kpi_prefix_sums, so each
+    pair costs a few index lookups however long its windows are; country
+    restricts every pair to one country.
+    """
+    try:
+        return await run_kpi_windows(
+            req.windows,
+            country=req.country,
+            timeout_seconds=req.timeout_seconds,
+            use_cache=req.use_cache,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.get("/pool/stats")
+def pool_stats():
+    """Report connection pool gauges (in use, idle, waiting) and wait counters.
+
+    "async" is the pool serving the API; "sync" is the run_sql() pool and is
+    null until something in this process has used it.
+    """
+    return {"async": get_async_pool_stats(), "sync": get_pool_stats()}
+
+@app.get("/slow-queries")
+async def slow_queries(limit: int = Query(20, ge=1, le=200), hours: float = Query(24.0, gt=0)):
+    """Worst slow-query fingerprints in the last `hours`, each with its latest EXPLAIN plan.
+
+    Captures are only recorded when SLOW_QUERY_THRESHOLD_MS is set.
+    """
+    result = await run_sql_async(
+        WORST_FINGERPRINTS_SQL,
+        {"limit": limit, "hours": hours},
+        max_rows=limit,
+        use_cache=False,
+        name="slow_queries",
+    )
+    slow_query_log = get_slow_query_log()
+    return {
+        "enabled": slow_query_log is not None,
+        "recorder": slow_query_log.stats() if slow_query_log is not None else None,
+        "fingerprints": result["rows"],
+    }
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics: per-query latency, row and payload histograms, errors, pool and cache gauges."""
+    return Response(content=get_metrics_registry().render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Report result cache hit rate and occupancy."""
+    return get_result_cache().stats()
+
+@app.get("/columnar/stats")
+def columnar_stats():
+    """Report the columnar engine's snapshot: rows, bytes, data version and load time."""
+    return get_columnar_engine().stats()
@@ -0,0 +1,451 @@
+# tools/async_sql_tool.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+import weakref
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from app.tools.metrics import estimate_payload_bytes, query_fingerprint, record_query
+from app.tools.result_cache import DATA_VERSION_SQL, ResultCache, get_result_cache, result_cache_enabled
+from app.tools.serialization import ROW_FORMATS, rows_to_columns
+from app.tools.sql_tool import (
+    READ_ONLY_SESSION_OPTIONS,
+    _hash_query,
+    _is_read_only_sql,
+    _record_slow_query,
+    _trace_query,
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Async connection pool and concurrency limiter (initialized lazily)
+_async_pool: Optional[AsyncConnectionPool] = None
+_async_pool_lock: Optional[asyncio.Lock] = None
+_data_version_lock: Optional[asyncio.Lock] = None
+_query_slots: Optional[asyncio.Semaphore] = None
+
+# statement_timeout (ms) currently set on each pooled connection
+_session_timeouts: "weakref.WeakKeyDictionary[Any, int]" = weakref.WeakKeyDictionary()
+
+
+class QueryCapacityError(RuntimeError):
+    """Raised when no query slot frees up within DB_QUEUE_TIMEOUT seconds."""
+
+
+async def _get_async_pool() -> AsyncConnectionPool:
+    """Get or create the async connection pool."""
+    global _async_pool, _async_pool_lock
+
+    if _async_pool is not None:
+        return _async_pool
+
+    if _async_pool_lock is None:
+        _async_pool_lock = asyncio.Lock()
+
+    async with _async_pool_lock:
+        if _async_pool is None:
+            dsn = os.getenv("DATABASE_URL")
+            if not dsn:
+                raise RuntimeError("DATABASE_URL env var is not set.")
+
+            # Pool configuration (shared with the sync pool)
+            min_conn = int(os.getenv("DB_POOL_MIN", "2"))
+            max_conn = int(os.getenv("DB_POOL_MAX", "10"))
+
+            try:
+                # Autocommit read-only sessions: no BEGIN/ROLLBACK per query. The
+                # pool rolls back any connection returned mid-transaction and
+                # resets one whose session is no longer read-only.
+                # Lifetime, idle and acquire limits mirror the sync pool
+                new_pool = AsyncConnectionPool(
+                    conninfo=dsn,
+                    min_size=min_conn,
+                    max_size=max_conn,
+                    kwargs={"autocommit": True, "options": READ_ONLY_SESSION_OPTIONS},
+                    reset=_reset_session,
+                    timeout=float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5.0")),
+                    max_waiting=int(os.getenv("DB_POOL_MAX_WAITERS", "64")),
+                    max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "3600")),
+                    max_idle=float(os.getenv("DB_POOL_MAX_IDLE", "600")),
+                    open=False,
+                )
+                await new_pool.open()
+                _async_pool = new_pool
+                logger.info(f"Async connection pool created: min={min_conn}, max={max_conn}")
+            except Exception as e:
+                logger.error(f"Failed to create async connection pool: {e}")
+                raise
+
+    return _async_pool
+
+
+def get_async_pool_stats() -> Optional[Dict[str, Any]]:
+    """Gauges and counters of the async connection pool, or None if it was never created."""
+    if _async_pool is None:
+        return None
+    stats = _async_pool.get_stats()
+    return {
+        "min_size": stats.get("pool_min", 0),
+        "max_size": stats.get("pool_max", 0),
+        "size": stats.get("pool_size", 0),
+        "in_use": stats.get("pool_size", 0) - stats.get("pool_available", 0),
+        "idle": stats.get("pool_available", 0),
+        "waiting": stats.get("requests_waiting", 0),
+        "requests_total": stats.get("requests_num", 0),
+        "waited_total": stats.get("requests_queued", 0),
+        "timeouts_total": stats.get("requests_errors", 0),
+        "opened_total": stats.get("connections_num", 0),
+        "wait_ms_total": stats.get("requests_wait_ms", 0),
+    }
+
+
+def _get_query_slots() -> asyncio.Semaphore:
+    """Get or create the semaphore bounding concurrent async queries."""
+    global _query_slots
+
+    if _query_slots is None:
+        limit = int(os.getenv("DB_MAX_CONCURRENT_QUERIES", os.getenv("DB_POOL_MAX", "10")))
+        _query_slots = asyncio.Semaphore(limit)
+
+    return _query_slots
+
+
+async def _acquire_query_slot(query_hash: str) -> asyncio.Semaphore:
+    """Wait for a free query slot, or push back once DB_QUEUE_TIMEOUT expires."""
+    slots = _get_query_slots()
+    queue_timeout = float(os.getenv("DB_QUEUE_TIMEOUT", "5.0"))
+
+    try:
+        await asyncio.wait_for(slots.acquire(), timeout=queue_timeout)
+    except asyncio.TimeoutError:
+        logger.warning(
+            f"Query rejected | hash={query_hash} | "
+            f"reason=no free query slot within {queue_timeout}s"
+        )
+        raise QueryCapacityError(
+            f"Too many concurrent queries; no slot freed within {queue_timeout}s."
+        ) from None
+
+    return slots
+
+
+async def _reset_session(conn: psycopg.AsyncConnection) -> None:
+    """Pool reset hook: RESET ALL when a query turned the read-only session off (see sql_tool._reset_session)."""
+    if conn.info.parameter_status("default_transaction_read_only") == "on":
+        return
+    logger.warning("Resetting pooled connection whose session is no longer read-only")
+    await conn.execute("RESET ALL")
+    _session_timeouts.pop(conn, None)
+
+
+async def _apply_statement_timeout(conn: psycopg.AsyncConnection, timeout_ms: int) -> None:
+    """Set statement_timeout on a pooled connection only when it differs from the current value."""
+    if _session_timeouts.get(conn) == timeout_ms:
+        return
+    await conn.execute(f"SET statement_timeout = {timeout_ms}")
+    _session_timeouts[conn] = timeout_ms
+
+
+async def _refresh_data_version_async(cache: ResultCache) -> None:
+    """Re-read the data version counter so the cache drops results from older loads."""
+    global _data_version_lock
+
+    if _data_version_lock is None:
+        _data_version_lock = asyncio.Lock()
+
+    # Single-flight: requests that were waiting on the lock reuse the read
+    # made by the one ahead of them instead of each taking a connection
+    async with _data_version_lock:
+        if not cache.version_check_due():
+            return
+        connection_pool = await _get_async_pool()
+        try:
+            async with connection_pool.connection() as conn:
+                cur = await conn.execute(DATA_VERSION_SQL)
+                row = await cur.fetchone()
+            cache.set_data_version(row[0] if row else None)
+        except psycopg.Error as e:
+            # Databases created before data_version existed fall back to TTL-only expiry
+            logger.debug(f"Data version unavailable: {e}")
+            cache.set_data_version(None)
+
+
+async def close_async_pool() -> None:
+    """Close the async connection pool (called on application shutdown)."""
+    global _async_pool
+
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+        logger.info("Async connection pool closed")
+
+
+async def run_sql_async(
+    sql: str,
+    params: Optional[Dict[str, Any]] = None,
+    *,
+    max_rows: int = 5000,
+    timeout_seconds: Optional[float] = None,
+    use_cache: bool = True,
+    prepare: bool = False,
+    row_format: str = "rows",
+    name: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Async variant of run_sql() on a psycopg 3 connection pool.
+
+    Applies the same read-only guard, statement timeout and query_hash
+    logging as run_sql(). At most DB_MAX_CONCURRENT_QUERIES queries run at
+    once; further callers wait up to DB_QUEUE_TIMEOUT seconds for a slot.
+
+    Args:
+        sql: SQL query string (SELECT or WITH statements only)
+        params: Optional dictionary of named parameters
+        max_rows: Maximum number of rows to return (default: 5000)
+        timeout_seconds: Query timeout in seconds (default: None, uses DB_POOL_TIMEOUT env var or 30s)
+        use_cache: Serve/store the result from the result cache (default: True)
+        prepare: Run as a server-side prepared statement, cached per pooled
+            connection so repeated calls skip parse and plan (default: False)
+        row_format: 'rows' (list of dicts) or 'columns' (column arrays) (default: 'rows')
+        name: Template or analysis name used as the metrics label (default: query fingerprint)
+
+    Returns:
+        Same dictionary shape as run_sql().
+
+    Raises:
+        ValueError: If query is not read-only or contains dangerous keywords
+        RuntimeError: If DATABASE_URL is not set or connection pool fails
+        QueryCapacityError: If no query slot frees up in time
+        psycopg.errors.QueryCanceled: If query exceeds timeout
+    """
+    _is_read_only_sql(sql)
+    if row_format not in ROW_FORMATS:
+        raise ValueError(f"Unsupported row_format: {row_format}. Expected one of {ROW_FORMATS}.")
+
+    # Generate query hash for logging
+    query_hash = _hash_query(sql, params)
+    metric_label = name or query_fingerprint(sql)
+
+    # Get timeout (from parameter, env var, or default)
+    timeout = timeout_seconds
+    if timeout is None:
+        timeout = float(os.getenv("DB_POOL_TIMEOUT", "30.0"))
+
+    # Serve repeated queries from the result cache without taking a query slot
+    cache = get_result_cache() if use_cache and result_cache_enabled() else None
+    cache_key = (query_hash, max_rows, row_format)
+    if cache is not None:
+        t0 = time.time()
+        if cache.version_check_due():
+            await _refresh_data_version_async(cache)
+        # The version the query runs under; put() skips the store if it moves
+        cache_version = cache.data_version
+        cached = cache.get(cache_key, sql, params)
+        if cached is not None:
+            elapsed = time.time() - t0
+            elapsed_ms = int(elapsed * 1000)
+            logger.info(
+                f"Query cache hit | hash={query_hash} | "
+                f"duration_ms={elapsed_ms} | rows={cached['row_count']}"
+            )
+            record_query(
+                metric_label, "cached", elapsed,
+                row_count=cached["row_count"], payload_bytes=estimate_payload_bytes(cached),
+            )
+            result = {**cached, "duration_ms": elapsed_ms, "cache": "hit"}
+            _trace_query(name, sql, params, query_hash, elapsed_ms, result)
+            return result
+
+    try:
+        slots = await _acquire_query_slot(query_hash)
+    except QueryCapacityError as e:
+        record_query(metric_label, "capacity", 0.0)
+        _trace_query(name, sql, params, query_hash, 0, error=e)
+        raise
+
+    t0 = time.time()
+
+    try:
+        connection_pool = await _get_async_pool()
+
+        async with connection_pool.connection() as conn:
+            # Columnar results are built from plain tuples, never per-row dicts
+            cursor_kwargs = {"row_factory": dict_row} if row_format == "rows" else {}
+            # Set statement timeout only when this connection has a different one
+            await _apply_statement_timeout(conn, int(timeout * 1000))
+
+            async with conn.cursor(**cursor_kwargs) as cur:
+                # Execute query (prepare=None lets psycopg auto-prepare hot statements)
+                await cur.execute(sql, params or {}, prepare=True if prepare else None)
+                rows = await cur.fetchmany(max_rows)
+                names = [column.name for column in cur.description or []]
+
+        elapsed_ms = int((time.time() - t0) * 1000)
+
+        # Log query execution
+        logger.info(
+            f"Query executed | hash={query_hash} | "
+            f"duration_ms={elapsed_ms} | rows={len(rows)} | "
+            f"max_rows={max_rows} | timeout={timeout}s"
+        )
+
+        result = {
+            "row_count": len(rows),
+            "duration_ms": elapsed_ms,
+            "query_hash": query_hash,
+            "cache": "bypass" if cache is None else "miss",
+        }
+        if row_format == "columns":
+            result["columns"] = names
+            result["arrays"] = rows_to_columns(names, rows)
+        else:
+            result["rows"] = rows
+        if cache is not None:
+            cache.put(cache_key, sql, params, result, data_version=cache_version)
+        record_query(
+            metric_label, "ok", time.time() - t0,
+            row_count=len(rows), payload_bytes=estimate_payload_bytes(result),
+        )
+        _trace_query(name, sql, params, query_hash, elapsed_ms, result)
+        _record_slow_query(name, sql, params, query_hash, elapsed_ms)
+
+        return result
+
+    except psycopg.errors.QueryCanceled as e:
+        elapsed_ms = int((time.time() - t0) * 1000)
+        logger.warning(
+            f"Query timeout | hash={query_hash} | "
+            f"duration_ms={elapsed_ms} | timeout={timeout}s | error={str(e)}"
+        )
+        record_query(metric_label, "timeout", time.time() - t0)
+        _trace_query(name, sql, params, query_hash, elapsed_ms, error=e)
+        _record_slow_query(name, sql, params, query_hash, elapsed_ms, timed_out=True)
+        raise
+
+    except Exception as e:
+        elapsed_ms = int((time.time() - t0) * 1000)
+        logger.error(
+            f"Query failed | hash={query_hash} | "
+            f"duration_ms={elapsed_ms} | error={str(e)}"
+        )
+        record_query(metric_label, "error", time.time() - t0)
+        _trace_query(name, sql, params, query_hash, elapsed_ms, error=e)
+        raise
+
+    finally:
+        slots.release()
+
+
+async def stream_sql_async(
+    sql: str,
+    params: Optional[Dict[str, Any]] = None,
+    *,
+    batch_size: int = 1000,
+    max_rows: Optional[int] = None,
+    timeout_seconds: Optional[float] = None,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Stream a read-only query in batches through a server-side (named) cursor.
+
+    Postgres produces rows on demand as batches are fetched, so memory stays
+    bounded by batch_size regardless of result size and the first batch is
+    available before the query has finished. The query slot and pooled
+    connection are held until the generator is exhausted or closed. Results
+    are never cached.
+
+    Args:
+        sql: SQL query string (SELECT or WITH statements only)
+        params: Optional dictionary of named parameters
+        batch_size: Rows fetched per round trip (default: 1000)
+        max_rows: Optional cap on the total rows streamed (default: no cap)
+        timeout_seconds: Statement timeout applied to each fetch (default: DB_POOL_TIMEOUT or 30s)
+
+    Yields:
+        Lists of row dictionaries, at most batch_size long.
+
+    Raises:
+        Same exceptions as run_sql_async().
+    """
+    _is_read_only_sql(sql)
+
+    # Generate query hash for logging
+    query_hash = _hash_query(sql, params)
+
+    # Get timeout (from parameter, env var, or default)
+    timeout = timeout_seconds
+    if timeout is None:
+        timeout = float(os.getenv("DB_POOL_TIMEOUT", "30.0"))
+
+    metric_label = query_fingerprint(sql)
+    try:
+        slots = await _acquire_query_slot(query_hash)
+    except QueryCapacityError:
+        record_query(metric_label, "capacity", 0.0)
+        raise
+
+    t0 = time.time()
+    first_batch_ms: Optional[int] = None
+    streamed = 0
+
+    try:
+        connection_pool = await _get_async_pool()
+
+        async with connection_pool.connection() as conn:
+            # Set statement timeout only when this connection has a different one
+            await _apply_statement_timeout(conn, int(timeout * 1000))
+
+            # Named cursors live inside a (read-only) transaction
+            cursor_name = f"stream_{query_hash}_{uuid.uuid4().hex[:8]}"
+            async with conn.transaction(), conn.cursor(name=cursor_name, row_factory=dict_row) as cur:
+                cur.itersize = batch_size
+                await cur.execute(sql, params or {})
+
+                while max_rows is None or streamed < max_rows:
+                    size = batch_size if max_rows is None else min(batch_size, max_rows - streamed)
+                    rows = await cur.fetchmany(size)
+                    if not rows:
+                        break
+                    if first_batch_ms is None:
+                        first_batch_ms = int((time.time() - t0) * 1000)
+                    streamed += len(rows)
+                    yield rows
+
+        elapsed_ms = int((time.time() - t0) * 1000)
+
+        # Log query execution
+        logger.info(
+            f"Query streamed | hash={query_hash} | "
+            f"duration_ms={elapsed_ms} | first_batch_ms={first_batch_ms} | "
+            f"rows={streamed} | batch_size={batch_size} | timeout={timeout}s"
+        )
+        record_query(metric_label, "streamed", time.time() - t0, row_count=streamed)
+
+    except psycopg.errors.QueryCanceled as e:
+        elapsed_ms = int((time.time() - t0) * 1000)
+        logger.warning(
+            f"Query timeout | hash={query_hash} | "
+            f"duration_ms={elapsed_ms} | rows={streamed} | timeout={timeout}s | error={str(e)}"
+        )
+        record_query(metric_label, "timeout", time.time() - t0)
+        raise
+
+    except Exception as e:
+        elapsed_ms = int((time.time() - t0) * 1000)
+        logger.error(
+            f"Query failed | hash={query_hash} | "
+            f"duration_ms={elapsed_ms} | rows={streamed} | error={str(e)}"
+        )
+        record_query(metric_label, "error", time.time() - t0)
+        raise
+
+    finally:
+        slots.release()
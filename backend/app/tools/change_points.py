@@ -0,0 +1,322 @@
+# tools/change_points.py
+from __future__ import annotations
+
+import logging
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+from app.tools.async_sql_tool import run_sql_async
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+KPIS = ("revenue", "units", "aov")
+
+MAX_WINDOW_DAYS = 366
+
+# Longest scanned range; the daily series holds one row per member and day in it
+MAX_RANGE_DAYS = 5 * 366
+
+# Members scanned per breakdown, largest first by revenue (units for kpi='units')
+DEFAULT_MAX_MEMBERS = 200
+MAX_MEMBERS = 2000
+
+# Member expression per breakdown dimension, on the rollups and on the line-level
+# tables. Invoices per country come from daily_invoice_rollup; per stock_code
+# they count the invoices containing the product.
+DIMENSION_SQL = {
+    None: {
+        "rollup_member": "''",
+        "line_member": "''",
+        "rollup_invoices": "SELECT day, '' AS member, SUM(invoice_count) AS invoices FROM daily_invoice_rollup",
+    },
+    "country": {
+        "rollup_member": "country",
+        "line_member": "COALESCE(c.country, 'Unknown')",
+        "rollup_invoices": "SELECT day, country AS member, SUM(invoice_count) AS invoices FROM daily_invoice_rollup",
+    },
+    "stock_code": {
+        "rollup_member": "stock_code",
+        "line_member": "ii.stock_code",
+        "rollup_invoices": "SELECT day, stock_code AS member, SUM(invoice_count) AS invoices FROM daily_sales_rollup",
+    },
+}
+
+# One pass over the daily series: running totals per member over a gap-free
+# day grid, so the windows ending on each day are differences of running
+# totals LAGged by window_days and 2 * window_days. The series is read from
+# the day rollups unless a day in the range awaits a rollup refresh, in
+# which case it is aggregated from the line-level tables, as in the KPI
+# templates. KPI values and rounding follow kpi_trend_window_comparison.
+_SCAN_SQL = """
+WITH use_rollup AS (
+  SELECT NOT EXISTS (
+    SELECT 1
+    FROM rollup_dirty_days d
+    WHERE d.day >= %(start_date)s AND d.day < %(end_date)s
+  ) AS ok
+),
+lines AS (
+  -- Line-level fallback; empty when the rollups are current
+  SELECT
+    ii.invoice_date::date AS day,
+    {line_member} AS member,
+    ii.invoice_no,
+    ii.quantity::numeric AS units,
+    ii.quantity::numeric * p.unit_price::numeric AS revenue
+  FROM invoice_items ii
+  JOIN invoices i ON i.invoice_no = ii.invoice_no AND i.invoice_date = ii.invoice_date
+  JOIN products p ON p.stock_code = ii.stock_code
+  LEFT JOIN customers c ON c.customer_id = i.customer_id
+  WHERE ii.invoice_date >= %(start_date)s AND ii.invoice_date < %(end_date)s
+    AND i.invoice_date >= %(start_date)s AND i.invoice_date < %(end_date)s
+    AND NOT (SELECT ok FROM use_rollup)
+),
+members AS (
+  -- The largest members over the whole range
+  SELECT member
+  FROM (
+    SELECT {rollup_member} AS member, SUM(revenue) AS revenue, SUM(units)::numeric AS units
+    FROM daily_sales_rollup
+    WHERE day >= %(start_date)s AND day < %(end_date)s
+      AND (SELECT ok FROM use_rollup)
+    GROUP BY 1
+    UNION ALL
+    SELECT member, SUM(revenue), SUM(units)
+    FROM lines
+    GROUP BY 1
+  ) t
+  ORDER BY CASE WHEN %(kpi)s = 'units' THEN units ELSE revenue END DESC, member
+  LIMIT %(max_members)s
+),
+daily AS (
+  SELECT s.day, s.member, s.revenue, s.units, COALESCE(n.invoices, 0) AS invoices
+  FROM (
+    SELECT day, {rollup_member} AS member, SUM(revenue) AS revenue, SUM(units)::numeric AS units
+    FROM daily_sales_rollup
+    WHERE day >= %(start_date)s AND day < %(end_date)s
+      AND {rollup_member} IN (SELECT member FROM members)
+      AND (SELECT ok FROM use_rollup)
+    GROUP BY 1, 2
+  ) s
+  LEFT JOIN (
+    {rollup_invoices}
+    WHERE day >= %(start_date)s AND day < %(end_date)s
+      AND {rollup_member} IN (SELECT member FROM members)
+      AND (SELECT ok FROM use_rollup)
+    GROUP BY 1, 2
+  ) n ON n.day = s.day AND n.member = s.member
+  UNION ALL
+  SELECT day, member, SUM(revenue), SUM(units), COUNT(DISTINCT invoice_no)
+  FROM lines
+  WHERE member IN (SELECT member FROM members)
+  GROUP BY 1, 2
+),
+grid AS (
+  SELECT m.member, g.day::date AS day
+  FROM members m
+  CROSS JOIN generate_series(%(start_date)s::date, %(end_date)s::date - 1, INTERVAL '1 day') AS g(day)
+),
+running AS (
+  SELECT
+    g.member,
+    g.day,
+    (g.day - %(start_date)s::date) AS day_index,
+    SUM(COALESCE(d.revenue, 0)) OVER w AS revenue,
+    SUM(COALESCE(d.units, 0)) OVER w AS units,
+    SUM(COALESCE(d.invoices, 0)) OVER w AS invoices
+  FROM grid g
+  LEFT JOIN daily d ON d.member = g.member AND d.day = g.day
+  WINDOW w AS (PARTITION BY g.member ORDER BY g.day)
+),
+window_pairs AS (
+  -- Row for the last day of each current window
+  SELECT
+    member,
+    day - (2 * %(window_days)s - 1) AS prior_start,
+    day - (%(window_days)s - 1) AS current_start,
+    day + 1 AS current_end,
+    day_index,
+    revenue - LAG(revenue, %(window_days)s) OVER w AS current_revenue,
+    LAG(revenue, %(window_days)s) OVER w - LAG(revenue, 2 * %(window_days)s, 0) OVER w AS prior_revenue,
+    units - LAG(units, %(window_days)s) OVER w AS current_units,
+    LAG(units, %(window_days)s) OVER w - LAG(units, 2 * %(window_days)s, 0) OVER w AS prior_units,
+    invoices - LAG(invoices, %(window_days)s) OVER w AS current_invoices,
+    LAG(invoices, %(window_days)s) OVER w - LAG(invoices, 2 * %(window_days)s, 0) OVER w AS prior_invoices
+  FROM running
+  WINDOW w AS (PARTITION BY member ORDER BY day)
+),
+kpi_values AS (
+  SELECT
+    member,
+    prior_start,
+    current_start,
+    current_end,
+    current_invoices,
+    prior_invoices,
+    CASE %(kpi)s
+      WHEN 'revenue' THEN current_revenue
+      WHEN 'units' THEN current_units
+      ELSE CASE WHEN current_invoices > 0 THEN current_revenue / current_invoices END
+    END AS current_value,
+    CASE %(kpi)s
+      WHEN 'revenue' THEN prior_revenue
+      WHEN 'units' THEN prior_units
+      ELSE CASE WHEN prior_invoices > 0 THEN prior_revenue / prior_invoices END
+    END AS prior_value
+  FROM window_pairs
+  WHERE day_index >= 2 * %(window_days)s - 1
+    AND (day_index - (2 * %(window_days)s - 1)) %% %(step_days)s = 0
+),
+changes AS (
+  SELECT
+    *,
+    current_value - prior_value AS change,
+    CASE WHEN prior_value <> 0 THEN (current_value - prior_value) / prior_value END AS pct_change
+  FROM kpi_values
+  -- Neither window has sales: nothing changed
+  WHERE current_invoices > 0 OR prior_invoices > 0
+),
+ranked AS (
+  SELECT
+    *,
+    ROW_NUMBER() OVER (ORDER BY ABS(change) DESC NULLS LAST, current_start, member) AS abs_rank,
+    ROW_NUMBER() OVER (ORDER BY ABS(pct_change) DESC NULLS LAST, current_start, member) AS pct_rank,
+    COUNT(*) OVER () AS pair_count
+  FROM changes
+)
+SELECT
+  NULLIF(member, '') AS member,
+  prior_start,
+  current_start,
+  current_end,
+  ROUND(current_value, 2) AS current_value,
+  ROUND(prior_value, 2) AS prior_value,
+  ROUND(change, 2) AS change,
+  ROUND(pct_change, 6) AS pct_change,
+  current_invoices::bigint AS current_invoices,
+  prior_invoices::bigint AS prior_invoices,
+  abs_rank,
+  pct_rank,
+  pair_count,
+  (SELECT COUNT(*) FROM members) AS member_count,
+  (SELECT ok FROM use_rollup) AS from_rollup
+FROM ranked
+WHERE abs_rank <= %(top_n)s OR pct_rank <= %(top_n)s
+ORDER BY abs_rank
+"""
+
+
+async def run_change_point_scan(
+    *,
+    kpi: str,
+    window_days: int,
+    start_date: date,
+    end_date: date,
+    step_days: int = 1,
+    dimension: Optional[str] = None,
+    max_members: int = DEFAULT_MAX_MEMBERS,
+    top_n: int = 10,
+    timeout_seconds: Optional[float] = None,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """
+    Rank every consecutive window pair in a date range by KPI change.
+
+    Each pair is a prior window [t - window_days, t) and a current window
+    [t, t + window_days), with both inside [start_date, end_date); t moves
+    by step_days. All pairs (per member of the breakdown dimension, if
+    one is given) are computed in one query from the daily series, instead
+    of one kpi_trend_window_comparison call per pair.
+
+    Args:
+        kpi: 'revenue', 'units' or 'aov' (revenue per invoice)
+        window_days: Length of each window in days
+        start_date: First day of the scanned range
+        end_date: Day after the scanned range
+        step_days: Days between consecutive split points (default: 1)
+        dimension: 'country' or 'stock_code' to scan each member's series
+            separately; None scans the overall series
+        max_members: With a dimension, scan only the members with the most
+            revenue (units for kpi='units') over the range; small members'
+            relative changes are mostly noise (default: 200)
+        top_n: Pairs kept per ranking (default: 10)
+        timeout_seconds: Statement timeout for the query
+        use_cache: Serve/store the result from the result cache (default: True)
+
+    Returns:
+        Dictionary with 'by_abs_change' and 'by_pct_change' (the top_n
+        pairs of each ranking), pair_count (pairs compared),
+        member_count (members scanned), source
+        ('rollup' or 'lines'), query_hash, cache and duration_ms.
+
+    Raises:
+        ValueError: If the KPI, dimension or window/range sizes are invalid
+        Same exceptions as run_sql_async().
+    """
+    if kpi not in KPIS:
+        raise ValueError(f"Unknown kpi: {kpi}. Expected one of {KPIS}.")
+    if dimension not in DIMENSION_SQL:
+        raise ValueError(f"Unknown dimension: {dimension}. Expected one of {tuple(d for d in DIMENSION_SQL if d)}.")
+    if not 1 <= window_days <= MAX_WINDOW_DAYS:
+        raise ValueError(f"window_days must be between 1 and {MAX_WINDOW_DAYS}.")
+    if step_days < 1 or top_n < 1:
+        raise ValueError("step_days and top_n must be >= 1.")
+    if not 1 <= max_members <= MAX_MEMBERS:
+        raise ValueError(f"max_members must be between 1 and {MAX_MEMBERS}.")
+    range_days = (end_date - start_date).days
+    if range_days > MAX_RANGE_DAYS:
+        raise ValueError(f"The scanned range is limited to {MAX_RANGE_DAYS} days.")
+    if range_days < 2 * window_days:
+        raise ValueError(
+            f"The range {start_date}..{end_date} is shorter than two windows of {window_days} days "
+            f"(needs end_date >= {start_date + timedelta(days=2 * window_days)})."
+        )
+
+    sql = _SCAN_SQL.format(**DIMENSION_SQL[dimension])
+    t0 = time.time()
+    result = await run_sql_async(
+        sql,
+        {
+            "kpi": kpi,
+            "window_days": window_days,
+            "start_date": start_date,
+            "end_date": end_date,
+            "step_days": step_days,
+            "max_members": max_members,
+            "top_n": top_n,
+        },
+        max_rows=2 * top_n,
+        timeout_seconds=timeout_seconds,
+        use_cache=use_cache,
+        prepare=True,
+        name=f"change_points.{dimension or 'total'}",
+    )
+    elapsed_ms = int((time.time() - t0) * 1000)
+
+    rows = result["rows"]
+    pairs = [
+        {key: value for key, value in row.items() if key not in ("pair_count", "member_count", "from_rollup")}
+        for row in rows
+    ]
+    pair_count = rows[0]["pair_count"] if rows else 0
+    member_count = rows[0]["member_count"] if rows else 0
+    source = "rollup" if not rows or rows[0]["from_rollup"] else "lines"
+
+    logger.info(
+        f"Change-point scan | kpi={kpi} | window_days={window_days} | dimension={dimension} | "
+        f"hash={result['query_hash']} | pairs={pair_count} | source={source} | "
+        f"duration_ms={elapsed_ms} | cache={result['cache']}"
+    )
+
+    return {
+        "by_abs_change": [p for p in pairs if p["abs_rank"] <= top_n],
+        "by_pct_change": sorted((p for p in pairs if p["pct_rank"] <= top_n), key=lambda p: p["pct_rank"]),
+        "pair_count": pair_count,
+        "member_count": member_count,
+        "source": source,
+        "query_hash": result["query_hash"],
+        "cache": result["cache"],
+        "duration_ms": elapsed_ms,
+    }
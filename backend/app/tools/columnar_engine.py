@@ -0,0 +1,516 @@
+# tools/columnar_engine.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.tools.async_sql_tool import _acquire_query_slot, _apply_statement_timeout, _get_async_pool
+from app.tools.result_cache import DATA_VERSION_SQL
+from app.tools.window_cube import GRAIN_DETAIL, GRAIN_IDS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# unit_price is NUMERIC(10,2), so its cents are an exact integer
+PRODUCTS_SQL = "SELECT stock_code, description, (unit_price * 100)::int8 FROM products ORDER BY stock_code"
+CUSTOMERS_SQL = "SELECT customer_id, country FROM customers"
+
+# Line-level facts as fixed-width binary tuples. stock_code arrives already
+# dictionary-encoded (its position in PRODUCTS_SQL order, 1-based; both run
+# in one snapshot) and NULLs are replaced, so every tuple has the same
+# layout (see _TUPLE_DTYPE).
+FACTS_COPY_SQL = """
+COPY (
+  WITH d AS (
+    SELECT stock_code, ROW_NUMBER() OVER (ORDER BY stock_code) AS code FROM products
+  )
+  SELECT
+    ii.invoice_date,
+    ii.invoice_no,
+    d.code::int4,
+    COALESCE(i.customer_id, -1),
+    COALESCE(ii.quantity, 0)
+  FROM invoice_items ii
+  JOIN invoices i ON i.invoice_no = ii.invoice_no AND i.invoice_date = ii.invoice_date
+  JOIN d ON d.stock_code = ii.stock_code
+) TO STDOUT (FORMAT BINARY)
+"""
+
+# One COPY BINARY tuple of FACTS_COPY_SQL: field count, then (length, value) per column
+_TUPLE_DTYPE = np.dtype([
+    ("fields", ">i2"),
+    ("ts_len", ">i4"), ("ts", ">i8"),
+    ("invoice_len", ">i4"), ("invoice", ">i4"),
+    ("stock_len", ">i4"), ("stock", ">i4"),
+    ("customer_len", ">i4"), ("customer", ">i4"),
+    ("quantity_len", ">i4"), ("quantity", ">i4"),
+])
+_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+# Postgres timestamps count microseconds from 2000-01-01
+_PG_EPOCH_US = 946_684_800_000_000
+
+# Grains in the order window_comparison_cube returns them
+_GRAIN_ORDER = (GRAIN_DETAIL, GRAIN_IDS["country"], GRAIN_IDS["stock_code"], GRAIN_IDS["customer_id"], GRAIN_IDS["totals"])
+
+
+def columnar_engine_enabled() -> bool:
+    """The columnar engine is off unless COLUMNAR_ENGINE_ENABLED is set to a true value."""
+    return os.getenv("COLUMNAR_ENGINE_ENABLED", "false").lower() in ("1", "true", "yes")
+
+
+def _to_us(value: datetime) -> int:
+    """Microseconds since 1970-01-01 for a window bound, as Postgres compares it with TIMESTAMP."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return int(np.datetime64(value, "us").astype(np.int64))
+
+
+# Stands for a NULL sum in a CentsColumn
+_NULL_CENTS = np.iinfo(np.int64).min
+
+
+class CentsColumn(Sequence):
+    """
+    Revenue column held as int64 cents, read as exact scale-2 Decimals.
+
+    WindowCube only reads the revenue of the rows it outputs, so values are
+    converted on access rather than for every cube row up front.
+    """
+
+    def __init__(self, cents: np.ndarray):
+        self.cents = cents
+
+    def __len__(self) -> int:
+        return len(self.cents)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        value = int(self.cents[index])
+        return None if value == _NULL_CENTS else Decimal(value).scaleb(-2)
+
+
+@dataclass(frozen=True)
+class FactColumns:
+    """
+    Line-level facts as typed column arrays, sorted by (invoice_date, invoice_no, stock_code).
+
+    Dimension columns hold int32 codes into their dictionaries (labels,
+    with None for NULL). Lines of one invoice share its date, so they are
+    contiguous and a date window is one slice that never splits an invoice.
+    """
+
+    ts: np.ndarray            # int64, microseconds since 1970-01-01
+    invoice: np.ndarray       # int32 code into invoice_nos
+    stock: np.ndarray         # int32 code into stock_codes
+    customer: np.ndarray      # int32 code into customer_ids
+    country: np.ndarray       # int32 code into countries
+    quantity: np.ndarray      # float64
+    price_cents: np.ndarray   # float64, current products.unit_price in whole cents
+    # First line of each invoice, and of each (invoice, stock_code) pair:
+    # COUNT(DISTINCT invoice_no) per group is a count of these rows
+    first_of_invoice: np.ndarray
+    first_of_pair: np.ndarray
+
+    invoice_nos: np.ndarray
+    stock_codes: np.ndarray    # object
+    descriptions: np.ndarray   # object, aligned with stock_codes
+    customer_ids: np.ndarray   # object: str labels, None for lines without a customer
+    countries: np.ndarray      # object: labels, None for unknown
+    customer_country: np.ndarray  # int32 country code per customer code
+
+    data_version: Optional[int]
+    loaded_at: float
+    load_ms: int
+
+    @property
+    def row_count(self) -> int:
+        return len(self.ts)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            getattr(self, name).nbytes
+            for name in ("ts", "invoice", "stock", "customer", "country", "quantity", "price_cents",
+                         "first_of_invoice", "first_of_pair", "invoice_nos", "customer_country")
+        )
+
+    def window(self, start: datetime, end: datetime) -> slice:
+        """Rows with start <= invoice_date < end."""
+        lo, hi = np.searchsorted(self.ts, [_to_us(start), _to_us(end)], side="left")
+        return slice(int(lo), int(max(lo, hi)))
+
+
+def _decode_facts(payload: bytes) -> np.ndarray:
+    """Parse a COPY BINARY payload of FACTS_COPY_SQL into a structured array."""
+    if not payload.startswith(_COPY_SIGNATURE):
+        raise RuntimeError("Unexpected COPY BINARY header.")
+    extension = int.from_bytes(payload[15:19], "big")
+    body = memoryview(payload)[19 + extension:len(payload) - 2]  # trailer: int16 -1
+    if len(body) % _TUPLE_DTYPE.itemsize:
+        raise RuntimeError("COPY BINARY payload is not a whole number of fact tuples.")
+    tuples = np.frombuffer(body, dtype=_TUPLE_DTYPE)
+    if len(tuples) and (
+        (tuples["fields"] != 5).any() or (tuples["ts_len"] != 8).any()
+        or (tuples["invoice_len"] != 4).any() or (tuples["quantity_len"] != 4).any()
+    ):
+        raise RuntimeError("Unexpected NULL or column width in fact tuples.")
+    return tuples
+
+
+def build_fact_columns(
+    tuples: np.ndarray,
+    products: Sequence[Tuple[str, Optional[str], Optional[float]]],
+    customers: Sequence[Tuple[int, Optional[str]]],
+    data_version: Optional[int],
+    started: float,
+) -> FactColumns:
+    """Dictionary-encode and sort the decoded fact tuples."""
+    ts = tuples["ts"].astype(np.int64) + _PG_EPOCH_US
+    invoice_no = tuples["invoice"].astype(np.int32)
+    stock = (tuples["stock"] - 1).astype(np.int32)
+    customer_raw = tuples["customer"].astype(np.int32)
+
+    order = np.lexsort((stock, invoice_no, ts))
+    ts, invoice_no, stock, customer_raw = ts[order], invoice_no[order], stock[order], customer_raw[order]
+    quantity = tuples["quantity"][order].astype(np.float64)
+    del order
+
+    invoice_nos, invoice = np.unique(invoice_no, return_inverse=True)
+    customer_values, customer = np.unique(customer_raw, return_inverse=True)
+
+    stock_codes = np.array([p[0] for p in products], dtype=object)
+    descriptions = np.array([p[1] for p in products], dtype=object)
+    price_cents = np.array([p[2] if p[2] is not None else 0 for p in products], dtype=np.float64)
+
+    # Countries: sorted labels, then None for lines whose customer or country is NULL
+    country_by_customer = dict(customers)
+    labels = sorted({c for c in country_by_customer.values() if c is not None})
+    countries = np.array(labels + [None], dtype=object)
+    country_code = {label: code for code, label in enumerate(labels)}
+    unknown = len(labels)
+    customer_country = np.array(
+        [country_code.get(country_by_customer.get(c), unknown) if c >= 0 else unknown for c in customer_values.tolist()],
+        dtype=np.int32,
+    )
+    customer_ids = np.array([str(c) if c >= 0 else None for c in customer_values.tolist()], dtype=object)
+
+    n = len(ts)
+    first_of_invoice = np.ones(n, dtype=bool)
+    first_of_invoice[1:] = invoice[1:] != invoice[:-1]
+    first_of_pair = first_of_invoice.copy()
+    first_of_pair[1:] |= stock[1:] != stock[:-1]
+
+    customer = customer.astype(np.int32)
+    return FactColumns(
+        ts=ts,
+        invoice=invoice.astype(np.int32),
+        stock=stock,
+        customer=customer,
+        country=customer_country[customer],
+        quantity=quantity,
+        price_cents=price_cents[stock],
+        first_of_invoice=first_of_invoice,
+        first_of_pair=first_of_pair,
+        invoice_nos=invoice_nos,
+        stock_codes=stock_codes,
+        descriptions=descriptions,
+        customer_ids=customer_ids,
+        countries=countries,
+        customer_country=customer_country,
+        data_version=data_version,
+        loaded_at=time.time(),
+        load_ms=int((time.monotonic() - started) * 1000),
+    )
+
+
+@dataclass
+class _WindowAggregates:
+    """Per-group sums for one window: revenue in cents, quantity, distinct invoices, line count."""
+
+    revenue: np.ndarray
+    quantity: np.ndarray
+    invoices: np.ndarray
+    lines: np.ndarray
+
+
+def _aggregate(facts: FactColumns, rows: slice, group: np.ndarray, size: int, distinct: np.ndarray) -> _WindowAggregates:
+    """Sum one window's lines into `size` groups; `distinct` marks each group's first line per invoice."""
+    # Integer-valued float64 products and sums are exact below 2**53 cents
+    revenue = np.bincount(group, weights=facts.quantity[rows] * facts.price_cents[rows], minlength=size)
+    quantity = np.bincount(group, weights=facts.quantity[rows], minlength=size)
+    return _WindowAggregates(
+        revenue=revenue.astype(np.int64),
+        quantity=np.rint(quantity).astype(np.int64),
+        invoices=np.bincount(group[distinct], minlength=size),
+        lines=np.bincount(group, minlength=size),
+    )
+
+
+def _grain_rows(grouping_id: int, cur: _WindowAggregates, prior: _WindowAggregates) -> Dict[str, np.ndarray]:
+    """Groups present in either window with their change, flags and contribution ranks, in cube order."""
+    present = np.flatnonzero((cur.lines > 0) | (prior.lines > 0))
+    rows = {
+        "group": present,
+        "current_revenue": cur.revenue[present],
+        "prior_revenue": prior.revenue[present],
+        "current_quantity": cur.quantity[present],
+        "prior_quantity": prior.quantity[present],
+        "current_invoices": cur.invoices[present],
+        "prior_invoices": prior.invoices[present],
+    }
+    revenue_change = rows["current_revenue"] - rows["prior_revenue"]
+    units_change = rows["current_quantity"] - rows["prior_quantity"]
+    is_contributor = (
+        (rows["current_revenue"] != 0) | (rows["prior_revenue"] != 0)
+        | (rows["current_quantity"] != 0) | (rows["prior_quantity"] != 0)
+    )
+    is_mix_row = (
+        (rows["current_revenue"] > 0) | (rows["prior_revenue"] > 0)
+        | (rows["current_quantity"] > 0) | (rows["prior_quantity"] > 0)
+    )
+
+    # ROW_NUMBER() OVER (PARTITION BY grouping_id, is_contributor ORDER BY change DESC)
+    n = len(present)
+    revenue_rank = np.empty(n, dtype=np.int64)
+    units_rank = np.empty(n, dtype=np.int64)
+    partition_size = np.empty(n, dtype=np.int64)
+    for members in (np.flatnonzero(is_contributor), np.flatnonzero(~is_contributor)):
+        ranks = np.arange(1, len(members) + 1)
+        revenue_rank[members[np.argsort(-revenue_change[members], kind="stable")]] = ranks
+        units_rank[members[np.argsort(-units_change[members], kind="stable")]] = ranks
+        partition_size[members] = len(members)
+
+    rows.update(
+        revenue_change=revenue_change,
+        units_change=units_change,
+        is_contributor=is_contributor,
+        is_mix_row=is_mix_row,
+        revenue_rank_positive=revenue_rank,
+        revenue_rank_negative=partition_size - revenue_rank + 1,
+        units_rank_positive=units_rank,
+        units_rank_negative=partition_size - units_rank + 1,
+    )
+
+    # ORDER BY ABS(revenue_change) DESC, ABS(units_change) DESC
+    order = np.lexsort((-np.abs(units_change), -np.abs(revenue_change)))
+    return {name: values[order] for name, values in rows.items()}
+
+
+def compute_window_cube(facts: FactColumns, bounds: Dict[str, datetime]) -> Tuple[List[str], List[List[Any]]]:
+    """
+    Columns and arrays shaped like the window_comparison_cube template's result.
+
+    Each window is a slice of the date-sorted arrays; every grain is a
+    bincount over dimension codes (the detail grain first maps its
+    (customer, stock_code) pairs to dense group ids). Revenue is summed as
+    quantity times the price in whole cents: every product and partial sum
+    is an integer below 2**53, so float64 holds it exactly. Groups tied on a
+    change may be ranked in a different order than Postgres ranks them.
+    """
+    windows = {
+        "current": facts.window(bounds["current_start_ts"], bounds["current_end_ts"]),
+        "prior": facts.window(bounds["prior_start_ts"], bounds["prior_end_ts"]),
+    }
+    n_stock, n_customers = len(facts.stock_codes), len(facts.customer_ids)
+
+    # Customer determines country, so (customer, stock_code) identifies a detail group
+    detail_keys = {
+        name: facts.customer[rows].astype(np.int64) * n_stock + facts.stock[rows]
+        for name, rows in windows.items()
+    }
+    detail_groups = np.unique(np.concatenate(list(detail_keys.values())))
+
+    columns: Dict[str, List[Any]] = {name: [] for name in (
+        "grouping_id", "country", "stock_code", "customer_id", "product_description",
+        "current_revenue", "prior_revenue", "current_quantity", "prior_quantity",
+        "current_invoices", "prior_invoices", "revenue_change", "units_change",
+        "is_contributor", "is_mix_row", "revenue_rank_positive", "revenue_rank_negative",
+        "units_rank_positive", "units_rank_negative",
+    )}
+    # Per-grain int64 cents, joined into CentsColumns at the end
+    revenue_columns = ("current_revenue", "prior_revenue", "revenue_change")
+
+    for grouping_id in _GRAIN_ORDER:
+        aggregates = {}
+        for name, rows in windows.items():
+            if grouping_id == GRAIN_DETAIL:
+                group, size = np.searchsorted(detail_groups, detail_keys[name]), len(detail_groups)
+                distinct = facts.first_of_pair[rows]
+            elif grouping_id == GRAIN_IDS["country"]:
+                group, size, distinct = facts.country[rows], len(facts.countries), facts.first_of_invoice[rows]
+            elif grouping_id == GRAIN_IDS["stock_code"]:
+                group, size, distinct = facts.stock[rows], n_stock, facts.first_of_pair[rows]
+            elif grouping_id == GRAIN_IDS["customer_id"]:
+                group, size, distinct = facts.customer[rows], n_customers, facts.first_of_invoice[rows]
+            else:
+                group, size, distinct = np.zeros(rows.stop - rows.start, dtype=np.int64), 1, facts.first_of_invoice[rows]
+            aggregates[name] = _aggregate(facts, rows, group, size, distinct)
+
+        if grouping_id == GRAIN_IDS["totals"] and not any(rows.stop > rows.start for rows in windows.values()):
+            # No lines in either window: one totals row of NULL sums, as in the template
+            for name in columns:
+                columns[name].append(np.array([_NULL_CENTS]) if name in revenue_columns else None)
+            columns["grouping_id"][-1] = grouping_id
+            columns["current_invoices"][-1] = columns["prior_invoices"][-1] = 0
+            continue
+        grain = _grain_rows(grouping_id, aggregates["current"], aggregates["prior"])
+
+        group, count = grain["group"], len(grain["group"])
+        if grouping_id == GRAIN_DETAIL:
+            customer, stock = np.divmod(detail_groups[group], n_stock)
+            country = facts.customer_country[customer]
+        else:
+            customer = group if grouping_id == GRAIN_IDS["customer_id"] else None
+            stock = group if grouping_id == GRAIN_IDS["stock_code"] else None
+            country = group if grouping_id == GRAIN_IDS["country"] else None
+
+        # Columns aggregated away are NULL; COALESCE(country, 'Unknown') where grouped
+        absent = [None] * count
+        columns["grouping_id"] += [grouping_id] * count
+        columns["country"] += (
+            ["Unknown" if label is None else label for label in facts.countries[country].tolist()]
+            if country is not None else absent
+        )
+        columns["stock_code"] += facts.stock_codes[stock].tolist() if stock is not None else absent
+        columns["customer_id"] += facts.customer_ids[customer].tolist() if customer is not None else absent
+        columns["product_description"] += facts.descriptions[stock].tolist() if stock is not None else absent
+        for name in revenue_columns:
+            columns[name].append(grain[name])
+        for name in ("current_quantity", "prior_quantity", "current_invoices", "prior_invoices", "units_change",
+                     "is_contributor", "is_mix_row", "revenue_rank_positive", "revenue_rank_negative",
+                     "units_rank_positive", "units_rank_negative"):
+            columns[name] += grain[name].tolist()
+
+    for name in revenue_columns:
+        columns[name] = CentsColumn(np.concatenate(columns[name]))
+    names = list(columns)
+    return names, [columns[name] for name in names]
+
+
+class ColumnarEngine:
+    """
+    In-process copy of the line-level facts for window comparisons.
+
+    The facts are loaded once (one consistent snapshot of facts,
+    dimensions and data version) and reloaded when the data version
+    changes, checked at most every DATA_VERSION_POLL_SECONDS. Requests keep
+    the snapshot they started with while a reload builds the next one.
+    """
+
+    def __init__(self, version_poll_seconds: float, load_timeout_seconds: float):
+        self.version_poll_seconds = version_poll_seconds
+        self.load_timeout_seconds = load_timeout_seconds
+        self._facts: Optional[FactColumns] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._version_checked_at = 0.0
+        self.loads = 0
+
+    async def facts(self) -> FactColumns:
+        """The current snapshot, (re)loading it first if it is missing or stale."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        facts = self._facts
+        if facts is not None and time.monotonic() - self._version_checked_at < self.version_poll_seconds:
+            return facts
+
+        async with self._lock:
+            if self._facts is not None and time.monotonic() - self._version_checked_at < self.version_poll_seconds:
+                return self._facts
+            if self._facts is None or await self._read_data_version() != self._facts.data_version:
+                self._facts = await self._load()
+            self._version_checked_at = time.monotonic()
+            return self._facts
+
+    async def warm(self) -> None:
+        """Load the first snapshot, logging instead of raising on failure (startup warm-up)."""
+        try:
+            await self.facts()
+        except Exception as e:
+            logger.warning(f"Columnar engine warm-up failed; loading on first use instead: {e}")
+
+    async def _read_data_version(self) -> Optional[int]:
+        connection_pool = await _get_async_pool()
+        async with connection_pool.connection() as conn:
+            cur = await conn.execute(DATA_VERSION_SQL)
+            row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def _load(self) -> FactColumns:
+        started = time.monotonic()
+        slots = await _acquire_query_slot("columnar_load")
+        try:
+            connection_pool = await _get_async_pool()
+            async with connection_pool.connection() as conn:
+                await _apply_statement_timeout(conn, int(self.load_timeout_seconds * 1000))
+                async with conn.transaction():
+                    # Facts, dimensions and the data version from one snapshot
+                    await conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                    data_version = (await (await conn.execute(DATA_VERSION_SQL)).fetchone())[0]
+                    products = await (await conn.execute(PRODUCTS_SQL)).fetchall()
+                    customers = await (await conn.execute(CUSTOMERS_SQL)).fetchall()
+                    chunks = []
+                    async with conn.cursor() as cur:
+                        async with cur.copy(FACTS_COPY_SQL) as copy:
+                            async for chunk in copy:
+                                chunks.append(bytes(chunk))
+        finally:
+            slots.release()
+
+        payload = b"".join(chunks)
+        del chunks
+        facts = await asyncio.to_thread(
+            lambda: build_fact_columns(_decode_facts(payload), products, customers, data_version, started)
+        )
+        self.loads += 1
+        logger.info(
+            f"Columnar facts loaded | rows={facts.row_count} | bytes={facts.nbytes} | "
+            f"data_version={data_version} | duration_ms={facts.load_ms}"
+        )
+        return facts
+
+    async def window_cube(self, bounds: Dict[str, datetime]) -> Tuple[List[str], List[List[Any]]]:
+        """window_comparison_cube columns computed from the in-memory facts, off the event loop."""
+        facts = await self.facts()
+        return await asyncio.to_thread(compute_window_cube, facts, bounds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot size, age and data version."""
+        facts = self._facts
+        return {
+            "enabled": columnar_engine_enabled(),
+            "loaded": facts is not None,
+            "rows": facts.row_count if facts else 0,
+            "bytes": facts.nbytes if facts else 0,
+            "data_version": facts.data_version if facts else None,
+            "loaded_at": facts.loaded_at if facts else None,
+            "load_ms": facts.load_ms if facts else None,
+            "loads": self.loads,
+        }
+
+
+# Process-wide engine (initialized lazily)
+_columnar_engine: Optional[ColumnarEngine] = None
+
+
+def get_columnar_engine() -> ColumnarEngine:
+    """Get or create the process-wide columnar engine."""
+    global _columnar_engine
+
+    if _columnar_engine is None:
+        _columnar_engine = ColumnarEngine(
+            version_poll_seconds=float(os.getenv("DATA_VERSION_POLL_SECONDS", "5")),
+            load_timeout_seconds=float(os.getenv("COLUMNAR_LOAD_TIMEOUT_SECONDS", "300")),
+        )
+
+    return _columnar_engine
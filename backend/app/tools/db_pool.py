@@ -0,0 +1,338 @@
+# tools/db_pool.py
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Handed to a waiter instead of a connection: a slot freed up, open a new one
+_OPEN_NEW = object()
+
+
+class PoolTimeoutError(RuntimeError):
+    """Raised when no pooled connection frees up within the acquire timeout."""
+
+
+class _Waiter:
+    __slots__ = ("event", "conn")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.conn: Any = None
+
+
+class BlockingConnectionPool:
+    """
+    Thread-safe psycopg2 pool that waits for a free connection instead of failing.
+
+    Drop-in for psycopg2.pool.ThreadedConnectionPool (getconn/putconn/closeall)
+    with these differences:
+    - When maxconn connections are checked out, getconn() queues the caller
+      (FIFO, at most max_waiters deep) for up to acquire_timeout seconds and
+      raises PoolTimeoutError after that, instead of raising PoolError at once.
+    - Borrowed connections are checked first. Closed or broken ones, and
+      those older than max_lifetime, are replaced. Connections idle for
+      longer than ping_after are pinged with SELECT 1.
+    - Connections returned inside a transaction are rolled back, then passed
+      to the optional reset callback (like psycopg_pool's reset=); a
+      connection the callback fails on is discarded.
+    - A daemon thread closes connections that stay idle longer than
+      max_idle, but keeps at least minconn connections open.
+    - stats() reports in-use/idle/waiting gauges and wait time counters.
+    """
+
+    def __init__(
+        self,
+        minconn: int,
+        maxconn: int,
+        *,
+        acquire_timeout: float = 5.0,
+        max_waiters: int = 64,
+        max_lifetime: float = 3600.0,
+        max_idle: float = 600.0,
+        ping_after: float = 5.0,
+        connect: Optional[Callable[[], Any]] = None,
+        reset: Optional[Callable[[Any], None]] = None,
+        **connect_kwargs: Any,
+    ) -> None:
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: minconn={minconn}, maxconn={maxconn}")
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.max_waiters = max_waiters
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self._connect = connect or (lambda: psycopg2.connect(**connect_kwargs))
+        self._reset = reset
+
+        self._lock = threading.Lock()
+        # Idle connections with the time they were returned; newest on the right
+        self._idle: Deque[Tuple[Any, float]] = deque()
+        self._waiters: Deque[_Waiter] = deque()
+        self._created_at: Dict[Any, float] = {}
+        # Open connections plus slots reserved for connections being opened
+        self._size = 0
+        self._in_use = 0
+        self.closed = False
+
+        self._counters = {
+            "requests": 0,
+            "waited": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "opened": 0,
+            "closed": 0,
+            "failed_checks": 0,
+        }
+        self._wait_ms_total = 0.0
+        self._wait_ms_max = 0.0
+
+        for _ in range(minconn):
+            conn = self._open()
+            with self._lock:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+
+        self._stop_reaper = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        if max_idle > 0 or max_lifetime > 0:
+            self._reaper = threading.Thread(target=self._reap_loop, name="db-pool-reaper", daemon=True)
+            self._reaper.start()
+
+    def _open(self) -> Any:
+        conn = self._connect()
+        with self._lock:
+            self._created_at[conn] = time.monotonic()
+            self._counters["opened"] += 1
+        return conn
+
+    def _close(self, conn: Any) -> None:
+        with self._lock:
+            self._created_at.pop(conn, None)
+            self._counters["closed"] += 1
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f"Error closing pooled connection: {e}")
+
+    def _expired(self, conn: Any, now: float) -> bool:
+        created_at = self._created_at.get(conn)
+        return self.max_lifetime > 0 and created_at is not None and now - created_at > self.max_lifetime
+
+    def _release_slot(self) -> None:
+        """Give up one slot (lock held): a waiter gets to open a connection, or the pool shrinks."""
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.conn = _OPEN_NEW
+            waiter.event.set()
+        else:
+            self._size -= 1
+
+    def _healthy(self, conn: Any, idle_for: float) -> bool:
+        """Check a borrowed connection; only connections idle past ping_after cost a round trip."""
+        if conn.closed:
+            return False
+        status = conn.get_transaction_status()
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        if idle_for < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            if not conn.autocommit:
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _prepare(self, conn: Any, returned_at: Optional[float]) -> Any:
+        """Hand out conn if it passes its checks, otherwise a fresh connection in the same slot."""
+        now = time.monotonic()
+        if conn is not _OPEN_NEW:
+            if not self._expired(conn, now) and self._healthy(conn, now - (returned_at or now)):
+                return conn
+            with self._lock:
+                self._counters["failed_checks"] += 1
+            logger.warning("Replacing stale or broken pooled connection")
+            self._close(conn)
+
+        try:
+            return self._open()
+        except Exception:
+            with self._lock:
+                self._in_use -= 1
+                self._release_slot()
+            raise
+
+    def getconn(self, timeout: Optional[float] = None) -> Any:
+        """
+        Borrow a connection, waiting up to timeout (default: acquire_timeout) seconds.
+
+        Raises:
+            PoolTimeoutError: If the wait queue is full or no connection frees up in time
+            psycopg2.pool.PoolError: If the pool is closed
+            psycopg2.OperationalError: If a new connection cannot be opened
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+
+        waiter = None
+        with self._lock:
+            if self.closed:
+                raise psycopg2.pool.PoolError("connection pool is closed")
+            self._counters["requests"] += 1
+            if self._idle:
+                conn, returned_at = self._idle.pop()
+                self._in_use += 1
+            elif self._size < self.maxconn:
+                conn, returned_at = _OPEN_NEW, None
+                self._size += 1
+                self._in_use += 1
+            elif len(self._waiters) >= self.max_waiters:
+                self._counters["rejected"] += 1
+                raise PoolTimeoutError(
+                    f"Connection pool exhausted: {self.maxconn} in use and {len(self._waiters)} callers waiting."
+                )
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+                self._counters["waited"] += 1
+
+        # Connection checks and connects run outside the lock
+        if waiter is None:
+            return self._prepare(conn, returned_at)
+
+        t0 = time.monotonic()
+        waiter.event.wait(timeout)
+        waited_ms = (time.monotonic() - t0) * 1000
+
+        with self._lock:
+            self._wait_ms_total += waited_ms
+            self._wait_ms_max = max(self._wait_ms_max, waited_ms)
+            if waiter.conn is None:
+                # Timed out, or the pool was closed while waiting
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                if self.closed:
+                    raise psycopg2.pool.PoolError("connection pool is closed")
+                self._counters["timeouts"] += 1
+                raise PoolTimeoutError(f"No database connection freed up within {timeout}s.")
+            self._in_use += 1
+
+        return self._prepare(waiter.conn, None)
+
+    def putconn(self, conn: Any, close: bool = False) -> None:
+        """Return a borrowed connection; close=True (or a broken or expired connection) discards it."""
+        discard = close or self.closed or conn.closed or self._expired(conn, time.monotonic())
+        if not discard:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                logger.warning(f"Resetting pooled connection returned in transaction | status={status}")
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        if not discard and self._reset is not None:
+            try:
+                self._reset(conn)
+            except Exception as e:
+                logger.warning(f"Discarding pooled connection that failed to reset: {e}")
+                discard = True
+
+        if discard:
+            self._close(conn)
+
+        with self._lock:
+            self._in_use -= 1
+            if discard:
+                self._release_slot()
+            elif self._waiters:
+                # Hand the connection straight to the longest waiter
+                waiter = self._waiters.popleft()
+                waiter.conn = conn
+                waiter.event.set()
+            else:
+                self._idle.append((conn, time.monotonic()))
+
+    def reap(self) -> int:
+        """Close idle connections past max_idle (down to minconn) or max_lifetime; returns how many."""
+        now = time.monotonic()
+        victims = []
+        with self._lock:
+            keep: Deque[Tuple[Any, float]] = deque()
+            while self._idle:
+                conn, returned_at = self._idle.popleft()
+                idle_expired = self.max_idle > 0 and now - returned_at > self.max_idle
+                if self._expired(conn, now) or (idle_expired and self._size - len(victims) > self.minconn):
+                    victims.append(conn)
+                else:
+                    keep.append((conn, returned_at))
+            self._idle = keep
+            self._size -= len(victims)
+
+        for conn in victims:
+            self._close(conn)
+        if victims:
+            logger.info(f"Connection pool reaped | closed={len(victims)} | size={self._size}")
+        return len(victims)
+
+    def _reap_loop(self) -> None:
+        limits = [limit for limit in (self.max_idle, self.max_lifetime) if limit > 0]
+        interval = max(1.0, min(limits) / 4)
+        while not self._stop_reaper.wait(interval):
+            try:
+                self.reap()
+            except Exception as e:
+                logger.warning(f"Connection pool reaper failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Point-in-time gauges plus cumulative counters since the pool was created."""
+        with self._lock:
+            waited = self._counters["waited"]
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": len(self._waiters),
+                **{f"{name}_total": value for name, value in self._counters.items()},
+                "wait_ms_total": round(self._wait_ms_total, 2),
+                "wait_ms_avg": round(self._wait_ms_total / waited, 2) if waited else 0.0,
+                "wait_ms_max": round(self._wait_ms_max, 2),
+            }
+
+    def closeall(self) -> None:
+        """Close idle connections and fail pending waiters; in-use connections close when returned."""
+        with self._lock:
+            self.closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            waiters = list(self._waiters)
+            self._waiters.clear()
+
+        self._stop_reaper.set()
+        for waiter in waiters:
+            waiter.event.set()
+        for conn in idle:
+            self._close(conn)
@@ -0,0 +1,240 @@
+# tools/drilldown.py
+from __future__ import annotations
+
+import logging
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence
+
+from pydantic import BaseModel
+
+from app.tools.async_sql_tool import run_sql_async
+from app.tools.window_cube import _pct_change, _round
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Grouping expression per drill-down dimension (the only SQL spliced into the query)
+DIMENSION_EXPRESSIONS = {
+    "country": "COALESCE(c.country, 'Unknown')",
+    "stock_code": "p.stock_code",
+    "customer_id": "COALESCE(i.customer_id::text, 'Unknown')",
+}
+
+METRIC_EXPRESSIONS = {
+    "revenue": "(ii.quantity::numeric * p.unit_price::numeric)",
+    "units": "ii.quantity::numeric",
+}
+
+DEFAULT_PATH = ("country", "stock_code", "customer_id")
+
+# Parent path values are joined with the ASCII unit separator into one key
+_KEY_SEPARATOR = "\x1f"
+
+# One level of the drill-down: every kept parent branch is aggregated and
+# ranked in the same query, so each level costs one scan of both windows
+_LEVEL_SQL = """
+WITH base AS (
+  SELECT
+    {parent_expr} AS parent_key,
+    {member_expr} AS member,
+    (ii.invoice_date >= %(current_start_ts)s AND ii.invoice_date < %(current_end_ts)s) AS in_current,
+    (ii.invoice_date >= %(prior_start_ts)s AND ii.invoice_date < %(prior_end_ts)s) AS in_prior,
+    {metric_expr} AS value
+  FROM invoice_items ii
+  JOIN invoices i ON i.invoice_no = ii.invoice_no AND i.invoice_date = ii.invoice_date
+  JOIN products p ON p.stock_code = ii.stock_code
+  LEFT JOIN customers c ON c.customer_id = i.customer_id
+  WHERE ((ii.invoice_date >= %(prior_start_ts)s AND ii.invoice_date < %(prior_end_ts)s)
+     OR (ii.invoice_date >= %(current_start_ts)s AND ii.invoice_date < %(current_end_ts)s))
+    -- Same windows on invoices, so its partitions are pruned too
+    AND ((i.invoice_date >= %(prior_start_ts)s AND i.invoice_date < %(prior_end_ts)s)
+     OR (i.invoice_date >= %(current_start_ts)s AND i.invoice_date < %(current_end_ts)s))
+    AND {parent_expr} = ANY(%(parent_keys)s)
+),
+members AS (
+  SELECT
+    parent_key,
+    member,
+    SUM(CASE WHEN in_current THEN value ELSE 0 END) AS current_value,
+    SUM(CASE WHEN in_prior THEN value ELSE 0 END) AS prior_value
+  FROM base
+  GROUP BY parent_key, member
+),
+ranked AS (
+  SELECT
+    *,
+    current_value - prior_value AS change,
+    ROW_NUMBER() OVER (PARTITION BY parent_key ORDER BY ABS(current_value - prior_value) DESC, member) AS rank,
+    COUNT(*) OVER (PARTITION BY parent_key) AS member_count,
+    SUM(current_value) OVER (PARTITION BY parent_key) AS parent_current,
+    SUM(prior_value) OVER (PARTITION BY parent_key) AS parent_prior
+  FROM members
+)
+SELECT parent_key, member, current_value, prior_value, change, rank, member_count, parent_current, parent_prior
+FROM ranked
+WHERE rank <= %(top_n)s
+ORDER BY parent_key, rank
+"""
+
+
+class DrillDownWindows(BaseModel):
+    current_start_ts: datetime
+    current_end_ts: datetime
+    prior_start_ts: datetime
+    prior_end_ts: datetime
+
+
+def _parent_expression(path: Sequence[str]) -> str:
+    if not path:
+        return "''"
+    return f"concat_ws(chr(31), {', '.join(DIMENSION_EXPRESSIONS[d] for d in path)})"
+
+
+def _share_pct(part: Decimal, whole: Decimal) -> Optional[Decimal]:
+    return _round(part / whole * 100, 2) if whole != 0 else None
+
+
+async def run_drilldown(
+    params: Dict[str, Any],
+    *,
+    path: Sequence[str] = DEFAULT_PATH,
+    metric: str = "revenue",
+    top_n: int = 5,
+    expand_n: int = 3,
+    timeout_seconds: Optional[float] = None,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """
+    Explain a KPI change top-down, one dimension per level.
+
+    Level 1 ranks every member of path[0] by absolute contribution to the
+    change between the windows. Each following level only aggregates the
+    expand_n strongest branches of the level above (e.g. the SKUs of the
+    top countries), all branches of a level in one query, so the number of
+    groups touched grows with top_n and expand_n, not with the size of the
+    full dimension cross product.
+
+    Args:
+        params: The four window bounds (current/prior start/end timestamps)
+        path: Dimensions to drill through, in order (default: country, stock_code, customer_id)
+        metric: 'revenue' or 'units' (default: 'revenue')
+        top_n: Contributors reported per branch (default: 5)
+        expand_n: Branches per node expanded into the next level (default: 3)
+        timeout_seconds: Statement timeout for each level's query
+        use_cache: Serve/store level results from the result cache (default: True)
+
+    Returns:
+        Dictionary with the overall change ('total'), the contributor
+        'tree' (nodes carry their 'children'), and 'stats' with the
+        queries run and groups aggregated per level.
+
+    Raises:
+        ValueError: If params, path, metric or limits are invalid
+        Same exceptions as run_sql_async().
+    """
+    try:
+        windows = DrillDownWindows(**(params or {})).model_dump()
+    except Exception as e:
+        raise ValueError(f"Invalid drill-down window parameters: {e}") from None
+    if not path or len(set(path)) != len(path) or any(d not in DIMENSION_EXPRESSIONS for d in path):
+        raise ValueError(f"path must list distinct dimensions from {tuple(DIMENSION_EXPRESSIONS)}.")
+    if metric not in METRIC_EXPRESSIONS:
+        raise ValueError(f"Unknown metric: {metric}. Expected one of {tuple(METRIC_EXPRESSIONS)}.")
+    if top_n < 1 or expand_n < 0:
+        raise ValueError("top_n must be >= 1 and expand_n >= 0.")
+
+    t0 = time.time()
+    tree: List[Dict[str, Any]] = []
+    total: Dict[str, Any] = {}
+    level_stats: List[Dict[str, Any]] = []
+
+    # Nodes whose children the next level fills in, keyed by their path key
+    frontier: Dict[str, List[Dict[str, Any]]] = {"": tree}
+
+    for depth, dimension in enumerate(path):
+        sql = _LEVEL_SQL.format(
+            parent_expr=_parent_expression(path[:depth]),
+            member_expr=DIMENSION_EXPRESSIONS[dimension],
+            metric_expr=METRIC_EXPRESSIONS[metric],
+        )
+        result = await run_sql_async(
+            sql,
+            {**windows, "parent_keys": list(frontier), "top_n": top_n},
+            max_rows=len(frontier) * top_n,
+            timeout_seconds=timeout_seconds,
+            use_cache=use_cache,
+            prepare=True,
+            name=f"drilldown.{dimension}",
+        )
+
+        groups = 0
+        next_frontier: Dict[str, List[Dict[str, Any]]] = {}
+        seen_parents = set()
+        for row in result["rows"]:
+            parent_key = row["parent_key"]
+            if parent_key not in seen_parents:
+                seen_parents.add(parent_key)
+                groups += row["member_count"]
+            parent_change = row["parent_current"] - row["parent_prior"]
+
+            if depth == 0 and not total:
+                total = {
+                    "current": _round(row["parent_current"], 2),
+                    "prior": _round(row["parent_prior"], 2),
+                    "change": _round(parent_change, 2),
+                    "pct_change": _pct_change(row["parent_current"], row["parent_prior"]),
+                }
+
+            node = {
+                "dimension": dimension,
+                "value": row["member"],
+                "current": _round(row["current_value"], 2),
+                "prior": _round(row["prior_value"], 2),
+                "change": _round(row["change"], 2),
+                "pct_change": _pct_change(row["current_value"], row["prior_value"]),
+                "share_of_parent_change_pct": _share_pct(row["change"], parent_change),
+                "rank": row["rank"],
+                "siblings": row["member_count"],
+            }
+            frontier[parent_key].append(node)
+
+            if depth + 1 < len(path) and row["rank"] <= expand_n:
+                node["children"] = []
+                child_key = row["member"] if depth == 0 else f"{parent_key}{_KEY_SEPARATOR}{row['member']}"
+                next_frontier[child_key] = node["children"]
+
+        level_stats.append({
+            "dimension": dimension,
+            "branches": len(frontier),
+            "groups_aggregated": groups,
+            "rows": result["row_count"],
+            "duration_ms": result["duration_ms"],
+            "cache": result["cache"],
+        })
+
+        frontier = next_frontier
+        if not frontier:
+            break
+
+    elapsed_ms = int((time.time() - t0) * 1000)
+    groups_total = sum(level["groups_aggregated"] for level in level_stats)
+
+    logger.info(
+        f"Drill-down | path={'>'.join(path)} | metric={metric} | "
+        f"levels={len(level_stats)} | groups={groups_total} | duration_ms={elapsed_ms}"
+    )
+
+    return {
+        "metric": metric,
+        "path": list(path),
+        "total": total or {"current": None, "prior": None, "change": None, "pct_change": None},
+        "tree": tree,
+        "stats": {
+            "queries": len(level_stats),
+            "groups_aggregated": groups_total,
+            "levels": level_stats,
+            "duration_ms": elapsed_ms,
+        },
+    }
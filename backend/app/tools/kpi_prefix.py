@@ -0,0 +1,243 @@
+# tools/kpi_prefix.py
+from __future__ import annotations
+
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+from pydantic import BaseModel
+
+from app.tools.async_sql_tool import run_sql_async
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Window pairs answered by one query
+MAX_WINDOWS = 1000
+
+_BOUNDS = ("current_start_ts", "current_end_ts", "prior_start_ts", "prior_end_ts")
+
+# Running totals of the member as of the day before one window bound
+# (db/migrations/004_kpi_prefix_sums.sql); no row means nothing sold yet
+_LOOKUP_SQL = """
+LEFT JOIN LATERAL (
+  SELECT revenue, units, invoices, active_days
+  FROM kpi_prefix_sums
+  WHERE dimension = %(dimension)s AND member = %(member)s AND day < w.{bound}
+  ORDER BY day DESC
+  LIMIT 1
+) {alias} ON TRUE"""
+
+# Every window pair costs four index lookups. Pairs with a day still waiting
+# in rollup_dirty_days are aggregated from the line-level tables instead, as
+# the KPI templates do, so results are never stale. The output columns and
+# expressions are kpi_trend_window_comparison's.
+_WINDOWS_SQL = """
+WITH w AS (
+  SELECT
+    n,
+    current_start_ts::date AS current_start,
+    current_end_ts::date AS current_end,
+    prior_start_ts::date AS prior_start,
+    prior_end_ts::date AS prior_end,
+    EXISTS (
+      SELECT 1
+      FROM rollup_dirty_days d
+      WHERE (d.day >= prior_start_ts AND d.day < prior_end_ts)
+         OR (d.day >= current_start_ts AND d.day < current_end_ts)
+    ) AS dirty
+  FROM unnest(
+    %(current_start_ts)s::timestamp[], %(current_end_ts)s::timestamp[],
+    %(prior_start_ts)s::timestamp[], %(prior_end_ts)s::timestamp[]
+  ) WITH ORDINALITY AS b(current_start_ts, current_end_ts, prior_start_ts, prior_end_ts, n)
+),
+prefix_metrics AS (
+  SELECT
+    w.n,
+    COALESCE(ce.revenue, 0) - COALESCE(cs.revenue, 0) AS current_revenue,
+    (COALESCE(ce.units, 0) - COALESCE(cs.units, 0))::numeric AS current_units,
+    COALESCE(ce.invoices, 0) - COALESCE(cs.invoices, 0) AS current_invoices,
+    COALESCE(pe.revenue, 0) - COALESCE(ps.revenue, 0) AS prior_revenue,
+    (COALESCE(pe.units, 0) - COALESCE(ps.units, 0))::numeric AS prior_units,
+    COALESCE(pe.invoices, 0) - COALESCE(ps.invoices, 0) AS prior_invoices,
+    -- Neither window has a day with sales: NULL sums, as in the template
+    (COALESCE(ce.active_days, 0) - COALESCE(cs.active_days, 0)
+      + COALESCE(pe.active_days, 0) - COALESCE(ps.active_days, 0)) = 0 AS empty
+  FROM w{lookups}
+  WHERE NOT w.dirty
+),
+line_metrics AS (
+  SELECT w.n, l.*
+  FROM w
+  CROSS JOIN LATERAL (
+    SELECT
+      SUM(CASE WHEN ii.invoice_date >= w.current_start AND ii.invoice_date < w.current_end
+        THEN ii.quantity::numeric * p.unit_price::numeric ELSE 0 END) AS current_revenue,
+      SUM(CASE WHEN ii.invoice_date >= w.current_start AND ii.invoice_date < w.current_end
+        THEN ii.quantity::numeric ELSE 0 END) AS current_units,
+      COUNT(DISTINCT CASE WHEN ii.invoice_date >= w.current_start AND ii.invoice_date < w.current_end
+        THEN ii.invoice_no END) AS current_invoices,
+      SUM(CASE WHEN ii.invoice_date >= w.prior_start AND ii.invoice_date < w.prior_end
+        THEN ii.quantity::numeric * p.unit_price::numeric ELSE 0 END) AS prior_revenue,
+      SUM(CASE WHEN ii.invoice_date >= w.prior_start AND ii.invoice_date < w.prior_end
+        THEN ii.quantity::numeric ELSE 0 END) AS prior_units,
+      COUNT(DISTINCT CASE WHEN ii.invoice_date >= w.prior_start AND ii.invoice_date < w.prior_end
+        THEN ii.invoice_no END) AS prior_invoices
+    FROM invoice_items ii
+    JOIN invoices i ON i.invoice_no = ii.invoice_no AND i.invoice_date = ii.invoice_date
+    JOIN products p ON p.stock_code = ii.stock_code
+    LEFT JOIN customers c ON c.customer_id = i.customer_id
+    WHERE ((ii.invoice_date >= w.prior_start AND ii.invoice_date < w.prior_end)
+       OR (ii.invoice_date >= w.current_start AND ii.invoice_date < w.current_end))
+      AND ((i.invoice_date >= w.prior_start AND i.invoice_date < w.prior_end)
+       OR (i.invoice_date >= w.current_start AND i.invoice_date < w.current_end))
+      AND (%(dimension)s = 'all' OR COALESCE(c.country, 'Unknown') = %(member)s)
+  ) l
+  WHERE w.dirty
+),
+period_metrics AS (
+  SELECT
+    n, 'prefix' AS source,
+    CASE WHEN NOT empty THEN current_revenue END AS current_revenue,
+    CASE WHEN NOT empty THEN current_units END AS current_units,
+    current_invoices,
+    CASE WHEN NOT empty THEN prior_revenue END AS prior_revenue,
+    CASE WHEN NOT empty THEN prior_units END AS prior_units,
+    prior_invoices
+  FROM prefix_metrics
+  UNION ALL
+  SELECT n, 'lines', current_revenue, current_units, current_invoices, prior_revenue, prior_units, prior_invoices
+  FROM line_metrics
+)
+SELECT
+  ROUND(current_revenue, 2) AS current_revenue,
+  ROUND(prior_revenue, 2) AS prior_revenue,
+  ROUND((current_revenue - prior_revenue), 2) AS revenue_change,
+  CASE
+    WHEN prior_revenue = 0 THEN NULL
+    ELSE ROUND((current_revenue - prior_revenue) / prior_revenue, 6)
+  END AS revenue_pct_change,
+  ROUND(current_units, 2) AS current_units,
+  ROUND(prior_units, 2) AS prior_units,
+  ROUND((current_units - prior_units), 2) AS units_change,
+  CASE
+    WHEN prior_units = 0 THEN NULL
+    ELSE ROUND((current_units - prior_units) / prior_units, 6)
+  END AS units_pct_change,
+  CASE
+    WHEN current_invoices > 0 THEN ROUND(current_revenue / current_invoices, 2)
+    ELSE NULL
+  END AS current_aov,
+  CASE
+    WHEN prior_invoices > 0 THEN ROUND(prior_revenue / prior_invoices, 2)
+    ELSE NULL
+  END AS prior_aov,
+  CASE
+    WHEN current_invoices > 0 AND prior_invoices > 0 THEN
+      ROUND((current_revenue / current_invoices) - (prior_revenue / prior_invoices), 2)
+    ELSE NULL
+  END AS aov_change,
+  current_invoices,
+  prior_invoices,
+  source
+FROM period_metrics
+ORDER BY n
+""".format(lookups="".join(
+    _LOOKUP_SQL.format(bound=bound, alias=alias)
+    for bound, alias in (
+        ("current_start", "cs"), ("current_end", "ce"), ("prior_start", "ps"), ("prior_end", "pe"),
+    )
+))
+
+
+class KpiWindowPair(BaseModel):
+    current_start_ts: datetime
+    current_end_ts: datetime
+    prior_start_ts: datetime
+    prior_end_ts: datetime
+
+
+def _parse_windows(windows: Sequence[Dict[str, Any]]) -> Dict[str, List[datetime]]:
+    """Validate the window pairs and transpose them into one array per bound."""
+    if not windows or len(windows) > MAX_WINDOWS:
+        raise ValueError(f"windows must hold between 1 and {MAX_WINDOWS} window pairs.")
+
+    columns: Dict[str, List[datetime]] = {bound: [] for bound in _BOUNDS}
+    for i, params in enumerate(windows):
+        try:
+            pair = KpiWindowPair(**(params or {}))
+        except Exception as e:
+            raise ValueError(f"Invalid window pair {i}: {e}") from None
+        for bound in _BOUNDS:
+            value = getattr(pair, bound)
+            if value.tzinfo is not None or value != datetime.combine(value.date(), datetime.min.time()):
+                raise ValueError(f"Window pair {i}: {bound} must be a date or a timezone-naive midnight timestamp.")
+            columns[bound].append(value)
+    return columns
+
+
+async def run_kpi_windows(
+    windows: Sequence[Dict[str, Any]],
+    *,
+    country: Optional[str] = None,
+    timeout_seconds: Optional[float] = None,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """
+    KPI deltas for many day-aligned window pairs from the prefix-sum index.
+
+    Each window's revenue, units and invoice count is the difference of two
+    running totals in kpi_prefix_sums, so a pair costs four index lookups
+    whatever its length, and all pairs run in one query. Pairs with a day
+    awaiting refresh_daily_sales_rollup() are aggregated from the line-level
+    tables instead (source='lines').
+
+    Args:
+        windows: Window pairs, each with the four bounds of
+            kpi_trend_window_comparison (current/prior start/end); every
+            bound must fall on midnight
+        country: Restrict every window to one country (COALESCE(country,
+            'Unknown') as in the rollups); None for all countries
+        timeout_seconds: Statement timeout for the query
+        use_cache: Serve/store the result from the result cache (default: True)
+
+    Returns:
+        Dictionary with 'rows' (one kpi_trend_window_comparison row per
+        pair, in input order, plus its 'source'), query_hash, cache and
+        duration_ms.
+
+    Raises:
+        ValueError: If there are no pairs, too many, or a bound is invalid
+        Same exceptions as run_sql_async().
+    """
+    params: Dict[str, Any] = {
+        **_parse_windows(windows),
+        "dimension": "all" if country is None else "country",
+        "member": "" if country is None else country,
+    }
+
+    t0 = time.time()
+    result = await run_sql_async(
+        _WINDOWS_SQL,
+        params,
+        max_rows=len(windows),
+        timeout_seconds=timeout_seconds,
+        use_cache=use_cache,
+        prepare=True,
+        name="kpi_prefix_windows",
+    )
+    elapsed_ms = int((time.time() - t0) * 1000)
+
+    lines = sum(row["source"] == "lines" for row in result["rows"])
+    logger.info(
+        f"KPI windows | hash={result['query_hash']} | pairs={len(windows)} | "
+        f"from_lines={lines} | duration_ms={elapsed_ms} | cache={result['cache']}"
+    )
+
+    return {
+        "rows": result["rows"],
+        "query_hash": result["query_hash"],
+        "cache": result["cache"],
+        "duration_ms": elapsed_ms,
+    }
@@ -0,0 +1,288 @@
+# tools/metrics.py
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 5000, 10000, 100000, 1000000)
+BYTE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB .. 256 MiB
+
+# Label used once METRICS_MAX_QUERY_LABELS distinct queries have been seen
+OVERFLOW_LABEL = "other"
+
+# Scrape-time sample from a collector: (name, type, help, label names, {label values: value})
+Sample = Tuple[str, str, str, Tuple[str, ...], Dict[Tuple[str, ...], Optional[float]]]
+
+
+class _Metric:
+    def __init__(
+        self,
+        name: str,
+        kind: str,
+        help_text: str,
+        label_names: Tuple[str, ...],
+        buckets: Tuple[float, ...] = (),
+    ):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms recorded into per-thread shards.
+
+    Each thread (the event loop thread included) writes only to its own
+    shard, so recording takes no lock: one dict lookup, a bisect and two
+    list increments. Shards are summed when /metrics is scraped.
+    """
+
+    def __init__(self, max_query_labels: int = 200, enabled: bool = True):
+        self.max_query_labels = max_query_labels
+        self.enabled = enabled
+        self._metrics: Dict[str, _Metric] = {}
+        self._shards: List[Dict[Tuple[str, Tuple[str, ...]], List[float]]] = []
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+        self._query_labels: set = set()
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> None:
+        self._metrics[name] = _Metric(name, "counter", help_text, tuple(label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str], buckets: Sequence[float]) -> None:
+        self._metrics[name] = _Metric(name, "histogram", help_text, tuple(label_names), tuple(buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        """Register a callable sampled at scrape time, e.g. for pool gauges."""
+        self._collectors.append(collector)
+
+    def _shard(self) -> Dict[Tuple[str, Tuple[str, ...]], List[float]]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            return shard
+
+    def query_label(self, label: str) -> str:
+        """Cap the number of distinct query label values, folding the rest into 'other'."""
+        if label in self._query_labels:
+            return label
+        with self._shards_lock:
+            if len(self._query_labels) >= self.max_query_labels:
+                return OVERFLOW_LABEL
+            self._query_labels.add(label)
+        return label
+
+    def inc(self, name: str, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        shard = self._shard()
+        key = (name, labels)
+        slot = shard.get(key)
+        if slot is None:
+            slot = shard[key] = [0]
+        slot[0] += amount
+
+    def observe(self, name: str, labels: Tuple[str, ...], value: float) -> None:
+        # Slot layout: one count per bucket, then +Inf count, then sum
+        shard = self._shard()
+        key = (name, labels)
+        slot = shard.get(key)
+        if slot is None:
+            slot = shard[key] = [0] * (len(self._metrics[name].buckets) + 2)
+        slot[bisect_left(self._metrics[name].buckets, value)] += 1
+        slot[-1] += value
+
+    def _merged(self) -> Dict[Tuple[str, Tuple[str, ...]], List[float]]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        merged: Dict[Tuple[str, Tuple[str, ...]], List[float]] = {}
+        for shard in shards:
+            for key, slot in list(shard.items()):
+                total = merged.get(key)
+                if total is None:
+                    merged[key] = list(slot)
+                else:
+                    for i, value in enumerate(slot):
+                        total[i] += value
+        return merged
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        merged = self._merged()
+        by_metric: Dict[str, List[Tuple[Tuple[str, ...], List[float]]]] = {}
+        for (name, labels), slot in merged.items():
+            by_metric.setdefault(name, []).append((labels, slot))
+
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, slot in sorted(by_metric.get(metric.name, [])):
+                base = list(zip(metric.label_names, labels))
+                if metric.kind == "counter":
+                    lines.append(f"{metric.name}{_format_labels(base)} {_format_value(slot[0])}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), slot[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _format_value(bound)
+                    lines.append(f"{metric.name}_bucket{_format_labels(base + [('le', le)])} {int(cumulative)}")
+                lines.append(f"{metric.name}_sum{_format_labels(base)} {_format_value(slot[-1])}")
+                lines.append(f"{metric.name}_count{_format_labels(base)} {int(cumulative)}")
+
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, help_text, label_names, values in samples:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(values.items()):
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_format_labels(list(zip(label_names, labels)))} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(str(value))}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+@lru_cache(maxsize=2048)
+def query_fingerprint(sql: str) -> str:
+    """Stable short id of a query's text (parameters excluded), used as its metrics label."""
+    normalized = re.sub(r"\s+", " ", sql.strip().lower())
+    return "sql:" + hashlib.sha256(normalized.encode()).hexdigest()[:12]
+
+
+def estimate_payload_bytes(result: Dict[str, Any]) -> int:
+    """
+    Approximate a result's size from its first row times the row count.
+
+    Cheap enough for every query; exact sizing would walk every value.
+    """
+    row_count = result["row_count"]
+    if not row_count:
+        return 0
+    if "rows" in result:
+        row = result["rows"][0]
+        first = sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values())
+    else:
+        first = sum(sys.getsizeof(column[0]) for column in result["arrays"])
+    return first * row_count
+
+
+# Process-wide registry (initialized lazily)
+_registry: Optional[MetricsRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def metrics_enabled() -> bool:
+    """Query metrics are recorded unless METRICS_ENABLED is set to a false value."""
+    return os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """Get or create the process-wide metrics registry with the query metrics defined."""
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = MetricsRegistry(
+                    max_query_labels=int(os.getenv("METRICS_MAX_QUERY_LABELS", "200")),
+                    enabled=metrics_enabled(),
+                )
+                registry.histogram(
+                    "sql_query_duration_seconds",
+                    "Query latency by template name or query fingerprint.",
+                    ("query", "outcome"),
+                    DURATION_BUCKETS,
+                )
+                registry.histogram(
+                    "sql_query_rows",
+                    "Rows returned per query.",
+                    ("query",),
+                    ROW_BUCKETS,
+                )
+                registry.histogram(
+                    "sql_query_payload_bytes",
+                    "Approximate in-memory size of each query result.",
+                    ("query",),
+                    BYTE_BUCKETS,
+                )
+                registry.counter(
+                    "sql_query_errors_total",
+                    "Failed queries by type (timeout, capacity, error).",
+                    ("query", "type"),
+                )
+                _registry = registry
+
+    return _registry
+
+
+def record_query(
+    label: str,
+    outcome: str,
+    duration_seconds: float,
+    *,
+    row_count: Optional[int] = None,
+    payload_bytes: Optional[int] = None,
+) -> None:
+    """
+    Record one query execution.
+
+    Args:
+        label: Template name, or query_fingerprint() of ad-hoc SQL
+        outcome: 'ok', 'cached', 'streamed', 'timeout', 'capacity' or 'error'
+        duration_seconds: Wall time of the call
+        row_count: Rows returned, if the query succeeded
+        payload_bytes: Result size, e.g. from estimate_payload_bytes()
+    """
+    registry = _registry or get_metrics_registry()
+    if not registry.enabled:
+        return
+    query = registry.query_label(label)
+    if outcome in ("timeout", "capacity", "error"):
+        registry.inc("sql_query_errors_total", (query, outcome))
+        if outcome == "capacity":
+            # Rejected before reaching the database; no latency to record
+            return
+    registry.observe("sql_query_duration_seconds", (query, outcome), duration_seconds)
+    if row_count is not None:
+        registry.observe("sql_query_rows", (query,), row_count)
+    if payload_bytes is not None:
+        registry.observe("sql_query_payload_bytes", (query,), payload_bytes)
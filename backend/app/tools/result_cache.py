@@ -0,0 +1,199 @@
+# tools/result_cache.py
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# SQL that reads the data version counter (see db/migrations/002b_data_version.sql)
+DATA_VERSION_SQL = "SELECT version FROM data_version"
+
+
+@dataclass
+class _CacheEntry:
+    result: Dict[str, Any]
+    sql: str
+    params_repr: str
+    size_bytes: int
+    expires_at: float
+    data_version: Optional[int]
+
+
+def estimate_size(value: Any) -> int:
+    """Roughly estimate the in-memory size of a query result in bytes."""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    In-process LRU cache of query results keyed by query_hash.
+
+    Entries expire after a per-entry TTL, are evicted least-recently-used
+    first once the byte budget is exceeded, and are dropped wholesale when
+    the data version changes.
+    """
+
+    def __init__(self, max_bytes: int, default_ttl_seconds: float, version_poll_seconds: float = 5.0):
+        self.max_bytes = max_bytes
+        self.default_ttl_seconds = default_ttl_seconds
+        self.version_poll_seconds = version_poll_seconds
+
+        self._entries: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._data_version: Optional[int] = None
+        self._version_checked_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, sql: str, params: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Return the cached result for key, or None on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            # query_hash lowercases SQL, so confirm the exact statement matches
+            if (
+                entry.expires_at <= now
+                or entry.data_version != self._data_version
+                or entry.sql != sql
+                or entry.params_repr != repr(params)
+            ):
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.result
+
+    def put(
+        self,
+        key: Hashable,
+        sql: str,
+        params: Optional[Dict[str, Any]],
+        result: Dict[str, Any],
+        ttl_seconds: Optional[float] = None,
+        *,
+        data_version: Optional[int],
+    ) -> None:
+        """
+        Store a result, evicting least-recently-used entries past the byte budget.
+
+        data_version is the version read before the query ran (the
+        data_version property at lookup time). If the version has moved
+        since, the rows may predate the change, so they are not stored.
+        """
+        size_bytes = estimate_size(result)
+        if size_bytes > self.max_bytes:
+            return
+
+        ttl = self.default_ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            if data_version != self._data_version:
+                return
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = _CacheEntry(
+                result=result,
+                sql=sql,
+                params_repr=repr(params),
+                size_bytes=size_bytes,
+                expires_at=time.monotonic() + ttl,
+                data_version=data_version,
+            )
+            self._bytes += size_bytes
+
+            while self._bytes > self.max_bytes and self._entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size_bytes
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    @property
+    def data_version(self) -> Optional[int]:
+        """The data version entries are currently stored and served under."""
+        return self._data_version
+
+    def version_check_due(self) -> bool:
+        """True when the data version should be re-read from the database."""
+        return time.monotonic() - self._version_checked_at >= self.version_poll_seconds
+
+    def set_data_version(self, version: Optional[int]) -> None:
+        """Record the current data version, clearing the cache if it changed."""
+        self._version_checked_at = time.monotonic()
+        if version == self._data_version:
+            return
+
+        if self._data_version is not None:
+            logger.info(f"Data version changed {self._data_version} -> {version}; clearing result cache")
+            self.clear()
+        self._data_version = version
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current occupancy."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "data_version": self._data_version,
+            }
+
+
+# Process-wide cache shared by run_sql() and run_sql_async() (initialized lazily)
+_result_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> ResultCache:
+    """Get or create the process-wide result cache."""
+    global _result_cache
+
+    if _result_cache is None:
+        _result_cache = ResultCache(
+            max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            default_ttl_seconds=float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300")),
+            version_poll_seconds=float(os.getenv("DATA_VERSION_POLL_SECONDS", "5")),
+        )
+
+    return _result_cache
+
+
+def result_cache_enabled() -> bool:
+    """Result caching is on unless RESULT_CACHE_ENABLED is set to a false value."""
+    return os.getenv("RESULT_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
@@ -0,0 +1,62 @@
+# tools/serialization.py
+from __future__ import annotations
+
+import io
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+from uuid import UUID
+
+# Media type for Arrow IPC streaming format
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Supported /query response shapes
+ROW_FORMATS = ("rows", "columns")
+
+
+def json_default(value: Any) -> Any:
+    """json.dumps() fallback for the types psycopg returns."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, memoryview):
+        return value.tobytes().hex()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def rows_to_ndjson(rows: Iterable[Dict[str, Any]]) -> bytes:
+    """Encode a batch of row dicts as newline-delimited JSON."""
+    return b"".join(
+        json.dumps(row, default=json_default, separators=(",", ":")).encode() + b"\n"
+        for row in rows
+    )
+
+
+def rows_to_columns(names: Sequence[str], rows: Sequence[Tuple[Any, ...]]) -> List[List[Any]]:
+    """Transpose tuple rows straight from the cursor into one list per column."""
+    if not rows:
+        return [[] for _ in names]
+    return [list(column) for column in zip(*rows)]
+
+
+def columns_to_arrow_ipc(names: Sequence[str], arrays: Sequence[Sequence[Any]]) -> bytes:
+    """
+    Encode column arrays as an Arrow IPC stream.
+
+    Raises:
+        RuntimeError: If pyarrow is not installed
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise RuntimeError("Arrow output requires the 'pyarrow' package.") from None
+
+    table = pa.Table.from_arrays([pa.array(column) for column in arrays], names=list(names))
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
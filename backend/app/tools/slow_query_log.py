@@ -0,0 +1,291 @@
+# tools/slow_query_log.py
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import psycopg2
+
+from app.tools.metrics import query_fingerprint
+from app.tools.serialization import json_default
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_INSERT_SQL = """
+INSERT INTO slow_queries (
+  fingerprint, query_name, query_hash, sql, params_json, duration_ms, timed_out,
+  analyzed, plan_json, plan_execution_ms, plan_error
+) VALUES (
+  %(fingerprint)s, %(query_name)s, %(query_hash)s, %(sql)s, %(params_json)s::jsonb, %(duration_ms)s, %(timed_out)s,
+  %(analyzed)s, %(plan_json)s::jsonb, %(plan_execution_ms)s, %(plan_error)s
+)
+"""
+
+# Worst fingerprints over a lookback window, each with its most recent plan
+WORST_FINGERPRINTS_SQL = """
+WITH recent AS (
+  SELECT *
+  FROM slow_queries
+  WHERE captured_at >= NOW() - %(hours)s * INTERVAL '1 hour'
+),
+summary AS (
+  SELECT
+    fingerprint,
+    COUNT(*) AS captures,
+    COUNT(*) FILTER (WHERE timed_out) AS timeouts,
+    MAX(duration_ms) AS max_duration_ms,
+    ROUND(AVG(duration_ms)) AS avg_duration_ms,
+    MAX(captured_at) AS last_captured_at
+  FROM recent
+  GROUP BY fingerprint
+),
+latest AS (
+  SELECT DISTINCT ON (fingerprint)
+    fingerprint, query_name, query_hash, sql, params_json, duration_ms,
+    timed_out, analyzed, plan_json, plan_execution_ms, plan_error, captured_at
+  FROM recent
+  ORDER BY fingerprint, captured_at DESC
+)
+SELECT
+  s.fingerprint,
+  l.query_name,
+  s.captures,
+  s.timeouts,
+  s.max_duration_ms,
+  s.avg_duration_ms,
+  s.last_captured_at,
+  l.query_hash AS latest_query_hash,
+  l.sql AS latest_sql,
+  l.params_json AS latest_params,
+  l.duration_ms AS latest_duration_ms,
+  l.analyzed AS latest_analyzed,
+  l.plan_execution_ms AS latest_plan_execution_ms,
+  l.plan_error AS latest_plan_error,
+  l.plan_json AS latest_plan
+FROM summary s
+JOIN latest l USING (fingerprint)
+ORDER BY s.max_duration_ms DESC, s.captures DESC
+LIMIT %(limit)s
+"""
+
+
+class SlowQueryLog:
+    """
+    Opt-in recorder that snapshots the plans of slow queries.
+
+    Queries at or over threshold_ms are handed to a background thread that
+    re-runs them as EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) inside a
+    read-only transaction and stores the plan in slow_queries. Statements
+    that timed out get a plain EXPLAIN (estimated plan only), since
+    re-running them would time out again.
+
+    Re-running costs a second execution, so each fingerprint is captured at
+    most once per cooldown_seconds and at most max_pending captures wait at
+    a time; anything beyond that is skipped. The re-run plan is a custom
+    plan for the logged parameters, which can differ from a cached generic
+    plan used by a prepared template.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        threshold_ms: int,
+        *,
+        cooldown_seconds: float = 300.0,
+        explain_timeout_seconds: float = 60.0,
+        max_pending: int = 100,
+    ):
+        self.dsn = dsn
+        self.threshold_ms = threshold_ms
+        self.cooldown_seconds = cooldown_seconds
+        self.explain_timeout_seconds = explain_timeout_seconds
+
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_pending)
+        self._last_capture: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._conn = None
+
+        self.captured = 0
+        self.skipped = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run, name="slow-query-log", daemon=True)
+        self._thread.start()
+
+    def observe(
+        self,
+        name: Optional[str],
+        sql: str,
+        params: Optional[Dict[str, Any]],
+        query_hash: str,
+        duration_ms: int,
+        *,
+        timed_out: bool = False,
+    ) -> bool:
+        """Queue a plan capture if the query was slow and its fingerprint is off cooldown."""
+        if duration_ms < self.threshold_ms and not timed_out:
+            return False
+
+        fingerprint = name or query_fingerprint(sql)
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_capture.get(fingerprint)
+            if last is not None and now - last < self.cooldown_seconds:
+                self.skipped += 1
+                return False
+            self._last_capture[fingerprint] = now
+
+        try:
+            self._queue.put_nowait({
+                "fingerprint": fingerprint,
+                "query_name": name,
+                "query_hash": query_hash,
+                "sql": sql,
+                "params": params or {},
+                "duration_ms": duration_ms,
+                "timed_out": timed_out,
+            })
+        except queue.Full:
+            self.skipped += 1
+            return False
+
+        logger.info(
+            f"Slow query queued for EXPLAIN | fingerprint={fingerprint} | "
+            f"hash={query_hash} | duration_ms={duration_ms} | timed_out={timed_out}"
+        )
+        return True
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(self.dsn)
+        return self._conn
+
+    def _explain(self, cur, capture: Dict[str, Any]) -> Dict[str, Any]:
+        """Run the EXPLAIN in a read-only transaction; plan fields for the slow_queries row."""
+        analyze = not capture["timed_out"]
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+        try:
+            cur.execute("SET TRANSACTION READ ONLY")
+            cur.execute(f"SET LOCAL statement_timeout = {int(self.explain_timeout_seconds * 1000)}")
+            cur.execute(f"EXPLAIN ({options}) {capture['sql']}", capture["params"])
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return {
+                "analyzed": analyze,
+                "plan_json": json.dumps(plan),
+                "plan_execution_ms": plan[0].get("Execution Time") if analyze else None,
+                "plan_error": None,
+            }
+        except psycopg2.Error as e:
+            return {"analyzed": analyze, "plan_json": None, "plan_execution_ms": None, "plan_error": str(e).strip()}
+        finally:
+            # End the read-only transaction before the insert
+            if not cur.connection.closed:
+                cur.connection.rollback()
+
+    def _capture(self, capture: Dict[str, Any]) -> None:
+        conn = self._connection()
+        try:
+            with conn.cursor() as cur:
+                plan_fields = self._explain(cur, capture)
+                cur.execute(_INSERT_SQL, {
+                    **{key: capture[key] for key in ("fingerprint", "query_name", "query_hash", "sql", "duration_ms", "timed_out")},
+                    "params_json": json.dumps(capture["params"], default=json_default),
+                    **plan_fields,
+                })
+            conn.commit()
+            self.captured += 1
+            logger.info(
+                f"Slow query plan captured | fingerprint={capture['fingerprint']} | "
+                f"hash={capture['query_hash']} | analyzed={plan_fields['analyzed']} | "
+                f"plan_execution_ms={plan_fields['plan_execution_ms']} | error={plan_fields['plan_error']}"
+            )
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+
+    def _run(self) -> None:
+        while True:
+            capture = self._queue.get()
+            if capture is None:
+                break
+            try:
+                self._capture(capture)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Slow query capture failed | fingerprint={capture['fingerprint']} | error={e}")
+                if self._conn is not None and self._conn.closed:
+                    self._conn = None
+        if self._conn is not None:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": self.threshold_ms,
+            "pending": self._queue.qsize(),
+            "captured": self.captured,
+            "skipped": self.skipped,
+            "failed": self.failed,
+        }
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Finish queued captures (up to timeout seconds) and stop the thread."""
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+
+# Process-wide recorder (initialized lazily)
+_slow_query_log: Optional[SlowQueryLog] = None
+_slow_query_log_lock = threading.Lock()
+
+
+def get_slow_query_log() -> Optional[SlowQueryLog]:
+    """Get or create the slow-query recorder; None unless SLOW_QUERY_THRESHOLD_MS is set."""
+    global _slow_query_log
+
+    if _slow_query_log is None:
+        threshold = os.getenv("SLOW_QUERY_THRESHOLD_MS")
+        if not threshold:
+            return None
+        with _slow_query_log_lock:
+            if _slow_query_log is None:
+                # Captures are stored, so they need a writable (non-pooled) connection
+                dsn = os.getenv("TRACE_DATABASE_URL") or os.getenv("DATABASE_URL")
+                if not dsn:
+                    return None
+                _slow_query_log = SlowQueryLog(
+                    dsn,
+                    int(threshold),
+                    cooldown_seconds=float(os.getenv("SLOW_QUERY_COOLDOWN_SECONDS", "300")),
+                    explain_timeout_seconds=float(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT", "60")),
+                )
+                atexit.register(_slow_query_log.close)
+                logger.info(
+                    f"Slow query log enabled: threshold_ms={_slow_query_log.threshold_ms}, "
+                    f"cooldown={_slow_query_log.cooldown_seconds}s"
+                )
+
+    return _slow_query_log
+
+
+def close_slow_query_log() -> None:
+    """Finish pending captures and stop the recorder (called on application shutdown)."""
+    global _slow_query_log
+
+    if _slow_query_log is not None:
+        _slow_query_log.close()
+        _slow_query_log = None
@@ -6,12 +6,21 @@ import logging
 import os
 import re
 import time
-from typing import Any, Dict, List, Optional, Tuple
+import uuid
+import weakref
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import psycopg2
-from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
 
+from app.tools.db_pool import BlockingConnectionPool, PoolTimeoutError
+from app.tools.metrics import estimate_payload_bytes, query_fingerprint, record_query
+from app.tools.result_cache import DATA_VERSION_SQL, ResultCache, get_result_cache, result_cache_enabled
+from app.tools.serialization import ROW_FORMATS, rows_to_columns
+from app.tools.slow_query_log import get_slow_query_log
+from app.tools.trace_writer import current_run_id, trace_tool_call
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -20,18 +29,45 @@ DANGEROUS_KEYWORDS = (
     "insert", "update", "delete", "drop", "alter", "truncate",
     "create", "grant", "revoke", "comment", "vacuum", "analyze"
 )
+_DANGEROUS_KEYWORD_SET = frozenset(DANGEROUS_KEYWORDS)
+# Functions that change session state; set_config(..., false) would outlive
+# the query on the pooled connection
+DANGEROUS_FUNCTIONS = ("set_config",)
+_DANGEROUS_FUNCTION_SET = frozenset(DANGEROUS_FUNCTIONS)
+
+# One alternative per lexical element the read-only guard cares about;
+# tried in order at each position, so quoted text is consumed whole
+_sql_token_re = re.compile(
+    r"""
+      (?P<line_comment>--[^\n]*)
+    | (?P<block_comment>/\*)
+    | (?P<string>[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*')
+    | (?P<unicode_identifier>[uU]&")
+    | (?P<identifier>"(?:[^"]|"")*")
+    | (?P<unterminated>['"])
+    | (?P<dollar>\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$)
+    | (?P<placeholder>%\(\w+\)s)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<semicolon>;)
+    | (?P<other>[^'"$%;/\-A-Za-z_]+|.)
+    """,
+    flags=re.S | re.X,
+)
+_block_comment_edge_re = re.compile(r"/\*|\*/")
 
-_comment_re = re.compile(r"(--[^\n]*\n)|(/\*.*?\*/)", flags=re.S)
+# Pooled sessions are read-only at the server, so no query can write even if
+# it slips past the guard; applied at connect time, costing no round trip.
+# The pools' reset hooks restore the setting should a query turn it off.
+READ_ONLY_SESSION_OPTIONS = "-c default_transaction_read_only=on"
 
 # Connection pool (initialized lazily)
-_connection_pool: Optional[pool.ThreadedConnectionPool] = None
-
+_connection_pool: Optional[BlockingConnectionPool] = None
 
-def _strip_comments(sql: str) -> str:
-    return re.sub(_comment_re, "", sql)
+# statement_timeout (ms) currently set on each pooled connection
+_session_timeouts: "weakref.WeakKeyDictionary[Any, int]" = weakref.WeakKeyDictionary()
 
 
-def _get_connection_pool() -> pool.ThreadedConnectionPool:
+def _get_connection_pool() -> BlockingConnectionPool:
     """Get or create the connection pool."""
     global _connection_pool
     
@@ -43,14 +79,24 @@ def _get_connection_pool() -> pool.ThreadedConnectionPool:
         # Pool configuration
         min_conn = int(os.getenv("DB_POOL_MIN", "2"))
         max_conn = int(os.getenv("DB_POOL_MAX", "10"))
+        acquire_timeout = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5.0"))
         
         try:
-            _connection_pool = pool.ThreadedConnectionPool(
+            _connection_pool = BlockingConnectionPool(
                 minconn=min_conn,
                 maxconn=max_conn,
+                acquire_timeout=acquire_timeout,
+                max_waiters=int(os.getenv("DB_POOL_MAX_WAITERS", "64")),
+                max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "3600")),
+                max_idle=float(os.getenv("DB_POOL_MAX_IDLE", "600")),
+                reset=_reset_session,
                 dsn=dsn,
+                options=READ_ONLY_SESSION_OPTIONS,
+            )
+            logger.info(
+                f"Connection pool created: min={min_conn}, max={max_conn}, "
+                f"acquire_timeout={acquire_timeout}s"
             )
-            logger.info(f"Connection pool created: min={min_conn}, max={max_conn}")
         except Exception as e:
             logger.error(f"Failed to create connection pool: {e}")
             raise
@@ -58,6 +104,62 @@ def _get_connection_pool() -> pool.ThreadedConnectionPool:
     return _connection_pool
 
 
+def get_pool_stats() -> Optional[Dict[str, Any]]:
+    """Gauges and counters of the sync connection pool, or None if it was never created."""
+    return _connection_pool.stats() if _connection_pool is not None else None
+
+
+def _checkout(connection_pool: BlockingConnectionPool):
+    """
+    Take a connection from the pool, ready for an autocommit read-only query.
+
+    Waits up to DB_POOL_ACQUIRE_TIMEOUT for a free connection; the pool
+    has already replaced broken or expired connections and rolled back
+    any left inside a transaction.
+    """
+    conn = connection_pool.getconn()
+    if not conn.autocommit:
+        conn.autocommit = True
+    return conn
+
+
+def _statement_timeout_prefix(conn, timeout_ms: int) -> str:
+    """
+    SQL to prepend so the query runs with timeout_ms, sent in the same round trip.
+
+    Returns an empty string when the connection already has that timeout.
+    The SET is recorded optimistically; callers must call
+    _forget_session_timeout() if the statement fails, because a failed
+    multi-statement query rolls back its SET as well.
+    """
+    if _session_timeouts.get(conn) == timeout_ms:
+        return ""
+    _session_timeouts[conn] = timeout_ms
+    return f"SET statement_timeout = {timeout_ms}; "
+
+
+def _forget_session_timeout(conn) -> None:
+    if conn is not None:
+        _session_timeouts.pop(conn, None)
+
+
+def _reset_session(conn) -> None:
+    """
+    Pool reset hook: restore the session settings of a returned connection.
+
+    Postgres 14+ reports default_transaction_read_only to the client, so a
+    session that is still read-only costs no round trip. Otherwise RESET ALL
+    restores the connect-time options (and drops statement_timeout).
+    """
+    if conn.get_parameter_status("default_transaction_read_only") == "on":
+        return
+    logger.warning("Resetting pooled connection whose session is no longer read-only")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("RESET ALL")
+    _forget_session_timeout(conn)
+
+
 def _hash_query(sql: str, params: Optional[Dict[str, Any]] = None) -> str:
     """Generate a hash of the query for logging/tracking."""
     # Normalize SQL (strip whitespace, lowercase)
@@ -74,24 +176,152 @@ def _hash_query(sql: str, params: Optional[Dict[str, Any]] = None) -> str:
     return hashlib.sha256(query_str.encode()).hexdigest()[:16]
 
 
-def _is_read_only_sql(sql: str) -> None:
-    s = _strip_comments(sql).strip()
-    if not s:
-        raise ValueError("Empty SQL is not allowed.")
+def _refresh_data_version(connection_pool: BlockingConnectionPool, cache: ResultCache) -> None:
+    """Re-read the data version counter so the cache drops results from older loads."""
+    conn = _checkout(connection_pool)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(DATA_VERSION_SQL)
+            row = cur.fetchone()
+        cache.set_data_version(row[0] if row else None)
+    except psycopg2.Error as e:
+        # Databases created before data_version existed fall back to TTL-only expiry
+        logger.debug(f"Data version unavailable: {e}")
+        cache.set_data_version(None)
+    finally:
+        connection_pool.putconn(conn)
+
+
+def _trace_query(
+    name: Optional[str],
+    sql: str,
+    params: Optional[Dict[str, Any]],
+    query_hash: str,
+    duration_ms: int,
+    result: Optional[Dict[str, Any]] = None,
+    error: Optional[BaseException] = None,
+) -> None:
+    """Queue an agent_tool_calls trace for a query run inside an agent run (no-op otherwise)."""
+    if current_run_id.get() is None:
+        return
+    trace_tool_call(
+        name or "run_sql",
+        # Templates are identified by name; ad-hoc SQL is kept verbatim
+        input_json={"sql": None if name else sql, "params": params or {}, "query_hash": query_hash},
+        output_json={"row_count": result["row_count"], "cache": result["cache"]} if result is not None else None,
+        success=error is None,
+        error=f"{type(error).__name__}: {error}" if error is not None else None,
+        duration_ms=duration_ms,
+    )
+
+
+def _record_slow_query(
+    name: Optional[str],
+    sql: str,
+    params: Optional[Dict[str, Any]],
+    query_hash: str,
+    duration_ms: int,
+    timed_out: bool = False,
+) -> None:
+    """Hand a slow or timed-out query to the slow-query recorder, when SLOW_QUERY_THRESHOLD_MS is set."""
+    slow_query_log = get_slow_query_log()
+    if slow_query_log is not None:
+        slow_query_log.observe(name, sql, params, query_hash, duration_ms, timed_out=timed_out)
+
+
+def _scan_sql(sql: str) -> Iterator[Tuple[str, str]]:
+    """
+    Single-pass SQL lexer for the read-only guard.
+
+    Yields ('word', lowered_word) for bare words, ('identifier', lowered_name)
+    for quoted identifiers and (';', ';') for statement separators. String
+    literals (including E'' escapes), dollar-quoted bodies, nested comments
+    and psycopg placeholders are skipped, so keywords inside them are never
+    matched.
+
+    Raises:
+        ValueError: If a string, identifier, comment or dollar quote is
+            unterminated, or an identifier is Unicode-escaped (U&"...")
+    """
+    pos, n = 0, len(sql)
+    while pos < n:
+        token = _sql_token_re.match(sql, pos)
+        kind = token.lastgroup
+        pos = token.end()
+
+        if kind == "word":
+            yield "word", token.group().lower()
+        elif kind == "identifier":
+            # Quoted names can still call functions: "set_config"(...)
+            yield "identifier", token.group()[1:-1].replace('""', '"').lower()
+        elif kind == "unicode_identifier":
+            raise ValueError('Unicode-escaped identifiers (U&"...") are not allowed.')
+        elif kind == "semicolon":
+            yield ";", ";"
+        elif kind == "block_comment":
+            # Postgres block comments nest
+            depth = 1
+            while depth:
+                edge = _block_comment_edge_re.search(sql, pos)
+                if edge is None:
+                    raise ValueError("Unterminated block comment.")
+                depth += 1 if edge.group() == "/*" else -1
+                pos = edge.end()
+        elif kind == "dollar":
+            end = sql.find(token.group(), pos)
+            if end < 0:
+                raise ValueError("Unterminated dollar-quoted string.")
+            pos = end + len(token.group())
+        elif kind == "unterminated":
+            raise ValueError("Unterminated quoted string or identifier.")
+
+
+@lru_cache(maxsize=1024)
+def _read_only_verdict(sql: str) -> Optional[str]:
+    """Classify one SQL text; returns the rejection reason, or None if read-only."""
+    try:
+        tokens = list(_scan_sql(sql))
+    except ValueError as e:
+        return str(e)
+
+    if not tokens:
+        return "Empty SQL is not allowed."
 
-    # Block multiple statements (simple but effective MVP guardrail)
     # Allow one trailing semicolon
-    if ";" in s[:-1]:
-        raise ValueError("Multiple SQL statements are not allowed.")
+    if tokens[-1][0] == ";":
+        tokens.pop()
+    if any(kind == ";" for kind, _ in tokens):
+        return "Multiple SQL statements are not allowed."
+    if not tokens:
+        return "Empty SQL is not allowed."
+
+    if tokens[0][0] != "word" or tokens[0][1] not in READ_ONLY_FIRST_KEYWORDS:
+        return "Only SELECT/WITH queries are allowed in run_sql()."
 
-    first = s.split(None, 1)[0].lower()
-    if first not in READ_ONLY_FIRST_KEYWORDS:
-        raise ValueError("Only SELECT/WITH queries are allowed in run_sql().")
+    for kind, word in tokens:
+        if kind == "word" and word in _DANGEROUS_KEYWORD_SET:
+            return f"Disallowed keyword detected: {word}"
+        if word in _DANGEROUS_FUNCTION_SET:
+            return f"Disallowed function detected: {word}"
 
-    lowered = s.lower()
-    for kw in DANGEROUS_KEYWORDS:
-        if re.search(rf"\b{kw}\b", lowered):
-            raise ValueError(f"Disallowed keyword detected: {kw}")
+    return None
+
+
+def _is_read_only_sql(sql: str) -> None:
+    """
+    Reject anything but a single SELECT/WITH statement.
+
+    Verdicts are memoized by SQL text (surrounding whitespace ignored), so
+    repeated template and API queries skip the lexer entirely.
+
+    Raises:
+        ValueError: If the SQL is empty, not read-only, has several
+            statements or contains a disallowed keyword or function outside
+            literals
+    """
+    reason = _read_only_verdict(sql.strip())
+    if reason is not None:
+        raise ValueError(reason)
 
 
 def run_sql(
@@ -100,6 +330,9 @@ def run_sql(
     *,
     max_rows: int = 5000,
     timeout_seconds: Optional[float] = None,
+    use_cache: bool = True,
+    row_format: str = "rows",
+    name: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     Execute a read-only query and return rows as dicts.
@@ -110,29 +343,39 @@ def run_sql(
     - Row limit enforcement
     - Query timeout support
     - Query hashing and logging
+    - Result caching keyed by query_hash (TTL, LRU, data-version invalidation)
     
     Args:
         sql: SQL query string (SELECT or WITH statements only)
         params: Optional dictionary of named parameters
         max_rows: Maximum number of rows to return (default: 5000)
         timeout_seconds: Query timeout in seconds (default: None, uses DB_POOL_TIMEOUT env var or 30s)
+        use_cache: Serve/store the result from the result cache (default: True)
+        row_format: 'rows' (list of dicts) or 'columns' (column arrays) (default: 'rows')
+        name: Template or analysis name used as the metrics label (default: query fingerprint)
     
     Returns:
         Dictionary with:
         - row_count: Number of rows returned
         - duration_ms: Query execution time in milliseconds
-        - rows: List of row dictionaries
+        - rows: List of row dictionaries (row_format='rows')
+        - columns, arrays: Column names and one value list per column (row_format='columns')
         - query_hash: SHA256 hash of the query (first 16 chars)
+        - cache: 'hit', 'miss' or 'bypass'
     
     Raises:
         ValueError: If query is not read-only or contains dangerous keywords
         RuntimeError: If DATABASE_URL is not set or connection pool fails
+        PoolTimeoutError: If no pooled connection frees up within DB_POOL_ACQUIRE_TIMEOUT
         psycopg2.extensions.QueryCanceledError: If query exceeds timeout
     """
     _is_read_only_sql(sql)
+    if row_format not in ROW_FORMATS:
+        raise ValueError(f"Unsupported row_format: {row_format}. Expected one of {ROW_FORMATS}.")
     
     # Generate query hash for logging
     query_hash = _hash_query(sql, params)
+    metric_label = name or query_fingerprint(sql)
     
     # Get timeout (from parameter, env var, or default)
     timeout = timeout_seconds
@@ -144,21 +387,42 @@ def run_sql(
     
     t0 = time.time()
     conn = None
+
+    # Serve repeated queries from the result cache
+    cache = get_result_cache() if use_cache and result_cache_enabled() else None
+    cache_key = (query_hash, max_rows, row_format)
+    if cache is not None:
+        if cache.version_check_due():
+            _refresh_data_version(connection_pool, cache)
+        # The version the query runs under; put() skips the store if it moves
+        cache_version = cache.data_version
+        cached = cache.get(cache_key, sql, params)
+        if cached is not None:
+            elapsed = time.time() - t0
+            elapsed_ms = int(elapsed * 1000)
+            logger.info(
+                f"Query cache hit | hash={query_hash} | "
+                f"duration_ms={elapsed_ms} | rows={cached['row_count']}"
+            )
+            record_query(
+                metric_label, "cached", elapsed,
+                row_count=cached["row_count"], payload_bytes=estimate_payload_bytes(cached),
+            )
+            result = {**cached, "duration_ms": elapsed_ms, "cache": "hit"}
+            _trace_query(name, sql, params, query_hash, elapsed_ms, result)
+            return result
     
     try:
-        # Get connection from pool
-        conn = connection_pool.getconn()
-        if conn is None:
-            raise RuntimeError("Failed to get connection from pool")
+        # Get an autocommit, read-only connection from the pool
+        conn = _checkout(connection_pool)
         
-        # Set query timeout
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Set statement timeout (PostgreSQL feature)
-            cur.execute(f"SET statement_timeout = {int(timeout * 1000)}")  # Convert to milliseconds
-            
-            # Execute query
-            cur.execute(sql, params or {})
+        # Columnar results are built from plain tuples, never per-row dicts
+        cursor_factory = RealDictCursor if row_format == "rows" else None
+        with conn.cursor(cursor_factory=cursor_factory) as cur:
+            # Execute query, changing statement_timeout in the same round trip only when needed
+            cur.execute(_statement_timeout_prefix(conn, int(timeout * 1000)) + sql, params or {})
             rows = cur.fetchmany(max_rows)
+            names = [column.name for column in cur.description or []]
         
         elapsed_ms = int((time.time() - t0) * 1000)
         
@@ -169,30 +433,161 @@ def run_sql(
             f"max_rows={max_rows} | timeout={timeout}s"
         )
         
-        return {
+        result = {
             "row_count": len(rows),
             "duration_ms": elapsed_ms,
-            "rows": rows,
             "query_hash": query_hash,
+            "cache": "bypass" if cache is None else "miss",
         }
+        if row_format == "columns":
+            result["columns"] = names
+            result["arrays"] = rows_to_columns(names, rows)
+        else:
+            result["rows"] = rows
+        if cache is not None:
+            cache.put(cache_key, sql, params, result, data_version=cache_version)
+        record_query(
+            metric_label, "ok", time.time() - t0,
+            row_count=len(rows), payload_bytes=estimate_payload_bytes(result),
+        )
+        _trace_query(name, sql, params, query_hash, elapsed_ms, result)
+        _record_slow_query(name, sql, params, query_hash, elapsed_ms)
+
+        return result
     
     except psycopg2.extensions.QueryCanceledError as e:
+        _forget_session_timeout(conn)
         elapsed_ms = int((time.time() - t0) * 1000)
         logger.warning(
             f"Query timeout | hash={query_hash} | "
             f"duration_ms={elapsed_ms} | timeout={timeout}s | error={str(e)}"
         )
+        record_query(metric_label, "timeout", time.time() - t0)
+        _trace_query(name, sql, params, query_hash, elapsed_ms, error=e)
+        _record_slow_query(name, sql, params, query_hash, elapsed_ms, timed_out=True)
         raise
     
     except Exception as e:
+        _forget_session_timeout(conn)
         elapsed_ms = int((time.time() - t0) * 1000)
         logger.error(
             f"Query failed | hash={query_hash} | "
             f"duration_ms={elapsed_ms} | error={str(e)}"
         )
+        record_query(metric_label, "capacity" if isinstance(e, PoolTimeoutError) else "error", time.time() - t0)
+        _trace_query(name, sql, params, query_hash, elapsed_ms, error=e)
         raise
     
     finally:
         # Return connection to pool
         if conn is not None:
             connection_pool.putconn(conn)
+
+
+def stream_sql(
+    sql: str,
+    params: Optional[Dict[str, Any]] = None,
+    *,
+    batch_size: int = 1000,
+    max_rows: Optional[int] = None,
+    timeout_seconds: Optional[float] = None,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Stream a read-only query in batches through a named (server-side) cursor.
+    
+    Unlike run_sql(), rows are fetched from Postgres batch_size at a time, so
+    memory stays flat for large exports. The pooled connection is held until
+    the generator is exhausted or closed. Results are never cached.
+    
+    Args:
+        sql: SQL query string (SELECT or WITH statements only)
+        params: Optional dictionary of named parameters
+        batch_size: Rows fetched per round trip (default: 1000)
+        max_rows: Optional cap on the total rows streamed (default: no cap)
+        timeout_seconds: Statement timeout applied to each fetch (default: DB_POOL_TIMEOUT or 30s)
+    
+    Yields:
+        Lists of row dictionaries, at most batch_size long.
+    
+    Raises:
+        Same exceptions as run_sql().
+    """
+    _is_read_only_sql(sql)
+    
+    # Generate query hash for logging
+    query_hash = _hash_query(sql, params)
+    metric_label = query_fingerprint(sql)
+    
+    # Get timeout (from parameter, env var, or default)
+    timeout = timeout_seconds
+    if timeout is None:
+        timeout = float(os.getenv("DB_POOL_TIMEOUT", "30.0"))
+    
+    # Get connection pool
+    connection_pool = _get_connection_pool()
+    
+    t0 = time.time()
+    conn = None
+    streamed = 0
+    
+    try:
+        # Get an autocommit, read-only connection from the pool
+        conn = _checkout(connection_pool)
+        
+        # Set statement timeout outside the cursor's transaction, only when it changes
+        timeout_prefix = _statement_timeout_prefix(conn, int(timeout * 1000))
+        if timeout_prefix:
+            with conn.cursor() as cur:
+                cur.execute(timeout_prefix)
+        
+        # Named cursors live inside a (read-only) transaction
+        conn.autocommit = False
+        cursor_name = f"stream_{query_hash}_{uuid.uuid4().hex[:8]}"
+        with conn.cursor(name=cursor_name, cursor_factory=RealDictCursor) as cur:
+            cur.itersize = batch_size
+            cur.execute(sql, params or {})
+            
+            while max_rows is None or streamed < max_rows:
+                size = batch_size if max_rows is None else min(batch_size, max_rows - streamed)
+                rows = cur.fetchmany(size)
+                if not rows:
+                    break
+                streamed += len(rows)
+                yield rows
+        
+        elapsed_ms = int((time.time() - t0) * 1000)
+        
+        # Log query execution
+        logger.info(
+            f"Query streamed | hash={query_hash} | "
+            f"duration_ms={elapsed_ms} | rows={streamed} | "
+            f"batch_size={batch_size} | timeout={timeout}s"
+        )
+        record_query(metric_label, "streamed", time.time() - t0, row_count=streamed)
+    
+    except psycopg2.extensions.QueryCanceledError as e:
+        elapsed_ms = int((time.time() - t0) * 1000)
+        logger.warning(
+            f"Query timeout | hash={query_hash} | "
+            f"duration_ms={elapsed_ms} | rows={streamed} | timeout={timeout}s | error={str(e)}"
+        )
+        record_query(metric_label, "timeout", time.time() - t0)
+        raise
+    
+    except Exception as e:
+        _forget_session_timeout(conn)
+        elapsed_ms = int((time.time() - t0) * 1000)
+        logger.error(
+            f"Query failed | hash={query_hash} | "
+            f"duration_ms={elapsed_ms} | rows={streamed} | error={str(e)}"
+        )
+        record_query(metric_label, "capacity" if isinstance(e, PoolTimeoutError) else "error", time.time() - t0)
+        raise
+    
+    finally:
+        # End the cursor's transaction and return connection to pool in autocommit mode
+        if conn is not None:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+            connection_pool.putconn(conn)
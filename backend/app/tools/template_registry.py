@@ -0,0 +1,258 @@
+# tools/template_registry.py
+from __future__ import annotations
+
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Type
+
+from pydantic import BaseModel, ConfigDict, ValidationError, create_model
+
+from app.tools.sql_tool import _is_read_only_sql
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Named pyformat placeholder, e.g. %(current_start_ts)s
+_placeholder_re = re.compile(r"%\((\w+)\)s")
+# Any '%' that is neither a named placeholder nor an escaped '%%'
+_stray_percent_re = re.compile(r"%(?!\(\w+\)s|%)")
+# Header parameter doc line, e.g. "--   top_n: Number of top contributors (default: 10)"
+_param_doc_re = re.compile(r"^--\s+(\w+):\s*(.*)$")
+_default_re = re.compile(r"\(default:\s*([^)]+)\)")
+
+# Locations probed once for sql/templates (Docker mount first, then repo checkout)
+_TEMPLATE_DIR_CANDIDATES = (
+    Path(__file__).resolve().parents[2] / "sql" / "templates",
+    Path(__file__).resolve().parents[3] / "sql" / "templates",
+)
+
+
+@dataclass
+class TemplateParam:
+    name: str
+    type: Type
+    default: Any = None
+    description: str = ""
+
+    @property
+    def required(self) -> bool:
+        return self.default is None
+
+
+@dataclass
+class SqlTemplate:
+    name: str
+    sql: str
+    path: Path
+    description: str = ""
+    params: Dict[str, TemplateParam] = field(default_factory=dict)
+    model: Optional[Type[BaseModel]] = None
+
+    def bind(self, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Validate and coerce caller params against the template's typed parameters.
+
+        Unknown keys are ignored (templates document a few params such as
+        'dimension' that the SQL does not consume).
+
+        Raises:
+            ValueError: If a required parameter is missing or has the wrong type
+        """
+        try:
+            validated = self.model(**(params or {}))
+        except ValidationError as e:
+            raise ValueError(f"Invalid parameters for template '{self.name}': {e}") from None
+        return validated.model_dump()
+
+    def describe(self) -> Dict[str, Any]:
+        """JSON-friendly summary for the /templates listing."""
+        return {
+            "name": self.name,
+            "description": self.description,
+            "params": [
+                {
+                    "name": p.name,
+                    "type": p.type.__name__,
+                    "required": p.required,
+                    "default": p.default,
+                    "description": p.description,
+                }
+                for p in self.params.values()
+            ],
+        }
+
+
+def _infer_type(name: str, doc: str, default: Any) -> Type:
+    """Infer a parameter's Python type from its name, header doc and default."""
+    if name.endswith("_ts") or "TIMESTAMP" in doc:
+        return datetime
+    if name.endswith("_date"):
+        return date
+    if isinstance(default, bool):
+        return bool
+    if isinstance(default, int):
+        return int
+    if isinstance(default, float) or name.endswith("_pct"):
+        return float
+    if name.endswith(("_n", "_min", "_max")):
+        return int
+    return str
+
+
+def _parse_default(raw: str) -> Any:
+    raw = raw.strip().strip("'\"")
+    for cast in (int, float):
+        try:
+            return cast(raw)
+        except ValueError:
+            continue
+    # Defaults like "current date" are descriptive, not literal values
+    return None if " " in raw else raw
+
+
+def _parse_header(sql: str) -> tuple[str, Dict[str, str]]:
+    """Split the leading comment block into a description and per-param docs."""
+    description_lines: List[str] = []
+    param_docs: Dict[str, str] = {}
+    in_params = False
+
+    for line in sql.splitlines():
+        stripped = line.strip()
+        if not stripped.startswith("--"):
+            if stripped:
+                break
+            continue
+
+        text = stripped[2:].strip()
+        if text.lower().startswith("parameters"):
+            in_params = True
+            continue
+
+        match = _param_doc_re.match(stripped)
+        if in_params and match:
+            param_docs[match.group(1)] = match.group(2).strip()
+        elif not in_params and text and not text.startswith("sql/") and not text.endswith(".sql"):
+            description_lines.append(text)
+
+    return " ".join(description_lines), param_docs
+
+
+def load_template(path: Path) -> SqlTemplate:
+    """
+    Load one template file and validate it.
+
+    Raises:
+        ValueError: If the SQL is not read-only or has malformed placeholders
+    """
+    name = path.stem
+    sql = path.read_text(encoding="utf-8")
+
+    _is_read_only_sql(sql)
+    stray = _stray_percent_re.search(_placeholder_re.sub("", sql).replace("%%", ""))
+    if stray:
+        line_no = sql[: stray.start()].count("\n") + 1
+        raise ValueError(f"Template '{name}' has an unescaped '%' near line {line_no}; use '%%'.")
+
+    description, param_docs = _parse_header(sql)
+
+    params: Dict[str, TemplateParam] = {}
+    for param_name in dict.fromkeys(_placeholder_re.findall(sql)):
+        doc = param_docs.get(param_name, "")
+        default_match = _default_re.search(doc)
+        default = _parse_default(default_match.group(1)) if default_match else None
+        param_type = _infer_type(param_name, doc, default)
+        if default is not None and param_type in (date, datetime):
+            default = None
+        params[param_name] = TemplateParam(
+            name=param_name,
+            type=param_type,
+            default=default,
+            description=_default_re.sub("", doc).strip(),
+        )
+
+    model = create_model(
+        f"{''.join(part.title() for part in name.split('_'))}Params",
+        __config__=ConfigDict(extra="ignore"),
+        **{
+            p.name: (p.type, ... if p.required else p.default)
+            for p in params.values()
+        },
+    )
+
+    return SqlTemplate(
+        name=name,
+        sql=sql,
+        path=path,
+        description=description,
+        params=params,
+        model=model,
+    )
+
+
+class TemplateRegistry:
+    """All sql/templates/*.sql files, loaded and validated once."""
+
+    def __init__(self, templates_dir: Path):
+        self.templates_dir = templates_dir
+        self._templates: Dict[str, SqlTemplate] = {}
+        # Templates that failed validation, by name, with the reason
+        self.errors: Dict[str, str] = {}
+
+        for path in sorted(templates_dir.glob("*.sql")):
+            try:
+                template = load_template(path)
+            except ValueError as e:
+                logger.error(f"Skipping invalid template {path.name}: {e}")
+                self.errors[path.stem] = str(e)
+                continue
+            self._templates[template.name] = template
+
+        logger.info(f"Template registry loaded {len(self._templates)} templates from {templates_dir}")
+
+    def get(self, name: str) -> SqlTemplate:
+        """
+        Look up a template by name, with or without the .sql suffix.
+
+        Raises:
+            KeyError: If no such template exists
+        """
+        key = name[:-4] if name.endswith(".sql") else name
+        try:
+            return self._templates[key]
+        except KeyError:
+            raise KeyError(f"Unknown template: {name}") from None
+
+    def names(self) -> List[str]:
+        return list(self._templates)
+
+    def __iter__(self):
+        return iter(self._templates.values())
+
+
+def _resolve_templates_dir() -> Path:
+    env_dir = os.getenv("SQL_TEMPLATES_DIR")
+    candidates = [Path(env_dir)] if env_dir else list(_TEMPLATE_DIR_CANDIDATES)
+
+    for candidate in candidates:
+        if candidate.is_dir():
+            return candidate
+
+    raise RuntimeError(f"SQL templates directory not found. Tried: {[str(p) for p in candidates]}")
+
+
+# Registry (initialized lazily, or eagerly at API startup)
+_template_registry: Optional[TemplateRegistry] = None
+
+
+def get_template_registry() -> TemplateRegistry:
+    """Get or create the template registry."""
+    global _template_registry
+
+    if _template_registry is None:
+        _template_registry = TemplateRegistry(_resolve_templates_dir())
+
+    return _template_registry
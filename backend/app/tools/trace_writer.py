@@ -0,0 +1,386 @@
+# tools/trace_writer.py
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from app.tools.serialization import json_default
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Agent run the current request / task belongs to; tool calls are traced only when set
+current_run_id: ContextVar[Optional[str]] = ContextVar("current_run_id", default=None)
+
+BACKPRESSURE_POLICIES = ("drop", "block")
+
+# Columns written per record kind (besides the JSON encoding, values go in as-is)
+_RUN_COLUMNS = ("id", "created_at", "status", "inputs_json", "result_json", "memo_md", "confidence", "duration_ms", "error")
+_TOOL_CALL_COLUMNS = ("id", "run_id", "ts", "tool_name", "input_json", "output_json", "success", "error", "duration_ms")
+_FINDING_COLUMNS = ("id", "run_id", "finding_type", "title", "data_json", "created_at")
+
+# Runs are upserted: a later record for the same run (e.g. its completion)
+# fills in status and results without touching what was recorded first
+_UPSERT_RUNS_SQL = f"""
+INSERT INTO agent_runs ({", ".join(_RUN_COLUMNS)}) VALUES %s
+ON CONFLICT (id) DO UPDATE SET
+  status = EXCLUDED.status,
+  inputs_json = CASE WHEN agent_runs.inputs_json = '{{}}'::jsonb THEN EXCLUDED.inputs_json ELSE agent_runs.inputs_json END,
+  result_json = COALESCE(EXCLUDED.result_json, agent_runs.result_json),
+  memo_md = COALESCE(EXCLUDED.memo_md, agent_runs.memo_md),
+  confidence = COALESCE(EXCLUDED.confidence, agent_runs.confidence),
+  duration_ms = COALESCE(EXCLUDED.duration_ms, agent_runs.duration_ms),
+  error = COALESCE(EXCLUDED.error, agent_runs.error)
+"""
+_RUN_TEMPLATE = "(%s, COALESCE(%s::timestamptz, NOW()), %s::agent_run_status, %s::jsonb, %s::jsonb, %s, %s, %s, %s)"
+
+# Tool calls may name a run the writer has not seen (e.g. one owned by the
+# agent process); a placeholder row keeps the foreign key satisfied
+_ENSURE_RUNS_SQL = "INSERT INTO agent_runs (id, inputs_json) VALUES %s ON CONFLICT (id) DO NOTHING"
+_ENSURE_RUN_TEMPLATE = "(%s, '{}'::jsonb)"
+
+_INSERT_TOOL_CALLS_SQL = f"INSERT INTO agent_tool_calls ({', '.join(_TOOL_CALL_COLUMNS)}) VALUES %s"
+_TOOL_CALL_TEMPLATE = "(%s, %s, %s, %s, %s::jsonb, %s::jsonb, %s, %s, %s)"
+
+_INSERT_FINDINGS_SQL = f"INSERT INTO agent_findings ({', '.join(_FINDING_COLUMNS)}) VALUES %s"
+_FINDING_TEMPLATE = "(%s, %s, %s::agent_finding_type, %s, %s::jsonb, %s)"
+
+
+def _to_json(value: Any) -> Optional[str]:
+    return None if value is None else json.dumps(value, default=json_default)
+
+
+class TraceWriter:
+    """
+    Background writer for agent_runs, agent_tool_calls and agent_findings.
+
+    Callers only put a record on a bounded in-memory queue. A daemon thread
+    takes records off it in batches (up to batch_size, or whatever arrived
+    within flush_interval seconds) and writes each batch in one transaction
+    with multi-row INSERTs, on its own writable connection.
+
+    When the queue is full, policy 'drop' discards the new record and counts
+    it, so the request path never waits. Policy 'block' makes the caller
+    wait for space; use it only off the event loop, e.g. in batch scripts.
+    close() stops accepting records, flushes what is queued and joins the thread.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        *,
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        policy: str = "drop",
+    ):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown trace backpressure policy: {policy}. Expected one of {BACKPRESSURE_POLICIES}.")
+
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+
+        self._queue: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue(maxsize=max_queue)
+        self._conn = None
+        self._stopping = threading.Event()
+        self._closed = False
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, kind: str, record: Dict[str, Any]) -> bool:
+        """Queue one record ('run', 'tool_call' or 'finding'); returns False if it was dropped."""
+        if self._closed:
+            self.dropped += 1
+            return False
+        try:
+            if self.policy == "block":
+                self._queue.put((kind, record))
+            else:
+                self._queue.put_nowait((kind, record))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"Trace queue full; dropping records | dropped={self.dropped}")
+            return False
+        self.enqueued += 1
+        return True
+
+    def _next_batch(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Block for the first record, then collect more until batch_size or flush_interval."""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self) -> List[Tuple[str, Dict[str, Any]]]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+        # Shutdown: flush everything still queued
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write(batch)
+
+        if self._conn is not None:
+            self._conn.close()
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(self.dsn)
+        return self._conn
+
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        runs: Dict[str, Dict[str, Any]] = {}
+        tool_calls: List[Tuple[Any, ...]] = []
+        findings: List[Tuple[Any, ...]] = []
+        referenced_runs = set()
+
+        for kind, record in batch:
+            if kind == "run":
+                # One row per run per statement; later fields win, unset ones are kept
+                merged = runs.setdefault(record["id"], {})
+                merged.update({key: value for key, value in record.items() if value is not None})
+            elif kind == "tool_call":
+                referenced_runs.add(record["run_id"])
+                tool_calls.append(tuple(
+                    _to_json(record.get(c)) if c in ("input_json", "output_json") else record.get(c)
+                    for c in _TOOL_CALL_COLUMNS
+                ))
+            elif kind == "finding":
+                referenced_runs.add(record["run_id"])
+                findings.append(tuple(
+                    _to_json(record.get(c)) if c == "data_json" else record.get(c)
+                    for c in _FINDING_COLUMNS
+                ))
+
+        run_rows = [
+            tuple(
+                _to_json(run.get(c, {} if c == "inputs_json" else None)) if c.endswith("_json")
+                else run.get(c, "running" if c == "status" else None)
+                for c in _RUN_COLUMNS
+            )
+            for run in runs.values()
+        ]
+        stub_rows = [(run_id,) for run_id in referenced_runs - runs.keys()]
+
+        for attempt in (1, 2):
+            conn = None
+            try:
+                conn = self._connection()
+                with conn.cursor() as cur:
+                    if run_rows:
+                        execute_values(cur, _UPSERT_RUNS_SQL, run_rows, template=_RUN_TEMPLATE, page_size=len(run_rows))
+                    if stub_rows:
+                        execute_values(cur, _ENSURE_RUNS_SQL, stub_rows, template=_ENSURE_RUN_TEMPLATE, page_size=len(stub_rows))
+                    if tool_calls:
+                        execute_values(cur, _INSERT_TOOL_CALLS_SQL, tool_calls, template=_TOOL_CALL_TEMPLATE, page_size=len(tool_calls))
+                    if findings:
+                        execute_values(cur, _INSERT_FINDINGS_SQL, findings, template=_FINDING_TEMPLATE, page_size=len(findings))
+                conn.commit()
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                # Lost connection: reconnect and retry the batch once
+                if conn is not None:
+                    conn.close()
+                if attempt == 2:
+                    self.failed += len(batch)
+                    logger.error(f"Trace batch failed | records={len(batch)} | error={e}")
+            except Exception as e:
+                if conn is not None and not conn.closed:
+                    conn.rollback()
+                self.failed += len(batch)
+                logger.error(f"Trace batch failed | records={len(batch)} | error={e}")
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop accepting records and flush the queue (waits up to timeout seconds)."""
+        if self._closed:
+            return
+        self._closed = True
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"Trace writer did not finish flushing within {timeout}s | queued={self._queue.qsize()}")
+        else:
+            logger.info(f"Trace writer closed | written={self.written} | dropped={self.dropped} | failed={self.failed}")
+
+
+# Process-wide writer (initialized lazily)
+_trace_writer: Optional[TraceWriter] = None
+_trace_writer_lock = threading.Lock()
+
+
+def tracing_enabled() -> bool:
+    """Agent traces are written only when TRACE_ENABLED is set to a true value."""
+    return os.getenv("TRACE_ENABLED", "").lower() in ("1", "true", "yes")
+
+
+def get_trace_writer() -> Optional[TraceWriter]:
+    """Get or create the process-wide trace writer; None if tracing is off or unconfigured."""
+    global _trace_writer
+
+    if _trace_writer is None and tracing_enabled():
+        with _trace_writer_lock:
+            if _trace_writer is None:
+                # Pooled query sessions are read-only, so traces use their own connection
+                dsn = os.getenv("TRACE_DATABASE_URL") or os.getenv("DATABASE_URL")
+                if not dsn:
+                    return None
+                _trace_writer = TraceWriter(
+                    dsn,
+                    max_queue=int(os.getenv("TRACE_QUEUE_SIZE", "10000")),
+                    batch_size=int(os.getenv("TRACE_BATCH_SIZE", "500")),
+                    flush_interval=float(os.getenv("TRACE_FLUSH_INTERVAL", "1.0")),
+                    policy=os.getenv("TRACE_BACKPRESSURE", "drop"),
+                )
+                atexit.register(_trace_writer.close)
+                logger.info(
+                    f"Trace writer started: queue={_trace_writer._queue.maxsize}, "
+                    f"batch_size={_trace_writer.batch_size}, policy={_trace_writer.policy}"
+                )
+
+    return _trace_writer
+
+
+def close_trace_writer() -> None:
+    """Flush queued traces and stop the writer (called on application shutdown)."""
+    global _trace_writer
+
+    if _trace_writer is not None:
+        _trace_writer.close()
+        _trace_writer = None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def trace_run(
+    run_id: str,
+    *,
+    status: str = "running",
+    inputs: Optional[Dict[str, Any]] = None,
+    result: Optional[Dict[str, Any]] = None,
+    memo_md: Optional[str] = None,
+    confidence: Optional[float] = None,
+    duration_ms: Optional[int] = None,
+    error: Optional[str] = None,
+) -> None:
+    """Record an agent run or update it (e.g. with its final status); fields left as None are kept."""
+    writer = get_trace_writer()
+    if writer is None:
+        return
+    writer.submit("run", {
+        "id": run_id,
+        "created_at": _now() if inputs is not None else None,
+        "status": status,
+        "inputs_json": inputs,
+        "result_json": result,
+        "memo_md": memo_md,
+        "confidence": confidence,
+        "duration_ms": duration_ms,
+        "error": error,
+    })
+
+
+def trace_tool_call(
+    tool_name: str,
+    *,
+    input_json: Optional[Dict[str, Any]] = None,
+    output_json: Optional[Dict[str, Any]] = None,
+    success: bool = True,
+    error: Optional[str] = None,
+    duration_ms: Optional[int] = None,
+    run_id: Optional[str] = None,
+) -> None:
+    """Record one tool call under run_id (default: current_run_id); a no-op outside a run."""
+    run_id = run_id or current_run_id.get()
+    if run_id is None:
+        return
+    writer = get_trace_writer()
+    if writer is None:
+        return
+    writer.submit("tool_call", {
+        "id": str(uuid.uuid4()),
+        "run_id": run_id,
+        "ts": _now(),
+        "tool_name": tool_name,
+        "input_json": input_json,
+        "output_json": output_json,
+        "success": success,
+        "error": error,
+        "duration_ms": duration_ms,
+    })
+
+
+def trace_finding(run_id: str, finding_type: str, title: str, data: Dict[str, Any]) -> None:
+    """Record a finding (headline, contributor, hypothesis, evidence_table or note) for a run."""
+    writer = get_trace_writer()
+    if writer is None:
+        return
+    writer.submit("finding", {
+        "id": str(uuid.uuid4()),
+        "run_id": run_id,
+        "finding_type": finding_type,
+        "title": title,
+        "data_json": data,
+        "created_at": _now(),
+    })
@@ -0,0 +1,385 @@
+# tools/window_cube.py
+from __future__ import annotations
+
+import logging
+import time
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.tools.async_sql_tool import run_sql_async
+from app.tools.metrics import record_query
+from app.tools.sql_tool import _hash_query
+from app.tools.template_registry import get_template_registry
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+CUBE_TEMPLATE = "window_comparison_cube"
+
+# Upper bound on cube rows fetched; the finest grain has one row per
+# country x stock_code x customer_id present in either window
+CUBE_MAX_ROWS = 1_000_000
+
+# grouping_id values produced by GROUPING(country, stock_code, customer_id)
+GRAIN_DETAIL = 0
+GRAIN_IDS = {
+    "totals": 7,
+    "country": 3,
+    "stock_code": 5,
+    "customer_id": 6,
+}
+
+DIMENSIONS = ("country", "stock_code", "customer_id")
+
+# "sql" runs the cube template; "columnar" computes the same cube in process
+ENGINES = ("sql", "columnar")
+
+_ZERO = Decimal(0)
+
+
+def _round(value: Optional[Decimal], places: int) -> Optional[Decimal]:
+    """Round like Postgres ROUND(numeric, n): half away from zero."""
+    if value is None:
+        return None
+    rounded = value.quantize(Decimal(1).scaleb(-places), rounding=ROUND_HALF_UP)
+    # Postgres numeric has no negative zero
+    return rounded.copy_abs() if rounded == 0 else rounded
+
+
+def _pct_change(current: Decimal, prior: Decimal) -> Optional[Decimal]:
+    return None if prior == 0 else _round((current - prior) / prior, 6)
+
+
+def _share_pct(value: Decimal, total: Optional[Decimal]) -> Decimal:
+    return _round(value / total * 100, 2) if total is not None and total > 0 else _ZERO
+
+
+class WindowCube:
+    """
+    Rows of the window_comparison_cube template, indexed by grain.
+
+    The template returns each grain as a contiguous block ordered by
+    absolute revenue change, with contribution ranks and row filters already
+    computed, so each method only does arithmetic on the rows it outputs.
+    Each method reproduces the output rows of one of the RCA templates
+    (same columns, rounding, filters and ordering) without another scan.
+    """
+
+    def __init__(self, names: Sequence[str], arrays: Sequence[Sequence[Any]]):
+        self.columns: Dict[str, Sequence[Any]] = dict(zip(names, arrays))
+        self.grains: Dict[int, range] = {}
+
+        grouping_ids = self.columns.get("grouping_id", [])
+        start = 0
+        for i in range(1, len(grouping_ids) + 1):
+            if i == len(grouping_ids) or grouping_ids[i] != grouping_ids[start]:
+                self.grains[grouping_ids[start]] = range(start, i)
+                start = i
+
+    def _grain(self, dimension: Optional[str]) -> range:
+        if dimension is None:
+            return self.grains.get(GRAIN_DETAIL, range(0))
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {dimension}. Expected one of {DIMENSIONS}.")
+        return self.grains.get(GRAIN_IDS[dimension], range(0))
+
+    def _totals(self) -> Optional[Dict[str, Any]]:
+        rows = self.grains.get(GRAIN_IDS["totals"])
+        # Empty windows aggregate to NULL sums, as in the templates
+        if not rows or self.columns["current_revenue"][rows[0]] is None:
+            return None
+        i = rows[0]
+        return {
+            "current_revenue": self.columns["current_revenue"][i],
+            "prior_revenue": self.columns["prior_revenue"][i],
+            "current_units": Decimal(self.columns["current_quantity"][i]),
+            "prior_units": Decimal(self.columns["prior_quantity"][i]),
+            "current_invoices": self.columns["current_invoices"][i],
+            "prior_invoices": self.columns["prior_invoices"][i],
+        }
+
+    def kpi_trend(self) -> List[Dict[str, Any]]:
+        """Rows of kpi_trend_window_comparison."""
+        totals = self._totals()
+        if totals is None:
+            return [{
+                "current_revenue": None, "prior_revenue": None, "revenue_change": None,
+                "revenue_pct_change": None, "current_units": None, "prior_units": None,
+                "units_change": None, "units_pct_change": None, "current_aov": None,
+                "prior_aov": None, "aov_change": None, "current_invoices": 0, "prior_invoices": 0,
+            }]
+
+        cur_rev, prior_rev = totals["current_revenue"], totals["prior_revenue"]
+        cur_units, prior_units = totals["current_units"], totals["prior_units"]
+        cur_inv, prior_inv = totals["current_invoices"], totals["prior_invoices"]
+
+        return [{
+            "current_revenue": _round(cur_rev, 2),
+            "prior_revenue": _round(prior_rev, 2),
+            "revenue_change": _round(cur_rev - prior_rev, 2),
+            "revenue_pct_change": _pct_change(cur_rev, prior_rev),
+            "current_units": _round(cur_units, 2),
+            "prior_units": _round(prior_units, 2),
+            "units_change": _round(cur_units - prior_units, 2),
+            "units_pct_change": _pct_change(cur_units, prior_units),
+            "current_aov": _round(cur_rev / cur_inv, 2) if cur_inv > 0 else None,
+            "prior_aov": _round(prior_rev / prior_inv, 2) if prior_inv > 0 else None,
+            "aov_change": (
+                _round(cur_rev / cur_inv - prior_rev / prior_inv, 2)
+                if cur_inv > 0 and prior_inv > 0 else None
+            ),
+            "current_invoices": cur_inv,
+            "prior_invoices": prior_inv,
+        }]
+
+    def top_contributors(self, top_n: int = 10, dimension: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Rows of top_contributors (detail grain, or one dimension's grain)."""
+        totals = self._totals()
+        if totals is None:
+            return []
+        # Every grain partitions the same line items, so its changes sum to the totals
+        total_rev_change = totals["current_revenue"] - totals["prior_revenue"]
+        total_units_change = totals["current_units"] - totals["prior_units"]
+
+        col = self.columns
+        rev_pos, rev_neg = col["revenue_rank_positive"], col["revenue_rank_negative"]
+        units_pos, units_neg = col["units_rank_positive"], col["units_rank_negative"]
+        rev_change, units_change = col["revenue_change"], col["units_change"]
+
+        def contributor_type(value) -> str:
+            return "positive" if value > 0 else "negative" if value < 0 else "neutral"
+
+        output = []
+        for i in self._grain(dimension):
+            if not col["is_contributor"][i]:
+                continue
+            rev_c, units_c = rev_change[i], units_change[i]
+            if not (
+                (rev_pos[i] <= top_n and rev_c > 0) or (rev_neg[i] <= top_n and rev_c < 0)
+                or (units_pos[i] <= top_n and units_c > 0) or (units_neg[i] <= top_n and units_c < 0)
+            ):
+                continue
+
+            prior_rev = col["prior_revenue"][i]
+            cur_units, prior_units = Decimal(col["current_quantity"][i]), Decimal(col["prior_quantity"][i])
+            units_c = Decimal(units_c)
+            output.append({
+                "country": col["country"][i],
+                "stock_code": col["stock_code"][i],
+                "customer_id": col["customer_id"][i],
+                "product_description": col["product_description"][i],
+                "current_revenue": _round(col["current_revenue"][i], 2),
+                "prior_revenue": _round(prior_rev, 2),
+                "revenue_contribution": _round(rev_c, 2),
+                "revenue_pct_change": _round(rev_c / prior_rev, 6) if prior_rev != 0 else None,
+                "revenue_contribution_pct": _round(rev_c / total_rev_change * 100, 2) if total_rev_change != 0 else None,
+                "revenue_contributor_type": contributor_type(rev_c),
+                "revenue_rank": rev_pos[i] if rev_c > 0 else rev_neg[i],
+                "current_units": _round(cur_units, 2),
+                "prior_units": _round(prior_units, 2),
+                "units_contribution": _round(units_c, 2),
+                "units_pct_change": _round(units_c / prior_units, 6) if prior_units != 0 else None,
+                "units_contribution_pct": _round(units_c / total_units_change * 100, 2) if total_units_change != 0 else None,
+                "units_contributor_type": contributor_type(units_c),
+                "units_rank": units_pos[i] if units_c > 0 else units_neg[i],
+            })
+
+        return output
+
+    def mix_shift(self, dimension: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Rows of mix_shift_by_dimension (detail grain, or one dimension's grain)."""
+        totals = self._totals()
+        if totals is None:
+            return []
+        cur_rev_t, prior_rev_t = totals["current_revenue"], totals["prior_revenue"]
+        cur_units_t, prior_units_t = totals["current_units"], totals["prior_units"]
+        revenue_totals_ok = cur_rev_t > 0 and prior_rev_t > 0
+        units_totals_ok = cur_units_t > 0 and prior_units_t > 0
+
+        col = self.columns
+        is_mix_row = col["is_mix_row"]
+
+        output = []
+        for i in self._grain(dimension):
+            if limit is not None and len(output) >= limit:
+                break
+            if not is_mix_row[i]:
+                continue
+
+            cur_rev, prior_rev = col["current_revenue"][i], col["prior_revenue"][i]
+            cur_units, prior_units = Decimal(col["current_quantity"][i]), Decimal(col["prior_quantity"][i])
+            output.append({
+                "country": col["country"][i],
+                "stock_code": col["stock_code"][i],
+                "customer_id": col["customer_id"][i],
+                "current_revenue": _round(cur_rev, 2),
+                "prior_revenue": _round(prior_rev, 2),
+                "revenue_change": _round(cur_rev - prior_rev, 2),
+                "revenue_pct_change": _pct_change(cur_rev, prior_rev),
+                "current_revenue_share_pct": _share_pct(cur_rev, cur_rev_t),
+                "prior_revenue_share_pct": _share_pct(prior_rev, prior_rev_t),
+                "revenue_mix_shift_pct": (
+                    _round((cur_rev / cur_rev_t - prior_rev / prior_rev_t) * 100, 2)
+                    if revenue_totals_ok else None
+                ),
+                "current_units": _round(cur_units, 2),
+                "prior_units": _round(prior_units, 2),
+                "units_change": _round(cur_units - prior_units, 2),
+                "units_pct_change": _pct_change(cur_units, prior_units),
+                "current_units_share_pct": _share_pct(cur_units, cur_units_t),
+                "prior_units_share_pct": _share_pct(prior_units, prior_units_t),
+                "units_mix_shift_pct": (
+                    _round((cur_units / cur_units_t - prior_units / prior_units_t) * 100, 2)
+                    if units_totals_ok else None
+                ),
+            })
+        return output
+
+    def price_volume(self) -> List[Dict[str, Any]]:
+        """Rows of price_volume_decomposition (Laspeyres, per stock_code)."""
+        products = self.grains.get(GRAIN_IDS["stock_code"])
+        if not products or self._totals() is None:
+            return [{
+                "current_revenue": None, "prior_revenue": None, "total_revenue_change": None,
+                "price_effect": None, "volume_effect": None, "decomposition_total": None,
+                "price_effect_pct": None, "volume_effect_pct": None,
+                "current_quantity": None, "prior_quantity": None, "total_quantity_change": None,
+            }]
+
+        col = self.columns
+        cur_rev = prior_rev = price_effect = volume_effect = _ZERO
+        cur_qty = prior_qty = 0
+        for i in products:
+            cq, pq = col["current_quantity"][i], col["prior_quantity"][i]
+            c_rev, p_rev = col["current_revenue"][i], col["prior_revenue"][i]
+            cur_price = c_rev / cq if cq > 0 else _ZERO
+            prior_price = p_rev / pq if pq > 0 else _ZERO
+            price_effect += (cur_price - prior_price) * pq
+            volume_effect += prior_price * (cq - pq)
+            cur_rev += c_rev
+            prior_rev += p_rev
+            cur_qty += cq
+            prior_qty += pq
+
+        total_change = cur_rev - prior_rev
+        return [{
+            "current_revenue": _round(cur_rev, 2),
+            "prior_revenue": _round(prior_rev, 2),
+            "total_revenue_change": _round(total_change, 2),
+            "price_effect": _round(price_effect, 2),
+            "volume_effect": _round(volume_effect, 2),
+            "decomposition_total": _round(price_effect + volume_effect, 2),
+            "price_effect_pct": _round(price_effect / total_change * 100, 2) if total_change != 0 else None,
+            "volume_effect_pct": _round(volume_effect / total_change * 100, 2) if total_change != 0 else None,
+            "current_quantity": cur_qty,
+            "prior_quantity": prior_qty,
+            "total_quantity_change": cur_qty - prior_qty,
+        }]
+
+
+async def run_window_comparison(
+    params: Optional[Dict[str, Any]],
+    *,
+    top_n: int = 10,
+    dimension: Optional[str] = None,
+    mix_shift_limit: Optional[int] = 5000,
+    timeout_seconds: Optional[float] = None,
+    use_cache: bool = True,
+    engine: str = "sql",
+) -> Dict[str, Any]:
+    """
+    Run the window comparison cube once and derive all four RCA outputs.
+
+    Args:
+        params: The four window bounds (current/prior start/end timestamps)
+        top_n: Contributors kept per metric and direction (default: 10)
+        dimension: 'country', 'stock_code' or 'customer_id' to report
+            contributors and mix shift at that grain; None keeps the
+            templates' country x stock_code x customer_id grain
+        mix_shift_limit: Cap on mix shift rows, mirroring run_sql's max_rows (default: 5000)
+        timeout_seconds: Statement timeout for the cube query
+        use_cache: Serve/store the cube from the result cache (default: True)
+        engine: 'sql' to run the cube template, or 'columnar' to compute the
+            cube from the in-memory facts (app/tools/columnar_engine.py);
+            both feed the same WindowCube, so outputs can be compared
+            (default: 'sql')
+
+    Returns:
+        Dictionary with kpi_trend, top_contributors, mix_shift and
+        price_volume row lists, plus engine, query_hash, cube_rows, cache
+        and duration_ms.
+
+    Raises:
+        ValueError: If params, dimension or engine are invalid, or the
+            columnar engine is requested but disabled
+        Same exceptions as run_sql_async().
+    """
+    if dimension is not None and dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension: {dimension}. Expected one of {DIMENSIONS}.")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}. Expected one of {ENGINES}.")
+
+    template = get_template_registry().get(CUBE_TEMPLATE)
+    bound = template.bind(params)
+
+    t0 = time.time()
+    if engine == "columnar":
+        result = await _columnar_cube(template.name, template.sql, bound)
+    else:
+        result = await run_sql_async(
+            template.sql,
+            bound,
+            max_rows=CUBE_MAX_ROWS,
+            timeout_seconds=timeout_seconds,
+            use_cache=use_cache,
+            prepare=True,
+            row_format="columns",
+            name=template.name,
+        )
+
+    cube = WindowCube(result["columns"], result["arrays"])
+    output = {
+        "kpi_trend": cube.kpi_trend(),
+        "top_contributors": cube.top_contributors(top_n, dimension),
+        "mix_shift": cube.mix_shift(dimension, mix_shift_limit),
+        "price_volume": cube.price_volume(),
+    }
+    elapsed_ms = int((time.time() - t0) * 1000)
+
+    logger.info(
+        f"Window comparison | engine={engine} | hash={result['query_hash']} | "
+        f"duration_ms={elapsed_ms} | query_ms={result['duration_ms']} | "
+        f"cube_rows={result['row_count']} | cache={result['cache']}"
+    )
+
+    return {
+        **output,
+        "engine": engine,
+        "query_hash": result["query_hash"],
+        "cube_rows": result["row_count"],
+        "cache": result["cache"],
+        "duration_ms": elapsed_ms,
+    }
+
+
+async def _columnar_cube(name: str, sql: str, bound: Dict[str, Any]) -> Dict[str, Any]:
+    """The cube template's result, computed by the columnar engine instead of Postgres."""
+    # Imported here: columnar_engine imports this module's grain ids
+    from app.tools.columnar_engine import columnar_engine_enabled, get_columnar_engine
+
+    if not columnar_engine_enabled():
+        raise ValueError("The columnar engine is disabled; set COLUMNAR_ENGINE_ENABLED=true to use engine='columnar'.")
+
+    t0 = time.time()
+    names, arrays = await get_columnar_engine().window_cube(bound)
+    row_count = len(arrays[0]) if arrays else 0
+    record_query(f"columnar.{name}", "ok", time.time() - t0, row_count=row_count)
+    return {
+        "columns": names,
+        "arrays": arrays,
+        "row_count": row_count,
+        "duration_ms": int((time.time() - t0) * 1000),
+        "query_hash": _hash_query(sql, bound),
+        # Computed from the in-memory snapshot of this data version, never the result cache
+        "cache": "bypass",
+    }
@@ -0,0 +1,24 @@
+#!/bin/bash
+# db/init/90_apply_migrations.sh
+# Apply db/migrations/*.sql (mounted at /db/migrations) to a freshly
+# initialized database and record them in schema_migrations, so new volumes
+# match databases upgraded with scripts/migrate.py.
+set -e
+
+MIGRATIONS_DIR="${MIGRATIONS_DIR:-/db/migrations}"
+PSQL=(psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB")
+
+"${PSQL[@]}" <<'SQL'
+CREATE TABLE IF NOT EXISTS schema_migrations (
+  version TEXT PRIMARY KEY,
+  applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+SQL
+
+for migration in "$MIGRATIONS_DIR"/*.sql; do
+  [ -e "$migration" ] || continue
+  version="$(basename "$migration" .sql)"
+  echo "Applying migration $version"
+  "${PSQL[@]}" --single-transaction -f "$migration"
+  "${PSQL[@]}" -c "INSERT INTO schema_migrations (version) VALUES ('$version') ON CONFLICT DO NOTHING"
+done
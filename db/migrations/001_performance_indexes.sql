@@ -0,0 +1,26 @@
+-- db/migrations/001_performance_indexes.sql
+-- Covering indexes for the sql/templates access paths.
+--
+-- Every template filters invoices on invoice_date windows and joins
+-- invoice_items on invoice_no, then products on stock_code and customers on
+-- customer_id. The INCLUDE columns let each step run as an index-only scan.
+-- Checked by scripts/check_template_plans.py.
+
+-- Date-window filter: invoice_no and customer_id ride along for the joins
+CREATE INDEX IF NOT EXISTS idx_invoices_invoice_date
+  ON invoices (invoice_date) INCLUDE (invoice_no, customer_id);
+
+-- Header -> line join: stock_code and quantity are all the templates read
+CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice_no
+  ON invoice_items (invoice_no) INCLUDE (stock_code, quantity);
+
+-- SKU lookups (product price corrections, SKU drill-downs)
+CREATE INDEX IF NOT EXISTS idx_invoice_items_stock_code
+  ON invoice_items (stock_code);
+
+-- Customer lookups (country corrections, customer drill-downs)
+CREATE INDEX IF NOT EXISTS idx_invoices_customer_id
+  ON invoices (customer_id);
+
+ANALYZE invoices;
+ANALYZE invoice_items;
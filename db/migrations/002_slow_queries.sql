@@ -0,0 +1,34 @@
+-- db/migrations/002_slow_queries.sql
+-- Plans captured by the opt-in slow-query recorder (backend/app/tools/slow_query_log.py).
+--
+-- One row per capture: queries slower than SLOW_QUERY_THRESHOLD_MS are
+-- re-run under EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON), at most once per
+-- fingerprint per cooldown. Statements that hit their timeout get a plain
+-- EXPLAIN instead (analyzed = false). GET /slow-queries reads this table.
+
+CREATE TABLE IF NOT EXISTS slow_queries (
+  id BIGSERIAL PRIMARY KEY,
+  captured_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+
+  -- Template name or sql:<fingerprint> (the /metrics query label)
+  fingerprint TEXT NOT NULL,
+  query_name TEXT,
+  query_hash TEXT NOT NULL,
+  sql TEXT NOT NULL,
+  params_json JSONB,
+
+  -- Latency seen by the caller, and whether it hit statement_timeout
+  duration_ms INT NOT NULL CHECK (duration_ms >= 0),
+  timed_out BOOLEAN NOT NULL DEFAULT FALSE,
+
+  -- EXPLAIN output; plan_error is set instead when the EXPLAIN itself failed
+  analyzed BOOLEAN NOT NULL,
+  plan_json JSONB,
+  plan_execution_ms DOUBLE PRECISION,
+  plan_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_slow_queries_fingerprint_captured_at
+  ON slow_queries (fingerprint, captured_at DESC);
+CREATE INDEX IF NOT EXISTS idx_slow_queries_captured_at
+  ON slow_queries (captured_at);
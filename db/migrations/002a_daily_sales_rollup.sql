@@ -0,0 +1,207 @@
+-- db/migrations/002a_daily_sales_rollup.sql
+-- Day-grain sales rollups read by the KPI templates for day-aligned windows.
+--
+-- daily_sales_rollup:   day x country x stock_code -> revenue, units, invoice_count
+-- daily_invoice_rollup: day x country -> distinct invoice_count
+--   (distinct invoices cannot be summed across stock codes, so invoice-level
+--    KPIs such as AOV read this table instead)
+--
+-- Statement-level triggers record every day touched by a load or correction
+-- in rollup_dirty_days; refresh_daily_sales_rollup() recomputes just those
+-- days. Templates fall back to the line-level tables for any window that
+-- contains a dirty day, so results are never stale.
+--
+-- These objects used to be created by db/init/20_daily_sales_rollup.sql, so
+-- databases initialised before this migration already have them, possibly
+-- with functions redefined by later migrations. Everything here is therefore
+-- idempotent: functions are only created when missing, triggers are
+-- recreated, and the initial build runs only while the rollups are empty.
+
+CREATE TABLE IF NOT EXISTS daily_sales_rollup (
+  day DATE NOT NULL,
+  country TEXT NOT NULL,
+  stock_code TEXT NOT NULL,
+  revenue NUMERIC NOT NULL,
+  units BIGINT NOT NULL,
+  invoice_count INT NOT NULL,
+  PRIMARY KEY (day, country, stock_code)
+);
+
+CREATE TABLE IF NOT EXISTS daily_invoice_rollup (
+  day DATE NOT NULL,
+  country TEXT NOT NULL,
+  invoice_count INT NOT NULL,
+  PRIMARY KEY (day, country)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_dirty_days (
+  day DATE PRIMARY KEY
+);
+
+DO $migration$
+BEGIN
+  IF to_regprocedure('refresh_daily_sales_rollup()') IS NOT NULL THEN
+    RETURN;
+  END IF;
+
+  -- Recompute the rollups for every dirty day; returns the number of days refreshed
+  CREATE OR REPLACE FUNCTION refresh_daily_sales_rollup() RETURNS INT
+  LANGUAGE plpgsql AS $$
+  DECLARE
+    days DATE[];
+  BEGIN
+    WITH claimed AS (
+      DELETE FROM rollup_dirty_days RETURNING day
+    )
+    SELECT array_agg(day) INTO days FROM claimed;
+
+    IF days IS NULL THEN
+      RETURN 0;
+    END IF;
+
+    DELETE FROM daily_sales_rollup WHERE day = ANY(days);
+    DELETE FROM daily_invoice_rollup WHERE day = ANY(days);
+
+    INSERT INTO daily_sales_rollup (day, country, stock_code, revenue, units, invoice_count)
+    SELECT
+      d.day,
+      COALESCE(c.country, 'Unknown'),
+      ii.stock_code,
+      SUM(ii.quantity::numeric * p.unit_price::numeric),
+      SUM(ii.quantity),
+      COUNT(DISTINCT ii.invoice_no)
+    FROM unnest(days) AS d(day)
+    JOIN invoices i ON i.invoice_date >= d.day AND i.invoice_date < d.day + 1
+    JOIN invoice_items ii ON ii.invoice_no = i.invoice_no
+    JOIN products p ON p.stock_code = ii.stock_code
+    LEFT JOIN customers c ON c.customer_id = i.customer_id
+    GROUP BY 1, 2, 3;
+
+    INSERT INTO daily_invoice_rollup (day, country, invoice_count)
+    SELECT
+      d.day,
+      COALESCE(c.country, 'Unknown'),
+      COUNT(DISTINCT ii.invoice_no)
+    FROM unnest(days) AS d(day)
+    JOIN invoices i ON i.invoice_date >= d.day AND i.invoice_date < d.day + 1
+    JOIN invoice_items ii ON ii.invoice_no = i.invoice_no
+    JOIN products p ON p.stock_code = ii.stock_code
+    LEFT JOIN customers c ON c.customer_id = i.customer_id
+    GROUP BY 1, 2;
+
+    RETURN cardinality(days);
+  END;
+  $$;
+
+  -- Trigger functions: mark the days whose line items changed as dirty
+
+  CREATE OR REPLACE FUNCTION mark_rollup_days_from_invoices() RETURNS TRIGGER
+  LANGUAGE plpgsql AS $$
+  BEGIN
+    INSERT INTO rollup_dirty_days (day)
+    SELECT DISTINCT invoice_date::date FROM changed_rows WHERE invoice_date IS NOT NULL
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+  END;
+  $$;
+
+  CREATE OR REPLACE FUNCTION mark_rollup_days_from_items() RETURNS TRIGGER
+  LANGUAGE plpgsql AS $$
+  BEGIN
+    INSERT INTO rollup_dirty_days (day)
+    SELECT DISTINCT i.invoice_date::date
+    FROM changed_rows ii
+    JOIN invoices i ON i.invoice_no = ii.invoice_no
+    WHERE i.invoice_date IS NOT NULL
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+  END;
+  $$;
+
+  CREATE OR REPLACE FUNCTION mark_rollup_days_from_products() RETURNS TRIGGER
+  LANGUAGE plpgsql AS $$
+  BEGIN
+    INSERT INTO rollup_dirty_days (day)
+    SELECT DISTINCT i.invoice_date::date
+    FROM changed_rows p
+    JOIN invoice_items ii ON ii.stock_code = p.stock_code
+    JOIN invoices i ON i.invoice_no = ii.invoice_no
+    WHERE i.invoice_date IS NOT NULL
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+  END;
+  $$;
+
+  CREATE OR REPLACE FUNCTION mark_rollup_days_from_customers() RETURNS TRIGGER
+  LANGUAGE plpgsql AS $$
+  BEGIN
+    INSERT INTO rollup_dirty_days (day)
+    SELECT DISTINCT i.invoice_date::date
+    FROM changed_rows c
+    JOIN invoices i ON i.customer_id = c.customer_id
+    WHERE i.invoice_date IS NOT NULL
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+  END;
+  $$;
+END;
+$migration$;
+
+-- Transition tables allow only one event per trigger, hence one trigger per event
+
+DROP TRIGGER IF EXISTS invoices_rollup_ins ON invoices;
+CREATE TRIGGER invoices_rollup_ins AFTER INSERT ON invoices
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mark_rollup_days_from_invoices();
+DROP TRIGGER IF EXISTS invoices_rollup_upd_old ON invoices;
+CREATE TRIGGER invoices_rollup_upd_old AFTER UPDATE ON invoices
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mark_rollup_days_from_invoices();
+DROP TRIGGER IF EXISTS invoices_rollup_upd_new ON invoices;
+CREATE TRIGGER invoices_rollup_upd_new AFTER UPDATE ON invoices
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mark_rollup_days_from_invoices();
+DROP TRIGGER IF EXISTS invoices_rollup_del ON invoices;
+CREATE TRIGGER invoices_rollup_del AFTER DELETE ON invoices
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mark_rollup_days_from_invoices();
+
+DROP TRIGGER IF EXISTS invoice_items_rollup_ins ON invoice_items;
+CREATE TRIGGER invoice_items_rollup_ins AFTER INSERT ON invoice_items
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mark_rollup_days_from_items();
+DROP TRIGGER IF EXISTS invoice_items_rollup_upd_old ON invoice_items;
+CREATE TRIGGER invoice_items_rollup_upd_old AFTER UPDATE ON invoice_items
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mark_rollup_days_from_items();
+DROP TRIGGER IF EXISTS invoice_items_rollup_upd_new ON invoice_items;
+CREATE TRIGGER invoice_items_rollup_upd_new AFTER UPDATE ON invoice_items
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mark_rollup_days_from_items();
+DROP TRIGGER IF EXISTS invoice_items_rollup_del ON invoice_items;
+CREATE TRIGGER invoice_items_rollup_del AFTER DELETE ON invoice_items
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mark_rollup_days_from_items();
+
+DROP TRIGGER IF EXISTS products_rollup_upd ON products;
+CREATE TRIGGER products_rollup_upd AFTER UPDATE ON products
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mark_rollup_days_from_products();
+
+DROP TRIGGER IF EXISTS customers_rollup_upd ON customers;
+CREATE TRIGGER customers_rollup_upd AFTER UPDATE ON customers
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION mark_rollup_days_from_customers();
+
+-- Initial build from the seed data loaded by db/init/10_seed.sql
+DO $migration$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM daily_sales_rollup) THEN
+    INSERT INTO rollup_dirty_days (day)
+    SELECT DISTINCT invoice_date::date FROM invoices WHERE invoice_date IS NOT NULL
+    ON CONFLICT DO NOTHING;
+
+    PERFORM refresh_daily_sales_rollup();
+  END IF;
+END;
+$migration$;
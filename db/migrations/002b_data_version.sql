@@ -0,0 +1,25 @@
+-- db/migrations/002b_data_version.sql
+-- Single-row data version counter. Loaders call bump_data_version() after
+-- each load so in-process result caches can drop entries computed on
+-- older data.
+--
+-- Used to be db/init/02_data_version.sql, which only ran on new volumes;
+-- every statement is idempotent, so databases initialised with it are
+-- left as they are.
+
+CREATE TABLE IF NOT EXISTS data_version (
+  id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  version BIGINT NOT NULL DEFAULT 1,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO data_version DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS BIGINT
+LANGUAGE sql AS $$
+  UPDATE data_version
+     SET version = version + 1,
+         updated_at = NOW()
+   WHERE id
+  RETURNING version;
+$$;
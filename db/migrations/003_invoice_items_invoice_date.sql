@@ -0,0 +1,271 @@
+-- db/migrations/003_invoice_items_invoice_date.sql
+-- Carry invoice_date on invoice_items so the line table can be filtered (and
+-- range-partitioned) by time without joining invoices first.
+--
+-- - invoice_items.invoice_date is backfilled from invoices and kept equal to
+--   it by a composite foreign key (invoice_no, invoice_date) with ON UPDATE
+--   CASCADE; invoice_date becomes NOT NULL on both tables.
+-- - The rollup refresh and the line-item dirty-day trigger read the line's
+--   own invoice_date. The refresh ends by calling refresh_rollup_dependents(),
+--   which later migrations replace to maintain tables derived from the rollups.
+-- - ensure_fact_partitions / detach_fact_partition / attach_fact_partition
+--   manage monthly partitions once scripts/partition_fact_tables.py has
+--   converted both tables to PARTITION BY RANGE (invoice_date). On plain
+--   tables ensure_fact_partitions() is a no-op, so loaders can always call it.
+
+-- ====== invoice_date on invoice_items ======
+
+ALTER TABLE invoices ALTER COLUMN invoice_date SET NOT NULL;
+
+ALTER TABLE invoice_items ADD COLUMN IF NOT EXISTS invoice_date TIMESTAMP;
+
+-- The backfill changes no revenue, so skip the dirty-day triggers (created
+-- by 002a_daily_sales_rollup)
+ALTER TABLE invoice_items DISABLE TRIGGER invoice_items_rollup_upd_old;
+ALTER TABLE invoice_items DISABLE TRIGGER invoice_items_rollup_upd_new;
+
+UPDATE invoice_items ii
+SET invoice_date = i.invoice_date
+FROM invoices i
+WHERE i.invoice_no = ii.invoice_no
+  AND ii.invoice_date IS DISTINCT FROM i.invoice_date;
+
+ALTER TABLE invoice_items ENABLE TRIGGER invoice_items_rollup_upd_old;
+ALTER TABLE invoice_items ENABLE TRIGGER invoice_items_rollup_upd_new;
+
+ALTER TABLE invoice_items ALTER COLUMN invoice_date SET NOT NULL;
+
+-- Composite key: the shape a partitioned invoices table can enforce (its
+-- unique keys must include the partition key). Constraints have no IF NOT
+-- EXISTS, so check pg_constraint to keep the migration re-runnable.
+DO $migration$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_constraint
+    WHERE conrelid = 'invoices'::regclass AND conname = 'invoices_invoice_no_invoice_date_key'
+  ) THEN
+    ALTER TABLE invoices ADD CONSTRAINT invoices_invoice_no_invoice_date_key UNIQUE (invoice_no, invoice_date);
+  END IF;
+
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_constraint
+    WHERE conrelid = 'invoice_items'::regclass AND conname = 'invoice_items_invoice_fkey'
+  ) THEN
+    ALTER TABLE invoice_items DROP CONSTRAINT IF EXISTS invoice_items_invoice_no_fkey;
+    ALTER TABLE invoice_items ADD CONSTRAINT invoice_items_invoice_fkey
+      FOREIGN KEY (invoice_no, invoice_date) REFERENCES invoices (invoice_no, invoice_date) ON UPDATE CASCADE;
+  END IF;
+END;
+$migration$;
+
+-- Date-window scans of the line table: everything the templates read rides along
+CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice_date
+  ON invoice_items (invoice_date) INCLUDE (invoice_no, stock_code, quantity);
+
+-- ====== Rollups read the line's own invoice_date ======
+
+-- Hook for tables derived from the rollups: refresh_daily_sales_rollup()
+-- ends by passing it the refreshed days and the first of them. A no-op
+-- until a later migration replaces it, and only created when missing so a
+-- re-run keeps the replacement.
+DO $migration$
+BEGIN
+  IF to_regprocedure('refresh_rollup_dependents(date[], date)') IS NULL THEN
+    CREATE FUNCTION refresh_rollup_dependents(days DATE[], first_day DATE) RETURNS VOID
+    LANGUAGE plpgsql AS $$
+    BEGIN
+      NULL;
+    END;
+    $$;
+  END IF;
+END;
+$migration$;
+
+-- The dirty days' overall range bounds both fact tables, so only the
+-- partitions (or index ranges) it covers are read
+
+CREATE OR REPLACE FUNCTION refresh_daily_sales_rollup() RETURNS INT
+LANGUAGE plpgsql AS $$
+DECLARE
+  days DATE[];
+  first_day DATE;
+  last_day DATE;
+BEGIN
+  WITH claimed AS (
+    DELETE FROM rollup_dirty_days RETURNING day
+  )
+  SELECT array_agg(day), MIN(day), MAX(day) INTO days, first_day, last_day FROM claimed;
+
+  IF days IS NULL THEN
+    RETURN 0;
+  END IF;
+
+  DELETE FROM daily_sales_rollup WHERE day = ANY(days);
+  DELETE FROM daily_invoice_rollup WHERE day = ANY(days);
+
+  INSERT INTO daily_sales_rollup (day, country, stock_code, revenue, units, invoice_count)
+  SELECT
+    d.day,
+    COALESCE(c.country, 'Unknown'),
+    ii.stock_code,
+    SUM(ii.quantity::numeric * p.unit_price::numeric),
+    SUM(ii.quantity),
+    COUNT(DISTINCT ii.invoice_no)
+  FROM invoice_items ii
+  JOIN unnest(days) AS d(day) ON d.day = ii.invoice_date::date
+  JOIN invoices i ON i.invoice_no = ii.invoice_no AND i.invoice_date = ii.invoice_date
+  JOIN products p ON p.stock_code = ii.stock_code
+  LEFT JOIN customers c ON c.customer_id = i.customer_id
+  WHERE ii.invoice_date >= first_day AND ii.invoice_date < last_day + 1
+    AND i.invoice_date >= first_day AND i.invoice_date < last_day + 1
+  GROUP BY 1, 2, 3;
+
+  INSERT INTO daily_invoice_rollup (day, country, invoice_count)
+  SELECT
+    d.day,
+    COALESCE(c.country, 'Unknown'),
+    COUNT(DISTINCT ii.invoice_no)
+  FROM invoice_items ii
+  JOIN unnest(days) AS d(day) ON d.day = ii.invoice_date::date
+  JOIN invoices i ON i.invoice_no = ii.invoice_no AND i.invoice_date = ii.invoice_date
+  JOIN products p ON p.stock_code = ii.stock_code
+  LEFT JOIN customers c ON c.customer_id = i.customer_id
+  WHERE ii.invoice_date >= first_day AND ii.invoice_date < last_day + 1
+    AND i.invoice_date >= first_day AND i.invoice_date < last_day + 1
+  GROUP BY 1, 2;
+
+  PERFORM refresh_rollup_dependents(days, first_day);
+
+  RETURN cardinality(days);
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION mark_rollup_days_from_items() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+  INSERT INTO rollup_dirty_days (day)
+  SELECT DISTINCT invoice_date::date FROM changed_rows
+  ON CONFLICT DO NOTHING;
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION mark_rollup_days_from_products() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+  INSERT INTO rollup_dirty_days (day)
+  SELECT DISTINCT ii.invoice_date::date
+  FROM changed_rows p
+  JOIN invoice_items ii ON ii.stock_code = p.stock_code
+  ON CONFLICT DO NOTHING;
+  RETURN NULL;
+END;
+$$;
+
+-- ====== Monthly partition management ======
+
+CREATE OR REPLACE FUNCTION fact_partition_name(parent TEXT, month DATE) RETURNS TEXT
+LANGUAGE sql IMMUTABLE AS $$
+  SELECT parent || to_char(month, '"_y"YYYY"m"MM');
+$$;
+
+CREATE OR REPLACE FUNCTION fact_tables_partitioned() RETURNS BOOLEAN
+LANGUAGE sql STABLE AS $$
+  SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'invoices'::regclass);
+$$;
+
+-- Create the missing monthly partitions covering [from_ts, to_ts]; returns
+-- how many tables were created. A month whose partition exists but is
+-- detached is left alone, so inserts into it fail until it is re-attached.
+CREATE OR REPLACE FUNCTION ensure_fact_partitions(from_ts TIMESTAMP, to_ts TIMESTAMP) RETURNS INT
+LANGUAGE plpgsql AS $$
+DECLARE
+  month DATE;
+  parent TEXT;
+  created INT := 0;
+BEGIN
+  IF NOT fact_tables_partitioned() OR from_ts IS NULL OR to_ts IS NULL THEN
+    RETURN 0;
+  END IF;
+
+  FOR month IN
+    SELECT generate_series(date_trunc('month', from_ts), date_trunc('month', to_ts), INTERVAL '1 month')::date
+  LOOP
+    -- invoices first: the line partition's foreign key needs the invoice partition
+    FOREACH parent IN ARRAY ARRAY['invoices', 'invoice_items'] LOOP
+      IF to_regclass(fact_partition_name(parent, month)) IS NULL THEN
+        EXECUTE format(
+          'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+          fact_partition_name(parent, month), parent, month, (month + INTERVAL '1 month')::date
+        );
+        created := created + 1;
+      END IF;
+    END LOOP;
+  END LOOP;
+
+  RETURN created;
+END;
+$$;
+
+-- Detach one month from both fact tables (lines first, then invoices). The
+-- detached tables keep their rows for archiving or DROP. The month's days
+-- are refreshed (and so emptied) in the rollups and the tables derived from
+-- them, so rollup-backed KPIs agree with line-level queries; the data
+-- version bump drops cached results that still include the month.
+CREATE OR REPLACE FUNCTION detach_fact_partition(month DATE) RETURNS VOID
+LANGUAGE plpgsql AS $$
+DECLARE
+  items TEXT := fact_partition_name('invoice_items', month);
+  fk TEXT;
+BEGIN
+  EXECUTE format('ALTER TABLE invoice_items DETACH PARTITION %I', items);
+
+  -- The detached line table keeps a standalone copy of the foreign key,
+  -- which would block detaching the invoices it references
+  FOR fk IN
+    SELECT conname FROM pg_constraint
+    WHERE conrelid = to_regclass(items) AND contype = 'f' AND confrelid = 'invoices'::regclass
+  LOOP
+    EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', items, fk);
+  END LOOP;
+
+  EXECUTE format('ALTER TABLE invoices DETACH PARTITION %I', fact_partition_name('invoices', month));
+
+  INSERT INTO rollup_dirty_days (day)
+  SELECT generate_series(month, (month + INTERVAL '1 month' - INTERVAL '1 day')::date, INTERVAL '1 day')::date
+  ON CONFLICT DO NOTHING;
+
+  PERFORM refresh_daily_sales_rollup();
+  PERFORM bump_data_version();
+END;
+$$;
+
+-- Re-attach a detached month (invoices first). Postgres validates the
+-- partition bounds and the line table's foreign key while attaching; the
+-- month's rollups are then rebuilt and the data version bumped, as on detach.
+CREATE OR REPLACE FUNCTION attach_fact_partition(month DATE) RETURNS VOID
+LANGUAGE plpgsql AS $$
+DECLARE
+  next_month DATE := (month + INTERVAL '1 month')::date;
+BEGIN
+  EXECUTE format(
+    'ALTER TABLE invoices ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+    fact_partition_name('invoices', month), month, next_month
+  );
+  EXECUTE format(
+    'ALTER TABLE invoice_items ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+    fact_partition_name('invoice_items', month), month, next_month
+  );
+
+  INSERT INTO rollup_dirty_days (day)
+  SELECT DISTINCT invoice_date::date FROM invoices
+  WHERE invoice_date >= month AND invoice_date < next_month
+  ON CONFLICT DO NOTHING;
+
+  PERFORM refresh_daily_sales_rollup();
+  PERFORM bump_data_version();
+END;
+$$;
+
+ANALYZE invoices;
+ANALYZE invoice_items;
@@ -0,0 +1,101 @@
+-- db/migrations/004_kpi_prefix_sums.sql
+-- Per-day running totals of revenue, units and invoices, overall and per
+-- country, so any [start, end) day window's KPIs are two index lookups
+-- (backend/app/tools/kpi_prefix.py, POST /analysis/kpi-windows).
+--
+-- kpi_prefix_sums holds one row per member and day with sales: the totals
+-- of every day up to and including `day`. A window's totals are the latest
+-- row before `end` minus the latest row before `start`. dimension 'all'
+-- (member '') is the whole business; dimension 'country' has one member per
+-- country. Invoice counts add up across days and countries because an
+-- invoice has one date and one customer.
+--
+-- The index is derived from the day rollups: refresh_rollup_dependents(),
+-- which refresh_daily_sales_rollup() calls last, now rebuilds the index from
+-- the earliest refreshed day onwards, so loading new days only rewrites the
+-- rows after them. Days waiting in
+-- rollup_dirty_days are stale here too, exactly as in the rollups.
+
+CREATE TABLE IF NOT EXISTS kpi_prefix_sums (
+  dimension TEXT NOT NULL,
+  member TEXT NOT NULL,
+  day DATE NOT NULL,
+  revenue NUMERIC NOT NULL,
+  units BIGINT NOT NULL,
+  invoices BIGINT NOT NULL,
+  -- Days with sales so far; tells an empty window (NULL KPIs) from a zero one
+  active_days INT NOT NULL,
+  PRIMARY KEY (dimension, member, day)
+);
+
+-- Rewrite the running totals for every day >= from_day (all days when NULL),
+-- continuing from each member's last total before from_day; returns the
+-- number of rows written
+CREATE OR REPLACE FUNCTION refresh_kpi_prefix(from_day DATE DEFAULT NULL) RETURNS INT
+LANGUAGE plpgsql AS $$
+DECLARE
+  written INT;
+BEGIN
+  from_day := COALESCE(from_day, '-infinity'::date);
+
+  DELETE FROM kpi_prefix_sums WHERE day >= from_day;
+
+  INSERT INTO kpi_prefix_sums (dimension, member, day, revenue, units, invoices, active_days)
+  WITH daily AS (
+    SELECT s.day, s.country, s.revenue, s.units, COALESCE(n.invoice_count, 0) AS invoices
+    FROM (
+      SELECT day, country, SUM(revenue) AS revenue, SUM(units) AS units
+      FROM daily_sales_rollup
+      WHERE day >= from_day
+      GROUP BY day, country
+    ) s
+    LEFT JOIN daily_invoice_rollup n ON n.day = s.day AND n.country = s.country
+  ),
+  members AS (
+    SELECT 'all' AS dimension, '' AS member, day, SUM(revenue) AS revenue, SUM(units) AS units, SUM(invoices) AS invoices
+    FROM daily
+    GROUP BY day
+    UNION ALL
+    SELECT 'country', country, day, revenue, units, invoices
+    FROM daily
+  ),
+  carried AS (
+    -- Each member's running totals as of the day before from_day
+    SELECT m.dimension, m.member, b.revenue, b.units, b.invoices, b.active_days
+    FROM (SELECT DISTINCT dimension, member FROM members) m
+    JOIN LATERAL (
+      SELECT p.revenue, p.units, p.invoices, p.active_days
+      FROM kpi_prefix_sums p
+      WHERE p.dimension = m.dimension AND p.member = m.member AND p.day < from_day
+      ORDER BY p.day DESC
+      LIMIT 1
+    ) b ON TRUE
+  )
+  SELECT
+    m.dimension,
+    m.member,
+    m.day,
+    COALESCE(c.revenue, 0) + SUM(m.revenue) OVER w,
+    COALESCE(c.units, 0) + SUM(m.units) OVER w,
+    COALESCE(c.invoices, 0) + SUM(m.invoices) OVER w,
+    COALESCE(c.active_days, 0) + COUNT(*) OVER w
+  FROM members m
+  LEFT JOIN carried c ON c.dimension = m.dimension AND c.member = m.member
+  WINDOW w AS (PARTITION BY m.dimension, m.member ORDER BY m.day);
+
+  GET DIAGNOSTICS written = ROW_COUNT;
+  RETURN written;
+END;
+$$;
+
+-- Called at the end of refresh_daily_sales_rollup(): the running totals
+-- from the first refreshed day on
+CREATE OR REPLACE FUNCTION refresh_rollup_dependents(days DATE[], first_day DATE) RETURNS VOID
+LANGUAGE plpgsql AS $$
+BEGIN
+  PERFORM refresh_kpi_prefix(first_day);
+END;
+$$;
+
+-- Backfill from the current rollups
+SELECT refresh_kpi_prefix();
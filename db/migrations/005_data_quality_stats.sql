@@ -0,0 +1,200 @@
+-- db/migrations/005_data_quality_stats.sql
+-- Persisted data-quality statistics read by sql/templates/data_quality_checks.sql,
+-- so a check costs as much as the data loaded since the last refresh rather
+-- than a scan of the whole history.
+--
+-- dq_daily_stats: invoices and line items per day with their null counts,
+--   plus the invoices' trailing 7-day average (the spike baseline). Built
+--   in one pass over each table per refreshed day; refresh_rollup_dependents()
+--   now refreshes the days refresh_daily_sales_rollup() claims, and the
+--   baselines from the first of them.
+-- dq_table_stats: row and null counts of the dimension tables (products'
+--   unit_price, customers' country), kept current by statement triggers that
+--   add and subtract the changed rows. refresh_dq_table_stats() recounts them,
+--   e.g. after a TRUNCATE.
+
+CREATE TABLE IF NOT EXISTS dq_daily_stats (
+  day DATE PRIMARY KEY,
+  invoices BIGINT NOT NULL,
+  null_customer_id BIGINT NOT NULL,
+  invoice_items BIGINT NOT NULL,
+  null_invoice_no BIGINT NOT NULL,
+  null_stock_code BIGINT NOT NULL,
+  null_quantity BIGINT NOT NULL,
+  -- Average invoices over this and the 6 preceding days with invoices
+  invoices_7d_avg NUMERIC,
+  computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS dq_table_stats (
+  table_name TEXT PRIMARY KEY,
+  null_column TEXT NOT NULL,
+  row_count BIGINT NOT NULL,
+  null_count BIGINT NOT NULL
+);
+
+-- Recompute the statistics of the given days (days left without rows are
+-- dropped) and the spike baselines from the first of them on; returns the
+-- number of days stored
+CREATE OR REPLACE FUNCTION refresh_dq_daily_stats(days DATE[]) RETURNS INT
+LANGUAGE plpgsql AS $$
+DECLARE
+  first_day DATE;
+  last_day DATE;
+  baseline_from DATE;
+  stored INT;
+BEGIN
+  SELECT MIN(d), MAX(d) INTO first_day, last_day FROM unnest(days) AS d;
+  IF first_day IS NULL THEN
+    RETURN 0;
+  END IF;
+
+  DELETE FROM dq_daily_stats WHERE day = ANY(days);
+
+  INSERT INTO dq_daily_stats (
+    day, invoices, null_customer_id, invoice_items, null_invoice_no, null_stock_code, null_quantity
+  )
+  SELECT
+    COALESCE(i.day, ii.day),
+    COALESCE(i.invoices, 0),
+    COALESCE(i.null_customer_id, 0),
+    COALESCE(ii.invoice_items, 0),
+    COALESCE(ii.null_invoice_no, 0),
+    COALESCE(ii.null_stock_code, 0),
+    COALESCE(ii.null_quantity, 0)
+  FROM (
+    SELECT
+      invoice_date::date AS day,
+      COUNT(*) AS invoices,
+      COUNT(*) FILTER (WHERE customer_id IS NULL) AS null_customer_id
+    FROM invoices
+    WHERE invoice_date >= first_day AND invoice_date < last_day + 1
+      AND invoice_date::date = ANY(days)
+    GROUP BY 1
+  ) i
+  FULL JOIN (
+    SELECT
+      invoice_date::date AS day,
+      COUNT(*) AS invoice_items,
+      COUNT(*) FILTER (WHERE invoice_no IS NULL) AS null_invoice_no,
+      COUNT(*) FILTER (WHERE stock_code IS NULL) AS null_stock_code,
+      COUNT(*) FILTER (WHERE quantity IS NULL) AS null_quantity
+    FROM invoice_items
+    WHERE invoice_date >= first_day AND invoice_date < last_day + 1
+      AND invoice_date::date = ANY(days)
+    GROUP BY 1
+  ) ii ON ii.day = i.day;
+
+  GET DIAGNOSTICS stored = ROW_COUNT;
+
+  -- A day's baseline covers it and the 6 days with invoices before it, so
+  -- every baseline from first_day on may change; the window starts 6 such
+  -- days earlier
+  SELECT COALESCE(MIN(day), first_day) INTO baseline_from
+  FROM (
+    SELECT day FROM dq_daily_stats
+    WHERE invoices > 0 AND day < first_day
+    ORDER BY day DESC
+    LIMIT 6
+  ) earlier;
+
+  UPDATE dq_daily_stats s
+  SET invoices_7d_avg = b.invoices_7d_avg
+  FROM (
+    SELECT day, AVG(invoices) OVER (ORDER BY day ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS invoices_7d_avg
+    FROM dq_daily_stats
+    WHERE invoices > 0 AND day >= baseline_from
+  ) b
+  WHERE b.day = s.day AND s.day >= first_day;
+
+  RETURN stored;
+END;
+$$;
+
+-- Recount the dimension tables' rows and nulls
+CREATE OR REPLACE FUNCTION refresh_dq_table_stats() RETURNS VOID
+LANGUAGE plpgsql AS $$
+BEGIN
+  INSERT INTO dq_table_stats (table_name, null_column, row_count, null_count)
+  SELECT 'products', 'unit_price', COUNT(*), COUNT(*) FILTER (WHERE unit_price IS NULL) FROM products
+  UNION ALL
+  SELECT 'customers', 'country', COUNT(*), COUNT(*) FILTER (WHERE country IS NULL) FROM customers
+  ON CONFLICT (table_name) DO UPDATE
+  SET null_column = EXCLUDED.null_column, row_count = EXCLUDED.row_count, null_count = EXCLUDED.null_count;
+END;
+$$;
+
+-- Trigger function: add the new rows (TG_ARGV[0] = 'new') or subtract the
+-- old ones ('old'); an UPDATE does both
+CREATE OR REPLACE FUNCTION track_dq_table_stats() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+DECLARE
+  direction INT := CASE TG_ARGV[0] WHEN 'new' THEN 1 ELSE -1 END;
+  null_column TEXT;
+  changed BIGINT;
+  nulls BIGINT;
+BEGIN
+  SELECT s.null_column INTO null_column FROM dq_table_stats s WHERE s.table_name = TG_TABLE_NAME;
+  IF null_column IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  EXECUTE format('SELECT COUNT(*), COUNT(*) FILTER (WHERE %I IS NULL) FROM changed_rows', null_column)
+  INTO changed, nulls;
+
+  UPDATE dq_table_stats
+  SET row_count = row_count + direction * changed, null_count = null_count + direction * nulls
+  WHERE table_name = TG_TABLE_NAME;
+  RETURN NULL;
+END;
+$$;
+
+-- Transition tables allow only one event per trigger, hence one trigger per event
+
+DROP TRIGGER IF EXISTS products_dq_ins ON products;
+CREATE TRIGGER products_dq_ins AFTER INSERT ON products
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION track_dq_table_stats('new');
+DROP TRIGGER IF EXISTS products_dq_upd_old ON products;
+CREATE TRIGGER products_dq_upd_old AFTER UPDATE ON products
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION track_dq_table_stats('old');
+DROP TRIGGER IF EXISTS products_dq_upd_new ON products;
+CREATE TRIGGER products_dq_upd_new AFTER UPDATE ON products
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION track_dq_table_stats('new');
+DROP TRIGGER IF EXISTS products_dq_del ON products;
+CREATE TRIGGER products_dq_del AFTER DELETE ON products
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION track_dq_table_stats('old');
+
+DROP TRIGGER IF EXISTS customers_dq_ins ON customers;
+CREATE TRIGGER customers_dq_ins AFTER INSERT ON customers
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION track_dq_table_stats('new');
+DROP TRIGGER IF EXISTS customers_dq_upd_old ON customers;
+CREATE TRIGGER customers_dq_upd_old AFTER UPDATE ON customers
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION track_dq_table_stats('old');
+DROP TRIGGER IF EXISTS customers_dq_upd_new ON customers;
+CREATE TRIGGER customers_dq_upd_new AFTER UPDATE ON customers
+  REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION track_dq_table_stats('new');
+DROP TRIGGER IF EXISTS customers_dq_del ON customers;
+CREATE TRIGGER customers_dq_del AFTER DELETE ON customers
+  REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION track_dq_table_stats('old');
+
+-- Called at the end of refresh_daily_sales_rollup(): the running totals of
+-- 004_kpi_prefix_sums, then the data-quality statistics of the refreshed days
+CREATE OR REPLACE FUNCTION refresh_rollup_dependents(days DATE[], first_day DATE) RETURNS VOID
+LANGUAGE plpgsql AS $$
+BEGIN
+  PERFORM refresh_kpi_prefix(first_day);
+  PERFORM refresh_dq_daily_stats(days);
+END;
+$$;
+
+-- Backfill
+SELECT refresh_dq_table_stats();
+SELECT refresh_dq_daily_stats(array_agg(DISTINCT invoice_date::date)) FROM invoices;
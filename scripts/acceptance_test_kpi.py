@@ -24,22 +24,12 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
 
 from app.tools.sql_tool import run_sql
+from app.tools.template_registry import get_template_registry
 
 
 def load_template(template_name: str) -> str:
-    """Load SQL template from sql/templates/ directory."""
-    # Try multiple possible paths
-    possible_paths = [
-        Path(__file__).parent.parent / "sql" / "templates" / template_name,  # Local
-        Path("/app/sql/templates") / template_name,  # Docker container
-        Path("/app/../sql/templates") / template_name,  # Alternative Docker path
-    ]
-    
-    for template_path in possible_paths:
-        if template_path.exists():
-            return template_path.read_text(encoding="utf-8")
-    
-    raise FileNotFoundError(f"Template not found: {template_name}. Tried: {[str(p) for p in possible_paths]}")
+    """Load SQL template from the backend template registry (sql/templates/)."""
+    return get_template_registry().get(template_name).sql
 
 
 def test_kpi_delta_percentage():
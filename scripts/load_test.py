@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+HTTP load test for the API's template and query workloads.
+
+Drives the running API with a weighted mix of the sql/templates queries
+(plus the window-comparison, drill-down and ad-hoc /query endpoints). Each
+request uses random day-aligned windows, so consecutive requests rarely
+share a result cache entry. Reports throughput, p50/p95/p99 latency and
+error rate per operation, and writes them as JSON that later runs can be
+compared against.
+
+Two modes:
+- Closed loop (default): --concurrency workers each send the next request
+  as soon as the previous one returns.
+- Open loop (--rate N): requests arrive as a Poisson process at N/s,
+  served by up to --concurrency workers. Latency is measured from each
+  request's scheduled arrival time, so time spent queued behind a slow
+  server counts (no coordinated omission).
+
+Usage:
+    docker-compose up -d
+    python scripts/load_test.py --duration 60 --concurrency 16 --no-cache
+    python scripts/load_test.py --rate 50 --output results/rate50.json
+    python scripts/load_test.py --rate 50 --compare results/rate50.json --max-p99-regression 20
+    python scripts/load_test.py --mix my_mix.json   # [{"name", "weight", "path", "body"}, ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Invoice dates covered by the seed data (db/data)
+DATA_START = date(2010, 12, 1)
+DATA_END = date(2011, 12, 9)
+WINDOW_DAYS = (7, 14, 28)
+
+PERCENTILES = (50, 95, 99)
+
+
+def random_windows(rng: random.Random) -> Dict[str, str]:
+    """A random current window and the equally long window right before it."""
+    days = rng.choice(WINDOW_DAYS)
+    latest_start = (DATA_END - DATA_START).days - days
+    current_start = DATA_START + timedelta(days=rng.randint(days, latest_start))
+    prior_start = current_start - timedelta(days=days)
+    return {
+        "current_start_ts": current_start.isoformat(),
+        "current_end_ts": (current_start + timedelta(days=days)).isoformat(),
+        "prior_start_ts": prior_start.isoformat(),
+        "prior_end_ts": current_start.isoformat(),
+    }
+
+
+def _template(name: str) -> Callable[[random.Random], Tuple[str, Dict[str, Any]]]:
+    return lambda rng: (f"/templates/{name}", {"params": random_windows(rng)})
+
+
+def _revenue_by_day(rng: random.Random) -> Tuple[str, Dict[str, Any]]:
+    windows = random_windows(rng)
+    return "/templates/revenue_by_day", {"params": {"start_ts": windows["prior_start_ts"], "end_ts": windows["current_end_ts"]}}
+
+
+def _window_comparison(rng: random.Random) -> Tuple[str, Dict[str, Any]]:
+    return "/analysis/window-comparison", {"params": random_windows(rng), "top_n": 10}
+
+
+def _drilldown(rng: random.Random) -> Tuple[str, Dict[str, Any]]:
+    return "/analysis/drilldown", {"params": random_windows(rng), "top_n": 5, "expand_n": 3}
+
+
+def _adhoc_revenue_by_country(rng: random.Random) -> Tuple[str, Dict[str, Any]]:
+    windows = random_windows(rng)
+    sql = (
+        "SELECT COALESCE(c.country, 'Unknown') AS country, SUM(ii.quantity * p.unit_price) AS revenue "
+        "FROM invoices i JOIN invoice_items ii ON ii.invoice_no = i.invoice_no "
+        "JOIN products p ON p.stock_code = ii.stock_code LEFT JOIN customers c ON c.customer_id = i.customer_id "
+        "WHERE i.invoice_date >= %(start)s AND i.invoice_date < %(end)s GROUP BY 1 ORDER BY 2 DESC"
+    )
+    return "/query", {"sql": sql, "params": {"start": windows["current_start_ts"], "end": windows["current_end_ts"]}}
+
+
+# Default mix, weighted toward the RCA templates an agent calls per question
+DEFAULT_MIX: List[Tuple[str, float, Callable[[random.Random], Tuple[str, Dict[str, Any]]]]] = [
+    ("kpi_trend_window_comparison", 20, _template("kpi_trend_window_comparison")),
+    ("top_contributors", 20, _template("top_contributors")),
+    ("mix_shift_by_dimension", 10, _template("mix_shift_by_dimension")),
+    ("price_volume_decomposition", 10, _template("price_volume_decomposition")),
+    ("revenue_window_vs_last", 10, _template("revenue_window_vs_last")),
+    ("revenue_by_day", 10, _revenue_by_day),
+    ("window_comparison", 10, _window_comparison),
+    ("drilldown", 5, _drilldown),
+    ("adhoc_revenue_by_country", 5, _adhoc_revenue_by_country),
+]
+
+
+def load_mix(path: str) -> List[Tuple[str, float, Callable[[random.Random], Tuple[str, Dict[str, Any]]]]]:
+    """
+    Read a custom mix: a JSON list of {"name", "weight", "path", "body"}.
+
+    Any "$windows" value inside body is replaced by fresh random windows per request.
+    """
+    def make(entry: Dict[str, Any]):
+        def build(rng: random.Random):
+            body = json.loads(json.dumps(entry.get("body", {})))
+            for key, value in list(body.items()):
+                if value == "$windows":
+                    body[key] = random_windows(rng)
+            return entry["path"], body
+        return build
+
+    entries = json.loads(Path(path).read_text(encoding="utf-8"))
+    return [(e["name"], float(e.get("weight", 1)), make(e)) for e in entries]
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Client:
+    """One keep-alive HTTP connection per worker thread."""
+
+    def __init__(self, base_url: str, timeout: float):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def post(self, path: str, body: Dict[str, Any]) -> Tuple[int, int]:
+        """POST JSON; returns (status, response bytes). Raises on transport errors."""
+        payload = json.dumps(body).encode()
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        for attempt in (1, 2):
+            conn = self._connection()
+            try:
+                conn.request("POST", self.prefix + path, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                return response.status, len(data)
+            except Exception as e:
+                # A failed exchange (timeout, partial read, ...) leaves the
+                # connection mid-request, so it can never be reused
+                conn.close()
+                self._local.conn = None
+                # Server closed the idle keep-alive connection: reconnect once
+                reconnect = isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError))
+                if attempt == 2 or not reconnect:
+                    raise
+        raise RuntimeError("unreachable")
+
+
+class Recorder:
+    """Collects one sample per request; measurement starts after the warm-up."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: List[Tuple[str, float, int, int, Optional[str]]] = []
+
+    def add(self, name: str, latency_s: float, status: int, size: int, error: Optional[str]) -> None:
+        with self._lock:
+            self.samples.append((name, latency_s, status, size, error))
+
+
+def summarize(samples: List[Tuple[str, float, int, int, Optional[str]]], elapsed_s: float) -> Dict[str, Any]:
+    latencies = sorted(s[1] * 1000 for s in samples)
+    errors = [s for s in samples if s[4] is not None or s[2] >= 400]
+    statuses: Dict[str, int] = {}
+    for s in samples:
+        key = str(s[2]) if s[4] is None else "transport_error"
+        statuses[key] = statuses.get(key, 0) + 1
+    summary: Dict[str, Any] = {
+        "requests": len(samples),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(samples), 4) if samples else None,
+        "throughput_rps": round(len(samples) / elapsed_s, 2) if elapsed_s > 0 else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+        "max_ms": round(latencies[-1], 2) if latencies else None,
+        "mean_response_bytes": round(sum(s[3] for s in samples) / len(samples)) if samples else None,
+        "status_counts": dict(sorted(statuses.items())),
+    }
+    for pct in PERCENTILES:
+        value = percentile(latencies, pct)
+        summary[f"p{pct}_ms"] = round(value, 2) if value is not None else None
+    return summary
+
+
+def run_load(args: argparse.Namespace, mix) -> Dict[str, Any]:
+    client = Client(args.base_url, args.request_timeout)
+    recorder = Recorder()
+    names = [name for name, _, _ in mix]
+    weights = [weight for _, weight, _ in mix]
+    builders = {name: build for name, _, build in mix}
+    rng_lock = threading.Lock()
+    rng = random.Random(args.seed)
+
+    t_start = time.monotonic()
+    t_measure = t_start + args.warmup
+    t_end = t_measure + args.duration
+
+    def next_request() -> Tuple[str, str, Dict[str, Any]]:
+        with rng_lock:
+            name = rng.choices(names, weights)[0]
+            path, body = builders[name](rng)
+        if args.no_cache:
+            body["use_cache"] = False
+        return name, path, body
+
+    def execute(name: str, path: str, body: Dict[str, Any], scheduled_at: float) -> None:
+        error = None
+        status, size = 0, 0
+        try:
+            status, size = client.post(path, body)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        done = time.monotonic()
+        if scheduled_at >= t_measure and done <= t_end + args.request_timeout:
+            recorder.add(name, done - scheduled_at, status, size, error)
+
+    if args.rate:
+        # Open loop: Poisson arrivals, queued on the worker pool when all workers are busy
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            arrival = time.monotonic()
+            while arrival < t_end:
+                with rng_lock:
+                    arrival += rng.expovariate(args.rate)
+                delay = arrival - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                name, path, body = next_request()
+                pool.submit(execute, name, path, body, arrival)
+    else:
+        def worker() -> None:
+            while time.monotonic() < t_end:
+                name, path, body = next_request()
+                execute(name, path, body, time.monotonic())
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    elapsed = min(time.monotonic(), t_end) - t_measure
+    by_name: Dict[str, List[Tuple[str, float, int, int, Optional[str]]]] = {}
+    for sample in recorder.samples:
+        by_name.setdefault(sample[0], []).append(sample)
+
+    return {
+        "overall": summarize(recorder.samples, elapsed),
+        "operations": {name: summarize(samples, elapsed) for name, samples in sorted(by_name.items())},
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    header = f"  {'operation':32s} {'reqs':>7s} {'rps':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'err%':>6s}"
+    print(header)
+    print("  " + "-" * (len(header) - 2))
+    rows = list(results["operations"].items()) + [("OVERALL", results["overall"])]
+    for name, s in rows:
+        err_pct = (s["error_rate"] or 0) * 100
+        print(
+            f"  {name:32s} {s['requests']:7d} {s['throughput_rps'] or 0:8.1f} "
+            f"{s['p50_ms'] or 0:8.1f}ms {s['p95_ms'] or 0:8.1f}ms {s['p99_ms'] or 0:8.1f}ms {err_pct:5.1f}%"
+        )
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], max_p99_regression: Optional[float]) -> bool:
+    """Print per-operation deltas against a baseline run; False if p99 regressed past the limit."""
+    print(f"\nCompared with baseline {baseline['meta'].get('git_revision')} ({baseline['meta'].get('started_at')}):")
+    print(f"  {'operation':32s} {'p50':>10s} {'p95':>10s} {'p99':>10s} {'rps':>10s} {'err%':>8s}")
+    ok = True
+
+    def delta(new, old) -> str:
+        if new is None or not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    pairs = [(name, s, baseline["operations"].get(name)) for name, s in results["operations"].items()]
+    pairs.append(("OVERALL", results["overall"], baseline["overall"]))
+    for name, new, old in pairs:
+        if old is None:
+            print(f"  {name:32s} (not in baseline)")
+            continue
+        err_delta = ((new["error_rate"] or 0) - (old["error_rate"] or 0)) * 100
+        print(
+            f"  {name:32s} {delta(new['p50_ms'], old['p50_ms']):>10s} {delta(new['p95_ms'], old['p95_ms']):>10s} "
+            f"{delta(new['p99_ms'], old['p99_ms']):>10s} {delta(new['throughput_rps'], old['throughput_rps']):>10s} "
+            f"{err_delta:+7.1f}pp"
+        )
+        if (
+            max_p99_regression is not None and new["p99_ms"] and old["p99_ms"]
+            and (new["p99_ms"] - old["p99_ms"]) / old["p99_ms"] * 100 > max_p99_regression
+        ):
+            ok = False
+    return ok
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--base-url", default=os.getenv("API_BASE_URL", "http://localhost:8000"), help="Defaults to $API_BASE_URL or http://localhost:8000")
+    p.add_argument("--duration", type=float, default=30.0, help="Measured seconds (default: 30)")
+    p.add_argument("--warmup", type=float, default=5.0, help="Unmeasured seconds before measuring (default: 5)")
+    p.add_argument("--concurrency", type=int, default=8, help="Worker threads / max in-flight requests (default: 8)")
+    p.add_argument("--rate", type=float, help="Open-loop arrival rate in requests/s (default: closed loop)")
+    p.add_argument("--mix", help="JSON workload mix file (default: built-in template mix)")
+    p.add_argument("--no-cache", action="store_true", help="Send use_cache=false so every request reaches Postgres")
+    p.add_argument("--request-timeout", type=float, default=60.0, help="Per-request HTTP timeout in seconds")
+    p.add_argument("--seed", type=int, default=42, help="Random seed for the request sequence")
+    p.add_argument("--output", help="Write results as JSON to this path")
+    p.add_argument("--compare", help="Baseline results JSON to compare against")
+    p.add_argument("--max-p99-regression", type=float, help="With --compare: exit 1 if any p99 grows by more than this %%")
+    args = p.parse_args()
+
+    mix = load_mix(args.mix) if args.mix else DEFAULT_MIX
+    mode = f"open loop at {args.rate}/s" if args.rate else "closed loop"
+    print(
+        f"Load test against {args.base_url}: {mode}, concurrency {args.concurrency}, "
+        f"{args.warmup:g}s warm-up + {args.duration:g}s measured, cache {'off' if args.no_cache else 'on'}"
+    )
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    results = run_load(args, mix)
+    results = {
+        "meta": {
+            "started_at": started_at,
+            "git_revision": git_revision(),
+            "base_url": args.base_url,
+            "mode": "open" if args.rate else "closed",
+            "rate": args.rate,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "use_cache": not args.no_cache,
+            "seed": args.seed,
+            "mix": {name: weight for name, weight, _ in mix},
+        },
+        **results,
+    }
+
+    print()
+    print_report(results)
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        if not compare(results, baseline, args.max_p99_regression):
+            print(f"❌ p99 regressed by more than {args.max_p99_regression}% for at least one operation.")
+            sys.exit(1)
+
+    if results["overall"]["requests"] == 0:
+        print("❌ No requests completed; is the API running?")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,9 @@
 from __future__ import annotations
 
 import argparse
+import time
 from pathlib import Path
+from typing import Callable, Iterator, Optional
 
 import pandas as pd
 
@@ -22,139 +24,249 @@ COLS_INVOICES = ["invoice_no", "customer_id", "invoice_date"]
 COLS_INVOICE_ITEMS = ["invoice_no", "stock_code", "quantity"]
 # ===================================================================
 
-
-def load_raw(path: Path) -> pd.DataFrame:
-    df = pd.read_csv(path)
-
-    # Normalize raw column names (dataset uses: InvoiceNo, StockCode, ...)
-    expected = ["InvoiceNo", "StockCode", "Description", "Quantity", "InvoiceDate", "UnitPrice", "CustomerID", "Country"]
-    missing = [c for c in expected if c not in df.columns]
+# Partial results are folded once at least this many rows are pending
+MIN_FOLD_ROWS = 100_000
+
+# Raw columns and the dtypes they are read with (dataset uses: InvoiceNo, StockCode, ...).
+# Reading text as "string" once avoids per-column astype(str) passes; CustomerID
+# is float in the raw file ("17850.0") and becomes a nullable integer below.
+RAW_DTYPES = {
+    "InvoiceNo": "string",
+    "StockCode": "string",
+    "Description": "string",
+    "Quantity": "float64",
+    "InvoiceDate": "string",
+    "UnitPrice": "float64",
+    "CustomerID": "float64",
+    "Country": "string",
+}
+
+
+def read_raw_chunks(path: Path, chunk_size: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """Yield the raw CSV in chunks of chunk_size rows (the whole file at once if None)."""
+    header = pd.read_csv(path, nrows=0)
+    missing = [c for c in RAW_DTYPES if c not in header.columns]
     if missing:
-        raise ValueError(f"Missing expected columns in raw CSV: {missing}. Found: {list(df.columns)}")
+        raise ValueError(f"Missing expected columns in raw CSV: {missing}. Found: {list(header.columns)}")
 
-    # Basic cleanup
-    df["StockCode"] = df["StockCode"].astype(str).str.strip()
-    df["Description"] = df["Description"].astype(str).str.strip()
-    df["Country"] = df["Country"].astype(str).str.strip()
-
-    # Parse datetime (format like 12/1/10 8:26)
-    df["InvoiceDate"] = pd.to_datetime(df["InvoiceDate"], errors="coerce")
-
-    # Numeric cleanup
-    df["UnitPrice"] = pd.to_numeric(df["UnitPrice"], errors="coerce")
-    df["Quantity"] = pd.to_numeric(df["Quantity"], errors="coerce").astype("Int64")
+    reader = pd.read_csv(path, usecols=list(RAW_DTYPES), dtype=RAW_DTYPES, chunksize=chunk_size)
+    if chunk_size is None:
+        yield reader
+    else:
+        with reader:
+            yield from reader
 
-    # CustomerID is float in the raw file; convert to nullable integer
-    df["CustomerID"] = pd.to_numeric(df["CustomerID"], errors="coerce").astype("Int64")
 
-    return df
+def load_raw(path: Path) -> pd.DataFrame:
+    return next(read_raw_chunks(path))
 
 
-def transform(
+def clean(
     df: pd.DataFrame,
     include_cancellations: bool,
     include_returns: bool,
     drop_missing_customers: bool,
     invoice_no_as_text: bool,
-) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+) -> pd.DataFrame:
+    """Filter and normalize one raw chunk; adds _invoice_no, _customer_id and _stock_code."""
+    df = df.assign(
+        InvoiceNo=df["InvoiceNo"].str.strip(),
+        StockCode=df["StockCode"].str.strip(),
+        Description=df["Description"].str.strip(),
+        Country=df["Country"].str.strip(),
+        # Parse datetime (format like 12/1/10 8:26). An explicit format keeps
+        # every chunk on the vectorized parser, and no chunk can infer a
+        # different day/month order from its first value.
+        InvoiceDate=pd.to_datetime(df["InvoiceDate"], errors="coerce", format="%m/%d/%y %H:%M"),
+    )
+
+    keep = df["InvoiceNo"].notna()
     # Cancellations are invoices starting with "C" in this dataset
-    is_cancel = df["InvoiceNo"].astype(str).str.startswith("C", na=False)
     if not include_cancellations:
-        df = df[~is_cancel].copy()
-
+        keep &= ~df["InvoiceNo"].str.startswith("C").fillna(False)
     # Returns often have negative quantities
     if not include_returns:
-        df = df[df["Quantity"].fillna(0) > 0].copy()
-
+        keep &= df["Quantity"].fillna(0) > 0
     # Missing customer IDs
     if drop_missing_customers:
-        df = df[df["CustomerID"].notna()].copy()
-
+        keep &= df["CustomerID"].notna()
     # Drop rows with broken essentials
-    df = df.dropna(subset=["InvoiceNo", "StockCode", "InvoiceDate", "UnitPrice", "Quantity"])
-
-    # InvoiceNo: either keep text (safer) or convert to int (if your PK is INT)
-    if invoice_no_as_text:
-        df["_invoice_no"] = df["InvoiceNo"].astype(str).str.strip()
-    else:
-        # Keep only numeric invoice numbers
-        inv = df["InvoiceNo"].astype(str).str.strip()
-        is_numeric = inv.str.fullmatch(r"\d+")
-        df = df[is_numeric].copy()
-        df["_invoice_no"] = inv[is_numeric].astype(int)
-
-    # CustomerID -> int
-    df["_customer_id"] = df["CustomerID"].astype("Int64")
-    df["_stock_code"] = df["StockCode"].astype(str).str.strip()
-
-    # ---- customers ----
-    customers = (
-        df[["_customer_id", "Country"]]
-        .dropna(subset=["_customer_id"])
-        .drop_duplicates(subset=["_customer_id"], keep="last")
-        .rename(columns={"_customer_id": "customer_id", "Country": "country"})
-        .sort_values("customer_id")
-        .reset_index(drop=True)
+    keep &= df[["StockCode", "InvoiceDate", "UnitPrice", "Quantity"]].notna().all(axis=1)
+    # InvoiceNo: either keep text (safer) or keep only numeric invoice numbers (if your PK is INT)
+    if not invoice_no_as_text:
+        keep &= df["InvoiceNo"].str.fullmatch(r"\d+").fillna(False)
+    df = df[keep]
+
+    return df.assign(
+        _invoice_no=df["InvoiceNo"] if invoice_no_as_text else df["InvoiceNo"].astype("int64"),
+        _customer_id=df["CustomerID"].astype("Int64"),
+        _stock_code=df["StockCode"],
+        Quantity=df["Quantity"].astype("int64"),
     )
 
-    # ---- products ----
-    # UnitPrice can vary. We'll use the most common (mode) per StockCode, fallback to median.
-    def pick_price(s: pd.Series) -> float:
-        s2 = s.dropna()
-        if s2.empty:
-            return float("nan")
-        mode = s2.mode()
-        if not mode.empty:
-            return float(mode.iloc[0])
-        return float(s2.median())
-
-    products = (
-        df.groupby("_stock_code", as_index=False)
-        .agg(
-            description=("Description", lambda x: x.dropna().iloc[0] if len(x.dropna()) else ""),
-            unit_price=("UnitPrice", pick_price),
+
+class _Folded:
+    """
+    Per-chunk partial results, folded into one frame.
+
+    Pending partials are folded into the state only once they hold as many
+    rows as the state itself. Each row is therefore re-folded O(1) times
+    on average, which keeps the total work linear in the input.
+    """
+
+    def __init__(self, fold: Callable[[pd.DataFrame], pd.DataFrame], columns: list[str]):
+        self._fold = fold
+        self._columns = columns
+        self._state: Optional[pd.DataFrame] = None
+        self._pending: list[pd.DataFrame] = []
+        self._pending_rows = 0
+
+    def add(self, part: pd.DataFrame) -> None:
+        self._pending.append(part)
+        self._pending_rows += len(part)
+        if self._pending_rows >= max(len(self._state) if self._state is not None else 0, MIN_FOLD_ROWS):
+            self._compact()
+
+    def _compact(self) -> None:
+        if self._pending:
+            parts = self._pending if self._state is None else [self._state, *self._pending]
+            self._state = self._fold(pd.concat(parts, ignore_index=True))
+            self._pending = []
+            self._pending_rows = 0
+
+    def result(self) -> pd.DataFrame:
+        self._compact()
+        return self._state if self._state is not None else pd.DataFrame(columns=self._columns)
+
+
+class SeedAccumulator:
+    """
+    Builds the dimension tables incrementally from cleaned chunks.
+
+    State is per entity, not per line: the latest country per customer, the
+    first row per invoice, the first description per stock code and a count
+    per (stock_code, unit_price) pair for the price mode. Every update is a
+    vectorized group operation whose partial result merges with the earlier
+    chunks' (in file order), so the output matches a single pass over the
+    whole file.
+    """
+
+    def __init__(self) -> None:
+        self._customers = _Folded(
+            lambda f: f.drop_duplicates(subset=["_customer_id"], keep="last"),
+            ["_customer_id", "Country"],
+        )
+        self._invoices = _Folded(
+            lambda f: f.drop_duplicates(subset=["_invoice_no"], keep="first"),
+            ["_invoice_no", "_customer_id", "InvoiceDate"],
+        )
+        # groupby.first() skips nulls, so this keeps the first non-null description per code
+        self._descriptions = _Folded(
+            lambda f: f.groupby("_stock_code", sort=False, as_index=False)["Description"].first(),
+            ["_stock_code", "Description"],
+        )
+        self._price_counts = _Folded(
+            lambda f: f.groupby(["_stock_code", "UnitPrice"], sort=False, as_index=False)["n"].sum(),
+            ["_stock_code", "UnitPrice", "n"],
         )
-        .rename(columns={"_stock_code": "stock_code"})
-        .sort_values("stock_code")
-        .reset_index(drop=True)
-    )
 
-    # ---- invoices ----
-    invoices = (
-        df[["_invoice_no", "_customer_id", "InvoiceDate"]]
-        .dropna(subset=["_invoice_no"])
-        .drop_duplicates(subset=["_invoice_no"], keep="first")
-        .rename(columns={"_invoice_no": "invoice_no", "_customer_id": "customer_id", "InvoiceDate": "invoice_date"})
-        .sort_values("invoice_no")
-        .reset_index(drop=True)
-    )
+    def add(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Fold a cleaned chunk into the state; returns its invoice_items rows."""
+        self._customers.add(
+            df[["_customer_id", "Country"]]
+            .dropna(subset=["_customer_id"])
+            .drop_duplicates(subset=["_customer_id"], keep="last")
+        )
+        self._invoices.add(
+            df[["_invoice_no", "_customer_id", "InvoiceDate"]].drop_duplicates(subset=["_invoice_no"], keep="first")
+        )
+        self._descriptions.add(df.groupby("_stock_code", sort=False, as_index=False)["Description"].first())
+        self._price_counts.add(df.groupby(["_stock_code", "UnitPrice"], sort=False).size().rename("n").reset_index())
+
+        return (
+            df[["_invoice_no", "_stock_code", "Quantity"]]
+            .rename(columns={"_invoice_no": "invoice_no", "_stock_code": "stock_code", "Quantity": "quantity"})
+            .sort_values(["invoice_no", "stock_code"], kind="stable")
+            [COLS_INVOICE_ITEMS]
+        )
 
-    # ---- invoice_items ----
-    invoice_items = (
-        df[["_invoice_no", "_stock_code", "Quantity"]]
-        .rename(
-            columns={
-                "_invoice_no": "invoice_no",
-                "_stock_code": "stock_code",
-                "Quantity": "quantity",
-            }
+    def customers(self) -> pd.DataFrame:
+        return (
+            self._customers.result()
+            .rename(columns={"_customer_id": "customer_id", "Country": "country"})
+            .sort_values("customer_id")
+            .reset_index(drop=True)
+            [COLS_CUSTOMERS]
         )
-        .sort_values(["invoice_no", "stock_code"])
-        .reset_index(drop=True)
-    )
 
-    # Align to schema column lists
-    customers = customers[COLS_CUSTOMERS]
-    products = products[COLS_PRODUCTS]
-    invoices = invoices[COLS_INVOICES]
-    invoice_items = invoice_items[COLS_INVOICE_ITEMS]
+    def products(self) -> pd.DataFrame:
+        # UnitPrice can vary. Use the most common (mode) per StockCode; ties go to the lower price.
+        prices = (
+            self._price_counts.result()
+            .sort_values(["_stock_code", "n", "UnitPrice"], ascending=[True, False, True])
+            .drop_duplicates(subset=["_stock_code"], keep="first")
+        )
+        return (
+            prices.merge(self._descriptions.result(), on="_stock_code", how="left")
+            .rename(columns={"_stock_code": "stock_code", "Description": "description", "UnitPrice": "unit_price"})
+            .fillna({"description": ""})
+            .sort_values("stock_code")
+            .reset_index(drop=True)
+            [COLS_PRODUCTS]
+        )
 
-    return customers, products, invoices, invoice_items
+    def invoices(self) -> pd.DataFrame:
+        return (
+            self._invoices.result()
+            .rename(columns={"_invoice_no": "invoice_no", "_customer_id": "customer_id", "InvoiceDate": "invoice_date"})
+            .sort_values("invoice_no")
+            .reset_index(drop=True)
+            [COLS_INVOICES]
+        )
 
 
-def write_csv(df: pd.DataFrame, out_path: Path) -> None:
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(out_path, index=False)
+def transform(
+    df: pd.DataFrame,
+    include_cancellations: bool,
+    include_returns: bool,
+    drop_missing_customers: bool,
+    invoice_no_as_text: bool,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Whole-frame transform: the streaming pipeline with a single chunk."""
+    acc = SeedAccumulator()
+    invoice_items = acc.add(
+        clean(df, include_cancellations, include_returns, drop_missing_customers, invoice_no_as_text)
+    ).reset_index(drop=True)
+    return acc.customers(), acc.products(), acc.invoices(), invoice_items
+
+
+class TableWriter:
+    """Writes a table as CSV or Parquet, either at once or appended chunk by chunk."""
+
+    def __init__(self, out_path: Path, fmt: str):
+        self.path = out_path.with_suffix(f".{fmt}")
+        self.fmt = fmt
+        self.rows = 0
+        self._parquet_writer = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.fmt == "csv":
+            df.to_csv(self.path, index=False, mode="w" if self.rows == 0 else "a", header=self.rows == 0)
+        else:
+            # Optional dependency: only needed for --format parquet
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self) -> None:
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
 
 
 def main() -> None:
@@ -165,30 +277,48 @@ def main() -> None:
     p.add_argument("--include-returns", action="store_true", help="Keep negative-quantity rows")
     p.add_argument("--keep-missing-customers", action="store_true", help="Keep rows with NULL CustomerID (not recommended)")
     p.add_argument("--invoice-no-as-text", action="store_true", help="Keep invoice_no as TEXT instead of INT")
+    p.add_argument(
+        "--chunk-size",
+        type=int,
+        help="Stream the raw file in chunks of this many rows (bounded memory; "
+        "invoice_items is then sorted within each chunk only)",
+    )
+    p.add_argument("--format", choices=["csv", "parquet"], default="csv", help="Output format (parquet needs pyarrow)")
     args = p.parse_args()
 
     raw_path = Path(args.input).expanduser().resolve()
     outdir = Path(args.outdir).expanduser().resolve()
-
-    df = load_raw(raw_path)
-    customers, products, invoices, invoice_items = transform(
-        df=df,
-        include_cancellations=args.include_cancellations,
-        include_returns=args.include_returns,
-        drop_missing_customers=not args.keep_missing_customers,
-        invoice_no_as_text=args.invoice_no_as_text,
-    )
-
-    write_csv(customers, outdir / f"{CUSTOMERS_TABLE}.csv")
-    write_csv(products, outdir / f"{PRODUCTS_TABLE}.csv")
-    write_csv(invoices, outdir / f"{INVOICES_TABLE}.csv")
-    write_csv(invoice_items, outdir / f"{INVOICE_ITEMS_TABLE}.csv")
-
-    print("Wrote:")
-    print(f"  {outdir / f'{CUSTOMERS_TABLE}.csv'}  rows={len(customers):,}")
-    print(f"  {outdir / f'{PRODUCTS_TABLE}.csv'}   rows={len(products):,}")
-    print(f"  {outdir / f'{INVOICES_TABLE}.csv'}   rows={len(invoices):,}")
-    print(f"  {outdir / f'{INVOICE_ITEMS_TABLE}.csv'} rows={len(invoice_items):,}")
+    t0 = time.monotonic()
+
+    acc = SeedAccumulator()
+    writers = {
+        name: TableWriter(outdir / f"{name}.csv", args.format)
+        for name in (CUSTOMERS_TABLE, PRODUCTS_TABLE, INVOICES_TABLE, INVOICE_ITEMS_TABLE)
+    }
+    try:
+        raw_rows = 0
+        for chunk in read_raw_chunks(raw_path, args.chunk_size):
+            raw_rows += len(chunk)
+            writers[INVOICE_ITEMS_TABLE].write(acc.add(clean(
+                chunk,
+                include_cancellations=args.include_cancellations,
+                include_returns=args.include_returns,
+                drop_missing_customers=not args.keep_missing_customers,
+                invoice_no_as_text=args.invoice_no_as_text,
+            )))
+            if args.chunk_size:
+                print(f"  read {raw_rows:,} raw rows ({time.monotonic() - t0:.1f}s)")
+
+        writers[CUSTOMERS_TABLE].write(acc.customers())
+        writers[PRODUCTS_TABLE].write(acc.products())
+        writers[INVOICES_TABLE].write(acc.invoices())
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    print(f"Wrote in {time.monotonic() - t0:.1f}s:")
+    for writer in writers.values():
+        print(f"  {writer.path}  rows={writer.rows:,}")
 
 
 if __name__ == "__main__":
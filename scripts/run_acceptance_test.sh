@@ -14,13 +14,11 @@ os.environ['DATABASE_URL'] = 'postgresql://postgres:postgres@db:5432/retail_sale
 sys.path.insert(0, '/app')
 
 from app.tools.sql_tool import run_sql
+from app.tools.template_registry import get_template_registry
 
 # Load template function
 def load_template(template_name):
-    template_path = Path('/app/sql/templates') / template_name
-    if not template_path.exists():
-        raise FileNotFoundError(f'Template not found: {template_name}')
-    return template_path.read_text(encoding='utf-8')
+    return get_template_registry().get(template_name).sql
 
 print('=' * 70)
 print('ACCEPTANCE TEST: KPI Computation')
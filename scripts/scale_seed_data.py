@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic retail dataset N times the size of the seed data.
+
+Profiles the seed CSVs written by prepare_seed_data.py (customers,
+products, invoices, invoice_items) and samples new data from the profile:
+- Seasonality: each day's expected invoice count is the source's
+  month-of-year rate times its day-of-week factor (days the source never
+  trades on, such as Saturdays, stay empty). Invoice times follow the
+  source's hour-of-day distribution.
+- Customers: each synthetic customer clones a random source customer's
+  country and activity level (invoices per customer), so the country mix
+  and the heavy tail of repeat buyers carry over.
+- Products and lines: lines per invoice and quantities follow the source
+  distributions; stock codes are drawn by their source line share (SKU
+  popularity). --product-scale > 1 adds variants of each product
+  ("85123A-2") with jittered prices and popularity.
+
+--scale multiplies the daily invoice rate and the customer count, so
+--scale 10 over the source span yields about 10x the rows of every table.
+Output is generated and written one chunk of invoices at a time, so memory
+stays bounded at any scale. The files have the same columns as db/data and
+load with the COPY statements in db/init/10_seed.sql.
+
+Usage:
+    # invoice_items.csv is not shipped in db/data; write it with
+    # prepare_seed_data.py or export it from a loaded database first:
+    psql "$DATABASE_URL" -c "\\copy invoice_items(invoice_no, stock_code, quantity) TO 'db/data/invoice_items.csv' CSV HEADER"
+
+    python scripts/scale_seed_data.py --scale 10 --outdir /tmp/retail_x10
+    python scripts/scale_seed_data.py --scale 100 --start 2009-01-01 --end 2011-12-31 --outdir /tmp/retail_x100
+
+    # A batch for scripts/ingest.py needs ids past those already loaded,
+    # otherwise the idempotent merge skips its customers and invoices
+    python scripts/scale_seed_data.py --scale 1 --start 2011-12-12 --end 2011-12-12 --outdir /tmp/day \
+        --invoice-no-start "$(psql "$DATABASE_URL" -Atc 'SELECT max(invoice_no) + 1 FROM invoices')" \
+        --customer-id-start "$(psql "$DATABASE_URL" -Atc 'SELECT max(customer_id) + 1 FROM customers')"
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Output CSV columns (same as scripts/prepare_seed_data.py)
+COLS_CUSTOMERS = ["customer_id", "country"]
+COLS_PRODUCTS = ["stock_code", "description", "unit_price"]
+COLS_INVOICES = ["invoice_no", "customer_id", "invoice_date"]
+COLS_INVOICE_ITEMS = ["invoice_no", "stock_code", "quantity"]
+
+# Default first synthetic ids (--customer-id-start / --invoice-no-start);
+# both columns are INT, so every generated id must stay below 2**31
+CUSTOMER_ID_START = 100000
+INVOICE_NO_START = 1000000
+INT_LIMIT = 2**31
+
+
+@dataclass
+class SourceProfile:
+    """Distributions measured from the seed data."""
+
+    countries: np.ndarray  # country per source customer
+    customer_activity: np.ndarray  # invoices per source customer (>= 1)
+    stock_codes: np.ndarray
+    descriptions: np.ndarray
+    unit_prices: np.ndarray
+    sku_weights: np.ndarray  # line count per stock code
+    month_rate: np.ndarray  # invoices per calendar day, by month 1..12 (index 0 unused)
+    weekday_factor: np.ndarray  # relative to the month rate, Monday=0
+    hour_weights: np.ndarray  # invoices by hour of day
+    lines_values: np.ndarray  # lines per invoice: values and counts
+    lines_counts: np.ndarray
+    quantity_values: np.ndarray  # quantity per line: values and counts
+    quantity_counts: np.ndarray
+    span_days: int
+    start: pd.Timestamp
+    end: pd.Timestamp
+    n_customers: int
+    n_invoices: int
+    n_items: int
+
+
+def load_profile(source: Path) -> SourceProfile:
+    missing = [name for name in ("customers", "products", "invoices", "invoice_items") if not (source / f"{name}.csv").exists()]
+    if missing:
+        raise FileNotFoundError(
+            f"Missing {', '.join(f'{name}.csv' for name in missing)} in {source}. "
+            "Run prepare_seed_data.py or export the tables first (see --help)."
+        )
+
+    customers = pd.read_csv(source / "customers.csv", dtype={"customer_id": "int64", "country": "string"})
+    products = pd.read_csv(
+        source / "products.csv",
+        dtype={"stock_code": "string", "description": "string", "unit_price": "float64"},
+        keep_default_na=False,
+    )
+    invoices = pd.read_csv(
+        source / "invoices.csv",
+        dtype={"invoice_no": "int64", "customer_id": "Int64"},
+        parse_dates=["invoice_date"],
+    )
+    items = pd.read_csv(
+        source / "invoice_items.csv",
+        dtype={"invoice_no": "int64", "stock_code": "string", "quantity": "int64"},
+        keep_default_na=False,
+    )
+
+    # Customers: country and invoices per customer
+    activity = invoices["customer_id"].value_counts()
+    customers = customers.assign(activity=customers["customer_id"].map(activity).fillna(0).astype("int64"))
+    customers = customers[customers["activity"] > 0]
+
+    # SKU popularity by line count; unused products keep a small weight
+    sku_lines = items["stock_code"].value_counts()
+    sku_weights = products["stock_code"].map(sku_lines).fillna(0).to_numpy(dtype="float64")
+    sku_weights = np.maximum(sku_weights, 0.5)
+
+    # Seasonality: invoices per calendar day by month, then a day-of-week factor
+    dates = invoices["invoice_date"]
+    start, end = dates.min().normalize(), dates.max().normalize()
+    calendar = pd.date_range(start, end, freq="D")
+    per_day = dates.dt.normalize().value_counts().reindex(calendar, fill_value=0)
+
+    month_rate = np.zeros(13)
+    by_month = per_day.groupby(calendar.month).mean()
+    month_rate[by_month.index.to_numpy()] = by_month.to_numpy()
+    # Months missing from a partial-year source take the overall mean
+    month_rate[1:][month_rate[1:] == 0] = per_day.mean()
+
+    expected = month_rate[calendar.month]
+    weekday_factor = np.zeros(7)
+    for weekday in range(7):
+        mask = calendar.weekday == weekday
+        if expected[mask].sum() > 0:
+            weekday_factor[weekday] = per_day.to_numpy()[mask].sum() / expected[mask].sum()
+
+    hour_weights = np.bincount(dates.dt.hour.to_numpy(), minlength=24).astype("float64")
+
+    lines = items.groupby("invoice_no").size().value_counts().sort_index()
+    quantities = items["quantity"].value_counts().sort_index()
+
+    return SourceProfile(
+        countries=customers["country"].fillna("Unknown").to_numpy(dtype=object),
+        customer_activity=customers["activity"].to_numpy(dtype="float64"),
+        stock_codes=products["stock_code"].to_numpy(dtype=object),
+        descriptions=products["description"].to_numpy(dtype=object),
+        unit_prices=products["unit_price"].to_numpy(dtype="float64"),
+        sku_weights=sku_weights,
+        month_rate=month_rate,
+        weekday_factor=weekday_factor,
+        hour_weights=hour_weights,
+        lines_values=lines.index.to_numpy(dtype="int64"),
+        lines_counts=lines.to_numpy(dtype="float64"),
+        quantity_values=quantities.index.to_numpy(dtype="int64"),
+        quantity_counts=quantities.to_numpy(dtype="float64"),
+        span_days=len(calendar),
+        start=start,
+        end=end,
+        n_customers=len(customers),
+        n_invoices=len(invoices),
+        n_items=len(items),
+    )
+
+
+class Sampler:
+    """Weighted sampling via a precomputed CDF; each draw is a vectorized binary search."""
+
+    def __init__(self, weights: np.ndarray):
+        cdf = np.cumsum(weights, dtype="float64")
+        self._cdf = cdf / cdf[-1]
+
+    def draw(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        idx = np.searchsorted(self._cdf, rng.random(n), side="right")
+        return np.minimum(idx, len(self._cdf) - 1)
+
+
+class CsvSink:
+    """Append DataFrame chunks to a CSV file, writing the header once."""
+
+    def __init__(self, path: Path, columns: list[str]):
+        self.path = path
+        self.columns = columns
+        self.rows = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "w", newline="")
+
+    def write(self, df: pd.DataFrame) -> None:
+        df[self.columns].to_csv(self._file, index=False, header=self.rows == 0, date_format="%Y-%m-%d %H:%M:%S")
+        self.rows += len(df)
+
+    def close(self) -> None:
+        if self.rows == 0:
+            self._file.write(",".join(self.columns) + "\n")
+        self._file.close()
+
+
+def write_customers(profile: SourceProfile, n_customers: int, first_id: int, rng: np.random.Generator, sink: CsvSink, chunk_size: int) -> np.ndarray:
+    """Write customers cloned from random source customers; returns their activity weights."""
+    weights = np.empty(n_customers, dtype="float64")
+    for offset in range(0, n_customers, chunk_size):
+        n = min(chunk_size, n_customers - offset)
+        clone = rng.integers(0, profile.n_customers, n)
+        weights[offset:offset + n] = profile.customer_activity[clone]
+        sink.write(pd.DataFrame({
+            "customer_id": np.arange(first_id + offset, first_id + offset + n),
+            "country": profile.countries[clone],
+        }))
+    return weights
+
+
+def write_products(profile: SourceProfile, product_scale: float, rng: np.random.Generator, sink: CsvSink) -> tuple[np.ndarray, np.ndarray]:
+    """Write the catalog (plus variants if product_scale > 1); returns stock codes and popularity weights."""
+    base = len(profile.stock_codes)
+    n_products = max(base, int(round(base * product_scale)))
+    src = np.arange(n_products) % base
+    variant = np.arange(n_products) // base
+
+    codes = pd.Series(profile.stock_codes[src], dtype=object)
+    prices = profile.unit_prices[src].copy()
+    weights = profile.sku_weights[src].copy()
+    is_variant = variant > 0
+    if is_variant.any():
+        codes[is_variant] = codes[is_variant] + "-" + pd.Series(variant[is_variant]).astype(str).to_numpy()
+        prices[is_variant] = np.round(prices[is_variant] * rng.lognormal(0.0, 0.15, is_variant.sum()), 2)
+        weights[is_variant] = weights[is_variant] * rng.lognormal(0.0, 0.5, is_variant.sum())
+
+    sink.write(pd.DataFrame({
+        "stock_code": codes,
+        "description": profile.descriptions[src],
+        "unit_price": prices,
+    }))
+    return codes.to_numpy(dtype=object), weights
+
+
+def daily_invoice_counts(profile: SourceProfile, scale: float, days: pd.DatetimeIndex, rng: np.random.Generator) -> np.ndarray:
+    expected = profile.month_rate[days.month] * profile.weekday_factor[days.weekday] * scale
+    return rng.poisson(expected)
+
+
+def generate(args: argparse.Namespace) -> None:
+    source = Path(args.source).expanduser().resolve()
+    outdir = Path(args.outdir).expanduser().resolve()
+    rng = np.random.default_rng(args.seed)
+    t0 = time.monotonic()
+
+    profile = load_profile(source)
+    start = pd.Timestamp(args.start) if args.start else profile.start
+    end = pd.Timestamp(args.end) if args.end else profile.end
+    if end < start:
+        raise ValueError(f"--end {end.date()} is before --start {start.date()}")
+    days = pd.date_range(start.normalize(), end.normalize(), freq="D")
+
+    print(
+        f"Source {source}: {profile.n_customers:,} customers, {len(profile.stock_codes):,} products, "
+        f"{profile.n_invoices:,} invoices, {profile.n_items:,} items over {profile.span_days} days"
+    )
+    print(f"Generating scale {args.scale:g} for {days[0].date()}..{days[-1].date()} ({len(days)} days) into {outdir}")
+
+    n_customers = max(1, int(round(profile.n_customers * args.scale)))
+    if args.customer_id_start + n_customers > INT_LIMIT:
+        raise ValueError(f"{n_customers:,} customers from id {args.customer_id_start:,} overflow INT; lower --scale or --customer-id-start")
+    sinks = {
+        "customers": CsvSink(outdir / "customers.csv", COLS_CUSTOMERS),
+        "products": CsvSink(outdir / "products.csv", COLS_PRODUCTS),
+        "invoices": CsvSink(outdir / "invoices.csv", COLS_INVOICES),
+        "invoice_items": CsvSink(outdir / "invoice_items.csv", COLS_INVOICE_ITEMS),
+    }
+    try:
+        customer_sampler = Sampler(write_customers(profile, n_customers, args.customer_id_start, rng, sinks["customers"], args.chunk_size))
+        codes, sku_weights = write_products(profile, args.product_scale, rng, sinks["products"])
+        sku_sampler = Sampler(sku_weights)
+        hour_sampler = Sampler(profile.hour_weights)
+        lines_sampler = Sampler(profile.lines_counts)
+        quantity_sampler = Sampler(profile.quantity_counts)
+
+        per_day = daily_invoice_counts(profile, args.scale, days, rng)
+        day_seconds = days.values.astype("datetime64[s]").astype("int64")
+        next_invoice_no = args.invoice_no_start
+        if next_invoice_no + int(per_day.sum()) > INT_LIMIT:
+            raise ValueError(
+                f"{int(per_day.sum()):,} invoices from invoice_no {next_invoice_no:,} overflow INT; "
+                "lower --scale, shorten the date span or lower --invoice-no-start"
+            )
+
+        # Group consecutive days into chunks of roughly chunk_size invoices
+        day_idx = 0
+        while day_idx < len(days):
+            chunk_end = int(np.searchsorted(np.cumsum(per_day[day_idx:]), args.chunk_size, side="left")) + day_idx + 1
+            chunk_end = min(chunk_end, len(days))
+            counts = per_day[day_idx:chunk_end]
+            n = int(counts.sum())
+            if n:
+                # Timestamps: day + sampled hour + uniform minute/second, in time order
+                day_of = np.repeat(day_seconds[day_idx:chunk_end], counts)
+                seconds = day_of + hour_sampler.draw(rng, n) * 3600 + rng.integers(0, 3600, n)
+                seconds.sort()
+                invoice_no = np.arange(next_invoice_no, next_invoice_no + n)
+                next_invoice_no += n
+                sinks["invoices"].write(pd.DataFrame({
+                    "invoice_no": invoice_no,
+                    "customer_id": args.customer_id_start + customer_sampler.draw(rng, n),
+                    "invoice_date": pd.to_datetime(seconds, unit="s"),
+                }))
+
+                lines = profile.lines_values[lines_sampler.draw(rng, n)]
+                total_lines = int(lines.sum())
+                sinks["invoice_items"].write(pd.DataFrame({
+                    "invoice_no": np.repeat(invoice_no, lines),
+                    "stock_code": codes[sku_sampler.draw(rng, total_lines)],
+                    "quantity": profile.quantity_values[quantity_sampler.draw(rng, total_lines)],
+                }))
+
+            print(
+                f"  {days[chunk_end - 1].date()}  invoices={sinks['invoices'].rows:,}  "
+                f"items={sinks['invoice_items'].rows:,}  ({time.monotonic() - t0:.1f}s)"
+            )
+            day_idx = chunk_end
+    finally:
+        for sink in sinks.values():
+            sink.close()
+
+    print(f"✅ Wrote in {time.monotonic() - t0:.1f}s:")
+    for name, sink in sinks.items():
+        print(f"  {sink.path}  rows={sink.rows:,}")
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--scale", type=float, required=True, help="Multiplier for the daily invoice rate and customer count (e.g. 10, 1000)")
+    p.add_argument("--source", default="db/data", help="Folder with the seed CSVs to profile (default: db/data)")
+    p.add_argument("--outdir", required=True, help="Output folder for the generated CSVs")
+    p.add_argument("--start", help="First invoice date, YYYY-MM-DD (default: first source date)")
+    p.add_argument("--end", help="Last invoice date, YYYY-MM-DD (default: last source date)")
+    p.add_argument("--product-scale", type=float, default=1.0, help="Catalog size multiplier; > 1 adds product variants (default: 1)")
+    p.add_argument("--chunk-size", type=int, default=50_000, help="Invoices generated and written per chunk (default: 50000)")
+    p.add_argument("--seed", type=int, default=42, help="Random seed")
+    p.add_argument("--customer-id-start", type=int, default=CUSTOMER_ID_START, help=f"First customer_id (default: {CUSTOMER_ID_START})")
+    p.add_argument("--invoice-no-start", type=int, default=INVOICE_NO_START, help=f"First invoice_no (default: {INVOICE_NO_START})")
+    args = p.parse_args()
+
+    if args.scale <= 0 or args.product_scale <= 0 or args.chunk_size <= 0:
+        p.error("--scale, --product-scale and --chunk-size must be positive")
+    if args.customer_id_start <= 0 or args.invoice_no_start <= 0:
+        p.error("--customer-id-start and --invoice-no-start must be positive")
+
+    try:
+        generate(args)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -91,13 +91,12 @@ def test_revenue_kpi():
     sql = """
     WITH base AS (
       SELECT
-        date_trunc('day', i.invoice_date) AS day,
+        date_trunc('day', ii.invoice_date) AS day,
         (ii.quantity::numeric * p.unit_price::numeric) AS line_revenue
       FROM invoice_items ii
-      JOIN invoices i ON i.invoice_no = ii.invoice_no
       JOIN products p ON p.stock_code = ii.stock_code
-      WHERE i.invoice_date >= %(start_ts)s
-        AND i.invoice_date < %(end_ts)s
+      WHERE ii.invoice_date >= %(start_ts)s
+        AND ii.invoice_date < %(end_ts)s
     )
     SELECT
       day::date AS day,
@@ -140,12 +139,11 @@ def test_units_kpi():
     
     sql = """
     SELECT
-      date_trunc('day', i.invoice_date)::date AS day,
+      date_trunc('day', ii.invoice_date)::date AS day,
       SUM(ii.quantity) AS units
     FROM invoice_items ii
-    JOIN invoices i ON i.invoice_no = ii.invoice_no
-    WHERE i.invoice_date >= %(start_ts)s
-      AND i.invoice_date < %(end_ts)s
+    WHERE ii.invoice_date >= %(start_ts)s
+      AND ii.invoice_date < %(end_ts)s
     GROUP BY 1
     ORDER BY 1
     LIMIT 10
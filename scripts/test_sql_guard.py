@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Check the read-only SQL guard against a table of queries with known verdicts.
+
+Runs _is_read_only_sql() from backend/app/tools/sql_tool.py on each case and
+compares accept/reject with the expected verdict. No database is needed.
+
+Usage:
+   python scripts/test_sql_guard.py
+   python scripts/test_sql_guard.py --verbose   # print every case, not just failures
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+# Add backend to path so we can import the sql_tool
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from app.tools.sql_tool import _is_read_only_sql
+
+ALLOW, REJECT = True, False
+
+# (description, sql, expected verdict)
+CASES = [
+    # Plain reads
+    ("select", "SELECT 1", ALLOW),
+    ("trailing semicolon", "SELECT 1;", ALLOW),
+    ("with", "WITH x AS (SELECT 1 AS n) SELECT n FROM x", ALLOW),
+    ("keyword as word prefix", "SELECT updated_at, created_by FROM t", ALLOW),
+    ("psycopg placeholder", "SELECT %(start_ts)s::timestamp", ALLOW),
+    # Keywords and separators inside literals
+    ("keyword in string", "SELECT 'drop table t; delete' AS s", ALLOW),
+    ("doubled quote in string", "SELECT 'it''s; delete' AS s", ALLOW),
+    ("E'' string with escaped quote", "SELECT E'it\\'s; delete' AS s", ALLOW),
+    ("E'' string ending in backslash", "SELECT E'\\\\' AS s, 1", ALLOW),
+    ("dollar quote", "SELECT $$; delete from t$$ AS s", ALLOW),
+    ("tagged dollar quote", "SELECT $tag$ $$; drop table t $$ $tag$ AS s", ALLOW),
+    ("keyword as quoted identifier", 'SELECT "delete" FROM t', ALLOW),
+    ("function name in string", "SELECT 'set_config' AS s", ALLOW),
+    # Comments
+    ("line comment", "SELECT 1 -- ; drop table t", ALLOW),
+    ("nested block comment", "SELECT 1 /* outer /* inner; drop */ still comment; delete */", ALLOW),
+    # Not a read
+    ("empty", "", REJECT),
+    ("only semicolon", ";", REJECT),
+    ("insert", "INSERT INTO t VALUES (1)", REJECT),
+    ("set", "SET default_transaction_read_only = off", REJECT),
+    ("explain analyze delete", "EXPLAIN ANALYZE DELETE FROM t", REJECT),
+    ("select for update", "SELECT * FROM t FOR UPDATE", REJECT),
+    # Multiple statements
+    ("two selects", "SELECT 1; SELECT 2", REJECT),
+    ("select then delete", "SELECT 1; DELETE FROM t", REJECT),
+    ("statement after string", "SELECT 'x'; DROP TABLE t", REJECT),
+    ("statement after dollar quote", "SELECT $a$ $b$ drop $a$; DROP TABLE t", REJECT),
+    ("statement after nested comment", "SELECT 1 /* /* */ */; DROP TABLE t", REJECT),
+    # Data-modifying CTEs
+    ("delete in cte", "WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d", REJECT),
+    ("update in cte", "WITH u AS (UPDATE t SET x = 1 RETURNING x) SELECT x FROM u", REJECT),
+    ("insert in cte", "WITH i AS (INSERT INTO t VALUES (1) RETURNING *) SELECT 1", REJECT),
+    # Unterminated quoting hides the rest of the text
+    ("unterminated string", "SELECT 'abc", REJECT),
+    ("unterminated E'' string", "SELECT E'abc\\'; DROP TABLE t", REJECT),
+    ("unterminated dollar quote", "SELECT $$ abc", REJECT),
+    ("unterminated nested comment", "SELECT 1 /* /* */", REJECT),
+    ("unterminated identifier", 'SELECT "abc', REJECT),
+    # Session settings that would outlive the query on a pooled connection
+    ("set_config", "SELECT set_config('default_transaction_read_only', 'off', false)", REJECT),
+    ("qualified set_config", "SELECT pg_catalog.set_config('statement_timeout', '0', false)", REJECT),
+    ("quoted set_config", "SELECT \"set_config\"('default_transaction_read_only', 'off', false)", REJECT),
+    ("unicode-escaped set_config", "SELECT U&\"set\\005fconfig\"('default_transaction_read_only', 'off', false)", REJECT),
+]
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--verbose", action="store_true", help="Print every case, not just failures")
+    args = p.parse_args()
+
+    failures = 0
+    for description, sql, expected in CASES:
+        try:
+            _is_read_only_sql(sql)
+            allowed, reason = True, ""
+        except ValueError as e:
+            allowed, reason = False, str(e)
+
+        ok = allowed == expected
+        failures += not ok
+        if args.verbose or not ok:
+            verdict = "allowed" if allowed else f"rejected ({reason})"
+            print(f"{'✅' if ok else '❌'} {description}: {verdict}")
+            if not ok:
+                print(f"   SQL: {sql}")
+
+    if failures:
+        print(f"\n❌ {failures} of {len(CASES)} cases got the wrong verdict.")
+        sys.exit(1)
+    print(f"✅ All {len(CASES)} cases got the expected verdict.")
+
+
+if __name__ == "__main__":
+    main()
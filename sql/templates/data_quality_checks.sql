@@ -5,48 +5,100 @@
 --   check_date: Date to check data freshness against (default: current date)
 --   expected_daily_rows_min: Minimum expected rows per day (default: 100)
 --   null_threshold_pct: Alert if null percentage exceeds this (default: 5.0)
+--
+-- Reads the per-day statistics in dq_daily_stats and the dimension counts in
+-- dq_table_stats (see db/migrations/005_data_quality_stats.sql). Only days
+-- waiting in rollup_dirty_days are counted from the fact tables, so the cost
+-- follows the data loaded since the last refresh, not the whole history.
 
-WITH freshness_check AS (
+WITH dirty_days AS (
+  SELECT day FROM rollup_dirty_days
+),
+dirty_invoices AS (
+  SELECT
+    d.day,
+    COUNT(*) AS invoices,
+    COUNT(*) FILTER (WHERE i.customer_id IS NULL) AS null_customer_id
+  FROM dirty_days d
+  JOIN invoices i ON i.invoice_date >= d.day AND i.invoice_date < d.day + 1
+  GROUP BY d.day
+),
+dirty_items AS (
+  SELECT
+    d.day,
+    COUNT(*) AS invoice_items,
+    COUNT(*) FILTER (WHERE ii.invoice_no IS NULL) AS null_invoice_no,
+    COUNT(*) FILTER (WHERE ii.stock_code IS NULL) AS null_stock_code,
+    COUNT(*) FILTER (WHERE ii.quantity IS NULL) AS null_quantity
+  FROM dirty_days d
+  JOIN invoice_items ii ON ii.invoice_date >= d.day AND ii.invoice_date < d.day + 1
+  GROUP BY d.day
+),
+daily_stats AS (
+  SELECT day, invoices, null_customer_id, invoice_items, null_invoice_no, null_stock_code, null_quantity, invoices_7d_avg
+  FROM dq_daily_stats
+  WHERE day NOT IN (SELECT day FROM dirty_days)
+  UNION ALL
+  SELECT
+    COALESCE(i.day, ii.day),
+    COALESCE(i.invoices, 0),
+    COALESCE(i.null_customer_id, 0),
+    COALESCE(ii.invoice_items, 0),
+    COALESCE(ii.null_invoice_no, 0),
+    COALESCE(ii.null_stock_code, 0),
+    COALESCE(ii.null_quantity, 0),
+    -- Recomputed below: a dirty day also moves the next 6 days' baselines
+    NULL
+  FROM dirty_invoices i
+  FULL JOIN dirty_items ii ON ii.day = i.day
+),
+freshness_check AS (
   SELECT
     'freshness' AS check_type,
-    MAX(i.invoice_date)::date AS latest_invoice_date,
+    MAX(day) AS latest_invoice_date,
     %(check_date)s::date AS check_date,
-    (%(check_date)s::date - MAX(i.invoice_date)::date) AS days_behind,
+    (%(check_date)s::date - MAX(day)) AS days_behind,
     CASE
-      WHEN (%(check_date)s::date - MAX(i.invoice_date)::date) <= 1 THEN 'pass'
-      WHEN (%(check_date)s::date - MAX(i.invoice_date)::date) <= 3 THEN 'warning'
+      WHEN (%(check_date)s::date - MAX(day)) <= 1 THEN 'pass'
+      WHEN (%(check_date)s::date - MAX(day)) <= 3 THEN 'warning'
       ELSE 'fail'
     END AS status
-  FROM invoices i
+  FROM daily_stats
+  WHERE invoices > 0
 ),
 row_count_check AS (
   SELECT
     'row_counts' AS check_type,
-    COUNT(*) AS total_invoices,
-    COUNT(DISTINCT DATE(i.invoice_date)) AS days_with_data,
-    COUNT(*)::numeric / NULLIF(COUNT(DISTINCT DATE(i.invoice_date)), 0) AS avg_rows_per_day,
+    COALESCE(SUM(invoices), 0) AS total_invoices,
+    COUNT(*) AS days_with_data,
+    SUM(invoices)::numeric / NULLIF(COUNT(*), 0) AS avg_rows_per_day,
     CASE
-      WHEN COUNT(*)::numeric / NULLIF(COUNT(DISTINCT DATE(i.invoice_date)), 0) >= %(expected_daily_rows_min)s THEN 'pass'
-      WHEN COUNT(*)::numeric / NULLIF(COUNT(DISTINCT DATE(i.invoice_date)), 0) >= (%(expected_daily_rows_min)s * 0.5) THEN 'warning'
+      WHEN SUM(invoices)::numeric / NULLIF(COUNT(*), 0) >= %(expected_daily_rows_min)s THEN 'pass'
+      WHEN SUM(invoices)::numeric / NULLIF(COUNT(*), 0) >= (%(expected_daily_rows_min)s * 0.5) THEN 'warning'
       ELSE 'fail'
     END AS status
-  FROM invoices i
+  FROM daily_stats
+  WHERE invoices > 0
 ),
 null_checks AS (
   SELECT
     'null_checks' AS check_type,
     -- Invoice items nulls
-    (SELECT COUNT(*) FROM invoice_items) AS total_invoice_items,
-    (SELECT COUNT(*) FROM invoice_items WHERE invoice_no IS NULL) AS null_invoice_no,
-    (SELECT COUNT(*) FROM invoice_items WHERE stock_code IS NULL) AS null_stock_code,
-    (SELECT COUNT(*) FROM invoice_items WHERE quantity IS NULL) AS null_quantity,
-    -- Invoices nulls
-    (SELECT COUNT(*) FROM invoices WHERE invoice_date IS NULL) AS null_invoice_date,
-    (SELECT COUNT(*) FROM invoices WHERE customer_id IS NULL) AS null_customer_id,
+    COALESCE(SUM(invoice_items), 0) AS total_invoice_items,
+    COALESCE(SUM(null_invoice_no), 0) AS null_invoice_no,
+    COALESCE(SUM(null_stock_code), 0) AS null_stock_code,
+    COALESCE(SUM(null_quantity), 0) AS null_quantity,
+    -- Invoices nulls; invoice_date is NOT NULL since migration 003
+    COALESCE(SUM(invoices), 0) AS total_invoices,
+    0 AS null_invoice_date,
+    COALESCE(SUM(null_customer_id), 0) AS null_customer_id,
     -- Products nulls
-    (SELECT COUNT(*) FROM products WHERE unit_price IS NULL) AS null_unit_price,
+    (SELECT row_count FROM dq_table_stats WHERE table_name = 'products') AS total_products,
+    (SELECT null_count FROM dq_table_stats WHERE table_name = 'products') AS null_unit_price,
     -- Customers nulls
-    (SELECT COUNT(*) FROM customers WHERE country IS NULL) AS null_country
+    (SELECT row_count FROM dq_table_stats WHERE table_name = 'customers') AS total_customers,
+    (SELECT null_count FROM dq_table_stats WHERE table_name = 'customers') AS null_country
+  FROM daily_stats
 ),
 null_percentages AS (
   SELECT
@@ -54,52 +106,43 @@ null_percentages AS (
     ROUND((null_invoice_no::numeric / NULLIF(total_invoice_items, 0)) * 100, 2) AS pct_null_invoice_no,
     ROUND((null_stock_code::numeric / NULLIF(total_invoice_items, 0)) * 100, 2) AS pct_null_stock_code,
     ROUND((null_quantity::numeric / NULLIF(total_invoice_items, 0)) * 100, 2) AS pct_null_quantity,
-    ROUND((null_invoice_date::numeric / NULLIF((SELECT COUNT(*) FROM invoices), 0)) * 100, 2) AS pct_null_invoice_date,
-    ROUND((null_customer_id::numeric / NULLIF((SELECT COUNT(*) FROM invoices), 0)) * 100, 2) AS pct_null_customer_id,
-    ROUND((null_unit_price::numeric / NULLIF((SELECT COUNT(*) FROM products), 0)) * 100, 2) AS pct_null_unit_price,
-    ROUND((null_country::numeric / NULLIF((SELECT COUNT(*) FROM customers), 0)) * 100, 2) AS pct_null_country,
-    CASE
-      WHEN GREATEST(
-        (null_invoice_no::numeric / NULLIF(total_invoice_items, 0)) * 100,
-        (null_stock_code::numeric / NULLIF(total_invoice_items, 0)) * 100,
-        (null_quantity::numeric / NULLIF(total_invoice_items, 0)) * 100,
-        (null_invoice_date::numeric / NULLIF((SELECT COUNT(*) FROM invoices), 0)) * 100,
-        (null_customer_id::numeric / NULLIF((SELECT COUNT(*) FROM invoices), 0)) * 100,
-        (null_unit_price::numeric / NULLIF((SELECT COUNT(*) FROM products), 0)) * 100,
-        (null_country::numeric / NULLIF((SELECT COUNT(*) FROM customers), 0)) * 100
-      ) <= %(null_threshold_pct)s THEN 'pass'
-      WHEN GREATEST(
-        (null_invoice_no::numeric / NULLIF(total_invoice_items, 0)) * 100,
-        (null_stock_code::numeric / NULLIF(total_invoice_items, 0)) * 100,
-        (null_quantity::numeric / NULLIF(total_invoice_items, 0)) * 100,
-        (null_invoice_date::numeric / NULLIF((SELECT COUNT(*) FROM invoices), 0)) * 100,
-        (null_customer_id::numeric / NULLIF((SELECT COUNT(*) FROM invoices), 0)) * 100,
-        (null_unit_price::numeric / NULLIF((SELECT COUNT(*) FROM products), 0)) * 100,
-        (null_country::numeric / NULLIF((SELECT COUNT(*) FROM customers), 0)) * 100
-      ) <= (%(null_threshold_pct)s * 2) THEN 'warning'
-      ELSE 'fail'
-    END AS status
+    ROUND((null_invoice_date::numeric / NULLIF(total_invoices, 0)) * 100, 2) AS pct_null_invoice_date,
+    ROUND((null_customer_id::numeric / NULLIF(total_invoices, 0)) * 100, 2) AS pct_null_customer_id,
+    ROUND((null_unit_price::numeric / NULLIF(total_products, 0)) * 100, 2) AS pct_null_unit_price,
+    ROUND((null_country::numeric / NULLIF(total_customers, 0)) * 100, 2) AS pct_null_country,
+    GREATEST(
+      (null_invoice_no::numeric / NULLIF(total_invoice_items, 0)) * 100,
+      (null_stock_code::numeric / NULLIF(total_invoice_items, 0)) * 100,
+      (null_quantity::numeric / NULLIF(total_invoice_items, 0)) * 100,
+      (null_invoice_date::numeric / NULLIF(total_invoices, 0)) * 100,
+      (null_customer_id::numeric / NULLIF(total_invoices, 0)) * 100,
+      (null_unit_price::numeric / NULLIF(total_products, 0)) * 100,
+      (null_country::numeric / NULLIF(total_customers, 0)) * 100
+    ) AS max_null_pct
   FROM null_checks
 ),
-daily_counts AS (
-  SELECT
-    DATE(i.invoice_date) AS date,
-    COUNT(*) AS daily_count
-  FROM invoices i
-  GROUP BY DATE(i.invoice_date)
-),
 daily_row_spikes AS (
   SELECT
     'daily_spikes' AS check_type,
-    date,
-    daily_count,
-    AVG(daily_count) OVER (ORDER BY date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) AS seven_day_avg,
+    day AS date,
+    invoices AS daily_count,
     CASE
-      WHEN daily_count > AVG(daily_count) OVER (ORDER BY date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) * 2 THEN 'spike'
-      WHEN daily_count < AVG(daily_count) OVER (ORDER BY date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW) * 0.5 THEN 'drop'
+      WHEN EXISTS (SELECT 1 FROM dirty_days)
+        THEN AVG(invoices) OVER (ORDER BY day ROWS BETWEEN 6 PRECEDING AND CURRENT ROW)
+      ELSE invoices_7d_avg
+    END AS seven_day_avg
+  FROM daily_stats
+  WHERE invoices > 0
+),
+daily_row_patterns AS (
+  SELECT
+    *,
+    CASE
+      WHEN daily_count > seven_day_avg * 2 THEN 'spike'
+      WHEN daily_count < seven_day_avg * 0.5 THEN 'drop'
       ELSE 'normal'
     END AS pattern
-  FROM daily_counts
+  FROM daily_row_spikes
 )
 SELECT
   'freshness' AS check_type,
@@ -111,27 +154,30 @@ UNION ALL
 SELECT
   'row_counts' AS check_type,
   total_invoices::text AS metric_value,
-  format('Days: %s, Avg/day: %.1f', days_with_data, avg_rows_per_day) AS detail,
+  format('Days: %%s, Avg/day: %%s', days_with_data, ROUND(avg_rows_per_day, 1)) AS detail,
   status
 FROM row_count_check
 UNION ALL
 SELECT
   'null_percentages' AS check_type,
-  format('Max null: %.2f%%', GREATEST(pct_null_invoice_no, pct_null_stock_code, pct_null_quantity, 
+  format('Max null: %%s%%%%', GREATEST(pct_null_invoice_no, pct_null_stock_code, pct_null_quantity,
          pct_null_invoice_date, pct_null_customer_id, pct_null_unit_price, pct_null_country)) AS metric_value,
-  format('Invoice items: %.2f%%, Invoices: %.2f%%, Products: %.2f%%, Customers: %.2f%%',
+  format('Invoice items: %%s%%%%, Invoices: %%s%%%%, Products: %%s%%%%, Customers: %%s%%%%',
          GREATEST(pct_null_invoice_no, pct_null_stock_code, pct_null_quantity),
          GREATEST(pct_null_invoice_date, pct_null_customer_id),
          pct_null_unit_price, pct_null_country) AS detail,
-  status
+  CASE
+    WHEN max_null_pct <= %(null_threshold_pct)s THEN 'pass'
+    WHEN max_null_pct <= (%(null_threshold_pct)s * 2) THEN 'warning'
+    ELSE 'fail'
+  END AS status
 FROM null_percentages
 UNION ALL
 SELECT
   'daily_spikes' AS check_type,
   date::text AS metric_value,
-  format('Count: %s, 7-day avg: %.1f', daily_count, seven_day_avg) AS detail,
+  format('Count: %%s, 7-day avg: %%s', daily_count, ROUND(seven_day_avg, 1)) AS detail,
   pattern AS status
-FROM daily_row_spikes
+FROM daily_row_patterns
 WHERE pattern IN ('spike', 'drop')
-ORDER BY check_type, date DESC;
-
+ORDER BY check_type, metric_value DESC;
@@ -9,21 +9,41 @@
 --   prior_end_ts: End of prior window (TIMESTAMP)
 --   kpi_type: 'revenue', 'units', or 'aov' (default: 'revenue')
 --   Note: For 'aov', calculates Average Order Value (revenue / invoice count)
+--
+-- Day-aligned windows are answered from daily_sales_rollup and
+-- daily_invoice_rollup (see db/migrations/002a_daily_sales_rollup.sql), so
+-- cost scales with the number of days rather than line items.
 
-WITH base AS (
+WITH use_rollup AS (
+  -- Read the daily rollups when every window bound falls on midnight and no
+  -- day in either window is waiting for a rollup refresh
+  SELECT (
+    %(current_start_ts)s::timestamp = date_trunc('day', %(current_start_ts)s::timestamp)
+    AND %(current_end_ts)s::timestamp = date_trunc('day', %(current_end_ts)s::timestamp)
+    AND %(prior_start_ts)s::timestamp = date_trunc('day', %(prior_start_ts)s::timestamp)
+    AND %(prior_end_ts)s::timestamp = date_trunc('day', %(prior_end_ts)s::timestamp)
+    AND NOT EXISTS (
+      SELECT 1
+      FROM rollup_dirty_days d
+      WHERE (d.day >= %(prior_start_ts)s::timestamp AND d.day < %(prior_end_ts)s::timestamp)
+         OR (d.day >= %(current_start_ts)s::timestamp AND d.day < %(current_end_ts)s::timestamp)
+    )
+  ) AS ok
+),
+base AS (
   SELECT
-    i.invoice_date,
-    i.invoice_no,
+    ii.invoice_date,
+    ii.invoice_no,
     ii.quantity,
     p.unit_price,
     (ii.quantity::numeric * p.unit_price::numeric) AS line_revenue
   FROM invoice_items ii
-  JOIN invoices i ON i.invoice_no = ii.invoice_no
   JOIN products p ON p.stock_code = ii.stock_code
-  WHERE (i.invoice_date >= %(prior_start_ts)s AND i.invoice_date < %(prior_end_ts)s)
-     OR (i.invoice_date >= %(current_start_ts)s AND i.invoice_date < %(current_end_ts)s)
+  WHERE ((ii.invoice_date >= %(prior_start_ts)s AND ii.invoice_date < %(prior_end_ts)s)
+     OR (ii.invoice_date >= %(current_start_ts)s AND ii.invoice_date < %(current_end_ts)s))
+    AND NOT (SELECT ok FROM use_rollup)
 ),
-period_metrics AS (
+line_metrics AS (
   SELECT
     -- Current period
     SUM(CASE WHEN invoice_date >= %(current_start_ts)s AND invoice_date < %(current_end_ts)s
@@ -40,6 +60,42 @@ period_metrics AS (
     COUNT(DISTINCT CASE WHEN invoice_date >= %(prior_start_ts)s AND invoice_date < %(prior_end_ts)s
       THEN invoice_no END) AS prior_invoices
   FROM base
+),
+rollup_sales AS (
+  SELECT
+    SUM(CASE WHEN day >= %(current_start_ts)s::timestamp AND day < %(current_end_ts)s::timestamp
+      THEN revenue ELSE 0 END) AS current_revenue,
+    SUM(CASE WHEN day >= %(current_start_ts)s::timestamp AND day < %(current_end_ts)s::timestamp
+      THEN units::numeric ELSE 0 END) AS current_units,
+    SUM(CASE WHEN day >= %(prior_start_ts)s::timestamp AND day < %(prior_end_ts)s::timestamp
+      THEN revenue ELSE 0 END) AS prior_revenue,
+    SUM(CASE WHEN day >= %(prior_start_ts)s::timestamp AND day < %(prior_end_ts)s::timestamp
+      THEN units::numeric ELSE 0 END) AS prior_units
+  FROM daily_sales_rollup
+  WHERE ((day >= %(prior_start_ts)s::timestamp AND day < %(prior_end_ts)s::timestamp)
+     OR (day >= %(current_start_ts)s::timestamp AND day < %(current_end_ts)s::timestamp))
+    AND (SELECT ok FROM use_rollup)
+),
+rollup_invoices AS (
+  SELECT
+    COALESCE(SUM(CASE WHEN day >= %(current_start_ts)s::timestamp AND day < %(current_end_ts)s::timestamp
+      THEN invoice_count END), 0) AS current_invoices,
+    COALESCE(SUM(CASE WHEN day >= %(prior_start_ts)s::timestamp AND day < %(prior_end_ts)s::timestamp
+      THEN invoice_count END), 0) AS prior_invoices
+  FROM daily_invoice_rollup
+  WHERE ((day >= %(prior_start_ts)s::timestamp AND day < %(prior_end_ts)s::timestamp)
+     OR (day >= %(current_start_ts)s::timestamp AND day < %(current_end_ts)s::timestamp))
+    AND (SELECT ok FROM use_rollup)
+),
+period_metrics AS (
+  SELECT current_revenue, current_units, current_invoices, prior_revenue, prior_units, prior_invoices
+  FROM line_metrics
+  WHERE NOT (SELECT ok FROM use_rollup)
+  UNION ALL
+  SELECT s.current_revenue, s.current_units, n.current_invoices, s.prior_revenue, s.prior_units, n.prior_invoices
+  FROM rollup_sales s
+  CROSS JOIN rollup_invoices n
+  WHERE (SELECT ok FROM use_rollup)
 )
 SELECT
   -- Select metric based on kpi_type (caller should use appropriate column)
@@ -11,7 +11,7 @@
 
 WITH base AS (
   SELECT
-    i.invoice_date,
+    ii.invoice_date,
     ii.quantity,
     p.unit_price,
     (ii.quantity::numeric * p.unit_price::numeric) AS line_revenue,
@@ -19,11 +19,14 @@ WITH base AS (
     p.stock_code,
     i.customer_id
   FROM invoice_items ii
-  JOIN invoices i ON i.invoice_no = ii.invoice_no
+  JOIN invoices i ON i.invoice_no = ii.invoice_no AND i.invoice_date = ii.invoice_date
   JOIN products p ON p.stock_code = ii.stock_code
   LEFT JOIN customers c ON c.customer_id = i.customer_id
-  WHERE (i.invoice_date >= %(prior_start_ts)s AND i.invoice_date < %(prior_end_ts)s)
-     OR (i.invoice_date >= %(current_start_ts)s AND i.invoice_date < %(current_end_ts)s)
+  WHERE ((ii.invoice_date >= %(prior_start_ts)s AND ii.invoice_date < %(prior_end_ts)s)
+     OR (ii.invoice_date >= %(current_start_ts)s AND ii.invoice_date < %(current_end_ts)s))
+    -- Same windows on invoices, so its partitions are pruned too
+    AND ((i.invoice_date >= %(prior_start_ts)s AND i.invoice_date < %(prior_end_ts)s)
+     OR (i.invoice_date >= %(current_start_ts)s AND i.invoice_date < %(current_end_ts)s))
 ),
 dimension_values AS (
   SELECT
@@ -7,21 +7,40 @@
 --   current_end_ts: End of current window (TIMESTAMP)
 --   prior_start_ts: Start of prior window (TIMESTAMP)
 --   prior_end_ts: End of prior window (TIMESTAMP)
+--
+-- Day-aligned windows are answered from daily_sales_rollup
+-- (see db/migrations/002a_daily_sales_rollup.sql).
 
-WITH base AS (
+WITH use_rollup AS (
+  -- Read the daily rollup when every window bound falls on midnight and no
+  -- day in either window is waiting for a rollup refresh
+  SELECT (
+    %(current_start_ts)s::timestamp = date_trunc('day', %(current_start_ts)s::timestamp)
+    AND %(current_end_ts)s::timestamp = date_trunc('day', %(current_end_ts)s::timestamp)
+    AND %(prior_start_ts)s::timestamp = date_trunc('day', %(prior_start_ts)s::timestamp)
+    AND %(prior_end_ts)s::timestamp = date_trunc('day', %(prior_end_ts)s::timestamp)
+    AND NOT EXISTS (
+      SELECT 1
+      FROM rollup_dirty_days d
+      WHERE (d.day >= %(prior_start_ts)s::timestamp AND d.day < %(prior_end_ts)s::timestamp)
+         OR (d.day >= %(current_start_ts)s::timestamp AND d.day < %(current_end_ts)s::timestamp)
+    )
+  ) AS ok
+),
+base AS (
   SELECT
     p.stock_code,
-    i.invoice_date,
+    ii.invoice_date,
     ii.quantity,
     p.unit_price,
     (ii.quantity::numeric * p.unit_price::numeric) AS line_revenue
   FROM invoice_items ii
-  JOIN invoices i ON i.invoice_no = ii.invoice_no
   JOIN products p ON p.stock_code = ii.stock_code
-  WHERE (i.invoice_date >= %(prior_start_ts)s AND i.invoice_date < %(prior_end_ts)s)
-     OR (i.invoice_date >= %(current_start_ts)s AND i.invoice_date < %(current_end_ts)s)
+  WHERE ((ii.invoice_date >= %(prior_start_ts)s AND ii.invoice_date < %(prior_end_ts)s)
+     OR (ii.invoice_date >= %(current_start_ts)s AND ii.invoice_date < %(current_end_ts)s))
+    AND NOT (SELECT ok FROM use_rollup)
 ),
-product_metrics AS (
+product_windows AS (
   SELECT
     stock_code,
     -- Current period
@@ -33,22 +52,43 @@ product_metrics AS (
     SUM(CASE WHEN invoice_date >= %(prior_start_ts)s AND invoice_date < %(prior_end_ts)s
       THEN quantity ELSE 0 END) AS prior_quantity,
     SUM(CASE WHEN invoice_date >= %(prior_start_ts)s AND invoice_date < %(prior_end_ts)s
-      THEN line_revenue ELSE 0 END) AS prior_revenue,
+      THEN line_revenue ELSE 0 END) AS prior_revenue
+  FROM base
+  GROUP BY stock_code
+  UNION ALL
+  SELECT
+    stock_code,
+    SUM(CASE WHEN day >= %(current_start_ts)s::timestamp AND day < %(current_end_ts)s::timestamp
+      THEN units ELSE 0 END)::bigint AS current_quantity,
+    SUM(CASE WHEN day >= %(current_start_ts)s::timestamp AND day < %(current_end_ts)s::timestamp
+      THEN revenue ELSE 0 END) AS current_revenue,
+    SUM(CASE WHEN day >= %(prior_start_ts)s::timestamp AND day < %(prior_end_ts)s::timestamp
+      THEN units ELSE 0 END)::bigint AS prior_quantity,
+    SUM(CASE WHEN day >= %(prior_start_ts)s::timestamp AND day < %(prior_end_ts)s::timestamp
+      THEN revenue ELSE 0 END) AS prior_revenue
+  FROM daily_sales_rollup
+  WHERE ((day >= %(prior_start_ts)s::timestamp AND day < %(prior_end_ts)s::timestamp)
+     OR (day >= %(current_start_ts)s::timestamp AND day < %(current_end_ts)s::timestamp))
+    AND (SELECT ok FROM use_rollup)
+  GROUP BY stock_code
+),
+product_metrics AS (
+  SELECT
+    stock_code,
+    current_quantity,
+    current_revenue,
+    prior_quantity,
+    prior_revenue,
     -- Average prices
-    CASE 
-      WHEN SUM(CASE WHEN invoice_date >= %(current_start_ts)s AND invoice_date < %(current_end_ts)s THEN quantity ELSE 0 END) > 0
-      THEN SUM(CASE WHEN invoice_date >= %(current_start_ts)s AND invoice_date < %(current_end_ts)s THEN line_revenue ELSE 0 END) /
-           SUM(CASE WHEN invoice_date >= %(current_start_ts)s AND invoice_date < %(current_end_ts)s THEN quantity ELSE 0 END)
+    CASE
+      WHEN current_quantity > 0 THEN current_revenue / current_quantity
       ELSE NULL
     END AS current_avg_price,
-    CASE 
-      WHEN SUM(CASE WHEN invoice_date >= %(prior_start_ts)s AND invoice_date < %(prior_end_ts)s THEN quantity ELSE 0 END) > 0
-      THEN SUM(CASE WHEN invoice_date >= %(prior_start_ts)s AND invoice_date < %(prior_end_ts)s THEN line_revenue ELSE 0 END) /
-           SUM(CASE WHEN invoice_date >= %(prior_start_ts)s AND invoice_date < %(prior_end_ts)s THEN quantity ELSE 0 END)
+    CASE
+      WHEN prior_quantity > 0 THEN prior_revenue / prior_quantity
       ELSE NULL
     END AS prior_avg_price
-  FROM base
-  GROUP BY stock_code
+  FROM product_windows
 ),
 decomposition AS (
   SELECT
@@ -1,13 +1,41 @@
 -- sql/revenue_by_day.sql
-WITH base AS (
+-- Daily revenue between two timestamps
+--
+-- Parameters:
+--   start_ts: Start of the range (TIMESTAMP)
+--   end_ts: End of the range, exclusive (TIMESTAMP)
+
+WITH use_rollup AS (
+  -- Day-aligned windows are answered from daily_sales_rollup (see
+  -- db/migrations/002a_daily_sales_rollup.sql): read it when both bounds
+  -- fall on midnight and no day in the window is waiting for a rollup refresh
+  SELECT (
+    %(start_ts)s::timestamp = date_trunc('day', %(start_ts)s::timestamp)
+    AND %(end_ts)s::timestamp = date_trunc('day', %(end_ts)s::timestamp)
+    AND NOT EXISTS (
+      SELECT 1
+      FROM rollup_dirty_days d
+      WHERE d.day >= %(start_ts)s::timestamp AND d.day < %(end_ts)s::timestamp
+    )
+  ) AS ok
+),
+base AS (
   SELECT
-    date_trunc('day', i.invoice_date) AS day,
+    date_trunc('day', ii.invoice_date) AS day,
     (ii.quantity::numeric * p.unit_price::numeric) AS line_revenue
   FROM invoice_items ii
-  JOIN invoices i ON i.invoice_no = ii.invoice_no
   JOIN products p ON p.stock_code = ii.stock_code
-  WHERE i.invoice_date >= %(start_ts)s
-    AND i.invoice_date <  %(end_ts)s
+  WHERE ii.invoice_date >= %(start_ts)s
+    AND ii.invoice_date <  %(end_ts)s
+    AND NOT (SELECT ok FROM use_rollup)
+  UNION ALL
+  SELECT
+    day::timestamp AS day,
+    revenue AS line_revenue
+  FROM daily_sales_rollup
+  WHERE day >= %(start_ts)s::timestamp
+    AND day <  %(end_ts)s::timestamp
+    AND (SELECT ok FROM use_rollup)
 )
 SELECT
   day::date AS day,
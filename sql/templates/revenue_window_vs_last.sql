@@ -1,21 +1,63 @@
 -- sql/revenue_window_vs_last.sql
-WITH base AS (
+-- Revenue of the current window against the prior window, with absolute and percent change
+--
+-- Parameters:
+--   current_start_ts: Start of current window (TIMESTAMP)
+--   current_end_ts: End of current window (TIMESTAMP)
+--   prior_start_ts: Start of prior window (TIMESTAMP)
+--   prior_end_ts: End of prior window (TIMESTAMP)
+
+WITH use_rollup AS (
+  -- Day-aligned windows are answered from daily_sales_rollup (see
+  -- db/migrations/002a_daily_sales_rollup.sql): read it when every window
+  -- bound falls on midnight and no day in either window is waiting for a
+  -- rollup refresh
+  SELECT (
+    %(current_start_ts)s::timestamp = date_trunc('day', %(current_start_ts)s::timestamp)
+    AND %(current_end_ts)s::timestamp = date_trunc('day', %(current_end_ts)s::timestamp)
+    AND %(prior_start_ts)s::timestamp = date_trunc('day', %(prior_start_ts)s::timestamp)
+    AND %(prior_end_ts)s::timestamp = date_trunc('day', %(prior_end_ts)s::timestamp)
+    AND NOT EXISTS (
+      SELECT 1
+      FROM rollup_dirty_days d
+      WHERE (d.day >= %(prior_start_ts)s::timestamp AND d.day < %(prior_end_ts)s::timestamp)
+         OR (d.day >= %(current_start_ts)s::timestamp AND d.day < %(current_end_ts)s::timestamp)
+    )
+  ) AS ok
+),
+base AS (
   SELECT
-    i.invoice_date,
+    ii.invoice_date,
     (ii.quantity::numeric * p.unit_price::numeric) AS line_revenue
   FROM invoice_items ii
-  JOIN invoices i ON i.invoice_no = ii.invoice_no
   JOIN products p ON p.stock_code = ii.stock_code
-  WHERE (i.invoice_date >= %(prior_start_ts)s AND i.invoice_date < %(prior_end_ts)s)
-     OR (i.invoice_date >= %(current_start_ts)s AND i.invoice_date < %(current_end_ts)s)
+  WHERE ((ii.invoice_date >= %(prior_start_ts)s AND ii.invoice_date < %(prior_end_ts)s)
+     OR (ii.invoice_date >= %(current_start_ts)s AND ii.invoice_date < %(current_end_ts)s))
+    AND NOT (SELECT ok FROM use_rollup)
 ),
-agg AS (
+line_agg AS (
   SELECT
     SUM(CASE WHEN invoice_date >= %(current_start_ts)s AND invoice_date < %(current_end_ts)s
       THEN line_revenue ELSE 0 END) AS current_revenue,
     SUM(CASE WHEN invoice_date >= %(prior_start_ts)s AND invoice_date < %(prior_end_ts)s
       THEN line_revenue ELSE 0 END) AS prior_revenue
   FROM base
+),
+rollup_agg AS (
+  SELECT
+    SUM(CASE WHEN day >= %(current_start_ts)s::timestamp AND day < %(current_end_ts)s::timestamp
+      THEN revenue ELSE 0 END) AS current_revenue,
+    SUM(CASE WHEN day >= %(prior_start_ts)s::timestamp AND day < %(prior_end_ts)s::timestamp
+      THEN revenue ELSE 0 END) AS prior_revenue
+  FROM daily_sales_rollup
+  WHERE ((day >= %(prior_start_ts)s::timestamp AND day < %(prior_end_ts)s::timestamp)
+     OR (day >= %(current_start_ts)s::timestamp AND day < %(current_end_ts)s::timestamp))
+    AND (SELECT ok FROM use_rollup)
+),
+agg AS (
+  SELECT current_revenue, prior_revenue FROM line_agg WHERE NOT (SELECT ok FROM use_rollup)
+  UNION ALL
+  SELECT current_revenue, prior_revenue FROM rollup_agg WHERE (SELECT ok FROM use_rollup)
 )
 SELECT
   ROUND(current_revenue, 2) AS current_revenue,
@@ -0,0 +1,105 @@
+-- sql/templates/window_comparison_cube.sql
+-- Window comparison cube: both windows scanned once, aggregated at every grain
+-- the RCA templates report on
+--
+-- One GROUPING SETS pass over the line items of the current and prior
+-- windows replaces the separate scans of kpi_trend_window_comparison,
+-- top_contributors, mix_shift_by_dimension and price_volume_decomposition.
+-- Contribution ranks and row filters are computed over the aggregated rows;
+-- app/tools/window_cube.py derives the four outputs from them.
+--
+-- grouping_id identifies the grain (1 = column aggregated away):
+--   7 = totals, 3 = country, 5 = stock_code, 6 = customer_id,
+--   0 = country x stock_code x customer_id
+-- Rows come back ordered by grain, then by absolute revenue change.
+--
+-- Parameters:
+--   current_start_ts: Start of current window (TIMESTAMP)
+--   current_end_ts: End of current window (TIMESTAMP)
+--   prior_start_ts: Start of prior window (TIMESTAMP)
+--   prior_end_ts: End of prior window (TIMESTAMP)
+
+WITH base AS (
+  SELECT
+    ii.invoice_no,
+    (ii.invoice_date >= %(current_start_ts)s AND ii.invoice_date < %(current_end_ts)s) AS in_current,
+    (ii.invoice_date >= %(prior_start_ts)s AND ii.invoice_date < %(prior_end_ts)s) AS in_prior,
+    ii.quantity,
+    (ii.quantity::numeric * p.unit_price::numeric) AS line_revenue,
+    c.country,
+    p.stock_code,
+    p.description,
+    i.customer_id
+  FROM invoice_items ii
+  JOIN invoices i ON i.invoice_no = ii.invoice_no AND i.invoice_date = ii.invoice_date
+  JOIN products p ON p.stock_code = ii.stock_code
+  LEFT JOIN customers c ON c.customer_id = i.customer_id
+  WHERE ((ii.invoice_date >= %(prior_start_ts)s AND ii.invoice_date < %(prior_end_ts)s)
+     OR (ii.invoice_date >= %(current_start_ts)s AND ii.invoice_date < %(current_end_ts)s))
+    -- Same windows on invoices, so its partitions are pruned too
+    AND ((i.invoice_date >= %(prior_start_ts)s AND i.invoice_date < %(prior_end_ts)s)
+     OR (i.invoice_date >= %(current_start_ts)s AND i.invoice_date < %(current_end_ts)s))
+),
+grains AS (
+  SELECT
+    GROUPING(country, stock_code, customer_id) AS grouping_id,
+    CASE WHEN GROUPING(country) = 0 THEN COALESCE(country, 'Unknown') END AS country,
+    stock_code,
+    customer_id::text AS customer_id,
+    CASE WHEN GROUPING(stock_code) = 0 THEN MAX(description) END AS product_description,
+    SUM(CASE WHEN in_current THEN line_revenue ELSE 0 END) AS current_revenue,
+    SUM(CASE WHEN in_prior THEN line_revenue ELSE 0 END) AS prior_revenue,
+    SUM(CASE WHEN in_current THEN quantity ELSE 0 END) AS current_quantity,
+    SUM(CASE WHEN in_prior THEN quantity ELSE 0 END) AS prior_quantity,
+    COUNT(DISTINCT CASE WHEN in_current THEN invoice_no END) AS current_invoices,
+    COUNT(DISTINCT CASE WHEN in_prior THEN invoice_no END) AS prior_invoices
+  FROM base
+  GROUP BY GROUPING SETS (
+    (),
+    (country),
+    (stock_code),
+    (customer_id),
+    (country, stock_code, customer_id)
+  )
+),
+flagged AS (
+  SELECT
+    *,
+    current_revenue - prior_revenue AS revenue_change,
+    current_quantity - prior_quantity AS units_change,
+    -- Rows kept by top_contributors and by mix_shift_by_dimension
+    (current_revenue != 0 OR prior_revenue != 0 OR current_quantity != 0 OR prior_quantity != 0) AS is_contributor,
+    (current_revenue > 0 OR prior_revenue > 0 OR current_quantity > 0 OR prior_quantity > 0) AS is_mix_row
+  FROM grains
+)
+SELECT
+  grouping_id,
+  country,
+  stock_code,
+  customer_id,
+  product_description,
+  current_revenue,
+  prior_revenue,
+  current_quantity,
+  prior_quantity,
+  current_invoices,
+  prior_invoices,
+  revenue_change,
+  units_change,
+  is_contributor,
+  is_mix_row,
+  -- Ranks within each grain over aggregated rows only (no second scan);
+  -- the ascending rank mirrors the descending one, saving a sort per metric
+  revenue_rank_positive,
+  COUNT(*) OVER grain - revenue_rank_positive + 1 AS revenue_rank_negative,
+  units_rank_positive,
+  COUNT(*) OVER grain - units_rank_positive + 1 AS units_rank_negative
+FROM (
+  SELECT
+    *,
+    ROW_NUMBER() OVER (PARTITION BY grouping_id, is_contributor ORDER BY revenue_change DESC) AS revenue_rank_positive,
+    ROW_NUMBER() OVER (PARTITION BY grouping_id, is_contributor ORDER BY units_change DESC) AS units_rank_positive
+  FROM flagged
+) ranked
+WINDOW grain AS (PARTITION BY grouping_id, is_contributor)
+ORDER BY grouping_id, ABS(revenue_change) DESC, ABS(units_change) DESC;